@@ -0,0 +1,315 @@
+import struct
+import asyncio
+import logging
+import discord
+
+
+_CMD_LOGIN = 3
+_CMD_RUN = 2
+_CMD_RESPONSE = 0
+_MAX_PAYLOAD = 4096
+
+
+class FakeRCONServer:
+    """
+    Local stand-in for a Minecraft RCON server speaking
+    the Source RCON protocol. It simulates the 'list'
+    and 'whitelist' commands on an in-memory state and
+    delays every response by latency seconds.
+    """
+
+    def __init__(self, password: str = 'bench', latency: float = 0.0,
+                 slots: int = 20):
+        self.password = password
+        self.latency = latency
+        self.slots = slots
+        self.online = []
+        self.whitelist = set()
+        self.commands = 0
+        self.reloads = 0
+        self._server = None
+        self._writers = set()
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.sockets[0].getsockname()[:2]
+        return '{}:{}'.format(host, port)
+
+    async def start(self, port: int = 0):
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', port)
+
+    def close(self):
+        """
+        Stops listening and drops all open connections,
+        like a restarting server.
+        """
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+
+    def execute(self, cmd: str) -> str:
+        self.commands += 1
+        parts = cmd.split()
+        if parts == ['list']:
+            return 'There are {}/{} players online:{}'.format(
+                len(self.online), self.slots, ', '.join(self.online))
+        if parts[:1] != ['whitelist'] or len(parts) < 2:
+            return 'Unknown command'
+        sub = parts[1]
+        if sub == 'add' and len(parts) == 3:
+            if parts[2].lower() in self.whitelist:
+                return 'Player is already whitelisted'
+            self.whitelist.add(parts[2].lower())
+            return 'Added {} to the whitelist'.format(parts[2])
+        if sub == 'remove' and len(parts) == 3:
+            if parts[2].lower() not in self.whitelist:
+                return 'Player is not whitelisted'
+            self.whitelist.discard(parts[2].lower())
+            return 'Removed {} from the whitelist'.format(parts[2])
+        if sub == 'list':
+            if not self.whitelist:
+                return 'There are no whitelisted players'
+            return 'There are {} whitelisted players: {}'.format(
+                len(self.whitelist), ', '.join(sorted(self.whitelist)))
+        if sub == 'reload':
+            self.reloads += 1
+            return 'Reloaded the whitelist'
+        return 'Unknown command'
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        authed = False
+        self._writers.add(writer)
+        try:
+            while True:
+                ident, cmd, payload = await _read_packet(reader)
+                if cmd == _CMD_LOGIN:
+                    authed = payload == self.password
+                    _write_packet(writer, ident if authed else -1, _CMD_RUN, '')
+                elif not authed:
+                    _write_packet(writer, -1, _CMD_RESPONSE, '')
+                elif cmd == _CMD_RUN:
+                    if self.latency > 0:
+                        await asyncio.sleep(self.latency)
+                    res = self.execute(payload)
+                    chunks = [res[i:i + _MAX_PAYLOAD]
+                              for i in range(0, len(res), _MAX_PAYLOAD)] or ['']
+                    for chunk in chunks:
+                        _write_packet(writer, ident, _CMD_RESPONSE, chunk)
+                else:
+                    _write_packet(writer, ident, _CMD_RESPONSE,
+                                  'Unknown request {}'.format(hex(cmd)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.error('fake rcon server: {}'.format(e))
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+async def _read_packet(reader: asyncio.StreamReader) -> (int, int, str):
+    ln = struct.unpack('<i', await reader.readexactly(4))[0]
+    data = await reader.readexactly(ln)
+    ident, cmd = struct.unpack('<ii', data[:8])
+    return ident, cmd, data[8:-2].decode('utf-8')
+
+
+def _write_packet(writer: asyncio.StreamWriter, ident: int, cmd: int, payload: str):
+    data = struct.pack('<ii', ident, cmd) + payload.encode('utf-8') + b'\x00\x00'
+    writer.write(struct.pack('<i', len(data)) + data)
+
+
+################
+# FAKE DISCORD #
+################
+
+class _Typing:
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _NotFoundResponse:
+
+    status = 404
+    reason = 'Not Found'
+
+
+class FakeMessage:
+
+    _next_id = 1
+
+    def __init__(self, channel, content=None, embed=None, deleted=False):
+        self.id = FakeMessage._next_id
+        FakeMessage._next_id += 1
+        self.channel = channel
+        self.content = content
+        self.embed = embed
+        self.deleted = deleted
+        self.edits = 0
+
+    async def edit(self, content=None, embed=None):
+        if self.channel.latency > 0:
+            await asyncio.sleep(self.channel.latency)
+        self.channel.api_calls += 1
+        if self.deleted:
+            raise discord.NotFound(_NotFoundResponse(), 'Unknown Message')
+        self.edits += 1
+        if content is not None:
+            self.content = content
+        if embed is not None:
+            self.embed = embed
+
+
+class FakeChannel:
+
+    def __init__(self, id: int, latency: float = 0.0):
+        self.id = id
+        self.latency = latency
+        self.api_calls = 0
+        self.messages = {}
+
+    async def send(self, content=None, embed=None, **kwargs):
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        self.api_calls += 1
+        msg = FakeMessage(self, content, embed)
+        self.messages[msg.id] = msg
+        return msg
+
+    async def fetch_message(self, id: int):
+        self.api_calls += 1
+        return self.messages[id]
+
+    def get_partial_message(self, id: int):
+        return self.messages.get(id) or FakeMessage(self, deleted=True)
+
+    def typing(self):
+        return _Typing()
+
+
+class FakeRole:
+
+    def __init__(self, id: int):
+        self.id = id
+
+
+class FakeMember:
+
+    def __init__(self, id: int, guild=None, roles=()):
+        self.id = id
+        self.guild = guild
+        self.roles = list(roles)
+        self.name = 'user{}'.format(id)
+        self.display_name = self.name
+
+
+class FakeGuild:
+
+    def __init__(self, id: int, owner_id: int = 1, latency: float = 0.0):
+        self.id = id
+        self.owner_id = owner_id
+        self.owner = FakeMember(owner_id, self)
+        self.channels = {id * 10: FakeChannel(id * 10, latency)}
+        self.members = {}
+
+    @property
+    def status_channel(self) -> FakeChannel:
+        return self.channels[self.id * 10]
+
+    def get_channel(self, id: int):
+        return self.channels.get(id)
+
+    def get_member(self, id: int):
+        return self.members.get(id)
+
+
+class FakeBot:
+
+    def __init__(self, guilds: list):
+        self.guilds = guilds
+        self.presence_changes = 0
+
+    async def change_presence(self, **kwargs):
+        self.presence_changes += 1
+
+    def is_closed(self) -> bool:
+        return False
+
+    async def wait_until_ready(self):
+        pass
+
+
+class FakeContext:
+
+    def __init__(self, bot: FakeBot, guild: FakeGuild, author: FakeMember,
+                 channel: FakeChannel = None):
+        self.bot = bot
+        self.guild = guild
+        self.author = author
+        self.channel = channel or FakeChannel(0)
+        self.message = self
+        self.sent = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        msg = await self.channel.send(content, embed=embed)
+        self.sent.append(msg)
+        return msg
+
+    async def send_help(self, *args):
+        pass
+
+    def typing(self):
+        return _Typing()
+
+
+def guild_payload(id: int, members: int, owner_id: int = 1) -> dict:
+    """
+    Returns a GUILD_CREATE gateway payload of a guild
+    with one text channel and the given number of
+    members, as received once the guild is chunked.
+    """
+    return {
+        'id': str(id),
+        'name': 'guild{}'.format(id),
+        'owner_id': str(owner_id),
+        'member_count': members,
+        'large': True,
+        'roles': [{'id': str(id), 'name': '@everyone', 'permissions': '0',
+                   'position': 0, 'color': 0, 'hoist': False,
+                   'managed': False, 'mentionable': False}],
+        'channels': [{'id': str(id * 10), 'type': 0, 'name': 'general',
+                      'position': 0, 'permission_overwrites': []}],
+        'members': [{
+            'user': {'id': str(10000 + i), 'username': 'user{}'.format(i),
+                     'discriminator': '0001', 'avatar': None},
+            'roles': [], 'joined_at': '2020-01-01T00:00:00+00:00',
+            'nick': None, 'deaf': False, 'mute': False, 'flags': 0,
+        } for i in range(members)],
+    }
+
+
+def message_payload(id: int, guild_id: int, author_id: int) -> dict:
+    """
+    Returns a MESSAGE_CREATE gateway payload of a
+    message in the channel of guild_payload.
+    """
+    return {
+        'id': str(id),
+        'channel_id': str(guild_id * 10),
+        'guild_id': str(guild_id),
+        'author': {'id': str(author_id), 'username': 'user{}'.format(author_id),
+                   'discriminator': '0001', 'avatar': None},
+        'member': {'roles': [], 'joined_at': '2020-01-01T00:00:00+00:00',
+                   'nick': None, 'deaf': False, 'mute': False, 'flags': 0},
+        'content': 'message {}'.format(id),
+        'timestamp': '2020-01-01T00:00:00+00:00',
+        'edited_timestamp': None,
+        'tts': False, 'mention_everyone': False, 'mentions': [],
+        'mention_roles': [], 'attachments': [], 'embeds': [],
+        'pinned': False, 'type': 0,
+    }
@@ -0,0 +1,362 @@
+"""
+Runs load scenarios against the bot with a local fake
+RCON server and stubbed Discord objects, so no network
+access is required. Every scenario runs in its own
+process, so the peak RSS is reported per scenario.
+Results are printed as JSON.
+
+    $ python3 benchmarks/run.py --scenario bind_burst --output results.json
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import asyncio
+import logging
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from discord.ext import commands
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'discordwhitelist'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import FakeRCONServer, FakeBot, FakeGuild, FakeMember, FakeContext, \
+    guild_payload, message_payload  # noqa: E402
+from database import SQLite, AsyncSQLite  # noqa: E402
+from mcserver import Server, ServerConfig, ServerRegistry, PlayerList  # noqa: E402
+from shared import Batcher  # noqa: E402
+from status import StatusUpdater  # noqa: E402
+from cogs import WhitelistMgmt, Admin  # noqa: E402
+from main import bot_options  # noqa: E402
+
+
+OWNER_ID = 1
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))
+    return values[idx]
+
+
+def result(scenario: str, operations: int, duration: float, latencies: list, **extra) -> dict:
+    res = {
+        'scenario': scenario,
+        'operations': operations,
+        'duration_s': round(duration, 4),
+        'throughput_ops': round(operations / duration, 2) if duration > 0 else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+    res.update(extra)
+    return res
+
+
+class Environment:
+    """
+    Fake server, managed server registry and
+    database shared by the scenarios.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.tmp_dir = tempfile.mkdtemp(prefix='d2mcwl-bench-')
+        self.db_file = os.path.join(self.tmp_dir, 'database.db')
+
+    def seed_bindings(self, count: int) -> list:
+        names = ['player{}'.format(i) for i in range(count)]
+        db = SQLite(self.db_file, autocommit=False)
+        for i, name in enumerate(names):
+            db.set_witelist(str(10000 + i), name)
+        db.commit()
+        db.close()
+        return names
+
+    async def start(self):
+        self.server = FakeRCONServer(latency=self.args.rcon_latency)
+        await self.server.start()
+        self.db = AsyncSQLite(self.db_file, commit_delay=self.args.db_commit_delay)
+        self.servers = ServerRegistry([Server(
+            ServerConfig('bench', self.server.address, self.server.password),
+            self.args.cmd_interval, self.args.reload_window)])
+        await self.servers.connect_all()
+        await self.servers.register(self.db)
+        self.servers.start(asyncio.get_event_loop())
+
+    async def close(self):
+        self.servers.stop()
+        self.server.close()
+        self.db.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+#############
+# SCENARIOS #
+#############
+
+async def bench_bind_burst(env: Environment) -> dict:
+    n = env.args.bind_users
+    guild = FakeGuild(1, OWNER_ID)
+    bot = FakeBot([guild])
+    cog = WhitelistMgmt(bot, env.servers, env.db)
+    latencies = []
+
+    async def bind(i: int):
+        ctx = FakeContext(bot, guild, FakeMember(10000 + i, guild))
+        started = time.perf_counter()
+        await WhitelistMgmt.bind.callback(cog, ctx, 'player{}'.format(i))
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[bind(i) for i in range(n)])
+    duration = time.perf_counter() - started
+
+    # Binds are acknowledged before the outbox has
+    # applied them, so wait for the server to catch up.
+    while len(env.server.whitelist) < n and time.perf_counter() - started < 60:
+        await asyncio.sleep(0.01)
+    applied = time.perf_counter() - started
+
+    return result('bind_burst', n, duration, latencies,
+                  applied_s=round(applied, 4),
+                  rcon_commands=env.server.commands,
+                  whitelisted=len(env.server.whitelist))
+
+
+async def _bench_admin_sync(env: Environment, scenario: str, cmd) -> dict:
+    guild = FakeGuild(1, OWNER_ID)
+    bot = FakeBot([guild])
+    cog = Admin(bot, env.servers, env.db)
+    ctx = FakeContext(bot, guild, guild.owner)
+
+    started = time.perf_counter()
+    await cmd.callback(cog, ctx)
+    duration = time.perf_counter() - started
+
+    return result(scenario, env.args.sync_size, duration, [duration],
+                  rcon_commands=env.server.commands,
+                  discord_calls=ctx.channel.api_calls,
+                  whitelisted=len(env.server.whitelist))
+
+
+async def bench_sync(env: Environment) -> dict:
+    return await _bench_admin_sync(env, 'sync', Admin.sync)
+
+
+async def bench_purge(env: Environment) -> dict:
+    env.server.whitelist = set(env.seeded)
+    return await _bench_admin_sync(env, 'purge', Admin.purge)
+
+
+async def bench_status_ticks(env: Environment) -> dict:
+    guilds = [FakeGuild(i + 1, OWNER_ID, latency=env.args.discord_latency)
+              for i in range(env.args.status_guilds)]
+    for guild in guilds:
+        await env.db.set_status_channel(guild.id, guild.status_channel.id)
+
+    bot = FakeBot(guilds)
+    updater = StatusUpdater(bot, env.db)
+    latencies = []
+
+    for tick in range(env.args.status_ticks):
+        # The player list changes every other tick.
+        names = ['player{}'.format(i) for i in range(tick // 2 % 5)]
+        started = time.perf_counter()
+        await updater.update({'bench': PlayerList(len(names), 20, names)})
+        latencies.append(time.perf_counter() - started)
+
+    return result('status_ticks', len(latencies), sum(latencies), latencies,
+                  guilds=len(guilds),
+                  discord_calls=sum(g.status_channel.api_calls for g in guilds) +
+                  bot.presence_changes)
+
+
+async def bench_status_cold_start(env: Environment) -> dict:
+    guilds = [FakeGuild(i + 1, OWNER_ID, latency=env.args.discord_latency)
+              for i in range(env.args.status_guilds)]
+    for guild in guilds:
+        await env.db.set_status_channel(guild.id, guild.status_channel.id)
+
+    bot = FakeBot(guilds)
+    players = {'bench': PlayerList(0, 20, [])}
+    await StatusUpdater(bot, env.db).update(players)
+    calls_before = sum(g.status_channel.api_calls for g in guilds)
+
+    # A restarted bot only knows the status message ids
+    # from the database and recovers the messages from
+    # them on the first update.
+    started = time.perf_counter()
+    await env.db.warm_guild_configs()
+    await StatusUpdater(bot, env.db).update({'bench': PlayerList(1, 20, ['player0'])})
+    duration = time.perf_counter() - started
+
+    return result('status_cold_start', len(guilds), duration, [duration],
+                  discord_calls=sum(g.status_channel.api_calls for g in guilds) -
+                  calls_before)
+
+
+async def bench_member_prune(env: Environment) -> dict:
+    n = env.args.prune_size
+    env.server.whitelist = set(env.seeded)
+
+    # Same as on_member_remove in main.
+    async def unbind_departed(discord_ids: list):
+        _, entries = await env.db.unbind_witelist_many(discord_ids, env.servers.ids)
+        if entries:
+            env.servers.notify_outbox()
+
+    departures = Batcher(unbind_departed, env.args.member_remove_window)
+
+    started = time.perf_counter()
+    for i in range(n):
+        departures.add(str(10000 + i))
+    while env.server.whitelist and time.perf_counter() - started < 120:
+        await asyncio.sleep(0.01)
+    duration = time.perf_counter() - started
+
+    return result('member_prune', n, duration, [duration],
+                  rcon_commands=env.server.commands,
+                  reloads=env.server.reloads,
+                  whitelisted=len(env.server.whitelist))
+
+
+async def _bench_guild_cache(env: Environment, scenario: str, options: dict) -> dict:
+    n, m = env.args.guild_members, env.args.guild_messages
+    guild_data = guild_payload(1, n, OWNER_ID)
+    messages = [message_payload(i + 1, 1, 10000 + i % max(n, 1)) for i in range(m)]
+
+    # The gateway events are parsed by the state of a bot
+    # which is never logged in, with events dropped.
+    bot = commands.Bot(command_prefix='>', **options)
+    state = bot._connection
+    state.dispatch = lambda *args, **kwargs: None
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+
+    started = time.perf_counter()
+    guild = state._add_guild_from_data(guild_data)
+    for data in messages:
+        state.parse_message_create(data)
+    duration = time.perf_counter() - started
+
+    del guild_data, messages
+    gc.collect()
+    cache_kb = (tracemalloc.get_traced_memory()[0] - before) // 1024
+    if not tracing:
+        tracemalloc.stop()
+
+    return result(scenario, n + m, duration, [duration],
+                  cached_members=len(guild.members),
+                  cached_messages=len(state._messages or ()),
+                  cache_kb=cache_kb)
+
+
+async def bench_guild_cache(env: Environment) -> dict:
+    return await _bench_guild_cache(env, 'guild_cache', bot_options(False))
+
+
+async def bench_guild_cache_low_memory(env: Environment) -> dict:
+    return await _bench_guild_cache(env, 'guild_cache_low_memory', bot_options(True))
+
+
+SCENARIOS = {
+    'bind_burst': (bench_bind_burst, 0),
+    'sync': (bench_sync, 'sync_size'),
+    'purge': (bench_purge, 'sync_size'),
+    'status_ticks': (bench_status_ticks, 0),
+    'status_cold_start': (bench_status_cold_start, 0),
+    'member_prune': (bench_member_prune, 'prune_size'),
+    'guild_cache': (bench_guild_cache, 0),
+    'guild_cache_low_memory': (bench_guild_cache_low_memory, 0),
+}
+
+
+async def run_scenario(name: str, args) -> dict:
+    fn, seed_arg = SCENARIOS[name]
+    env = Environment(args)
+    env.seeded = env.seed_bindings(getattr(args, seed_arg)) if seed_arg else []
+    await env.start()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    try:
+        res = await fn(env)
+        if args.trace_memory:
+            res['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        if args.trace_memory:
+            tracemalloc.stop()
+        await env.close()
+
+    res['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return res
+
+
+def run_scenario_process(name: str, args) -> dict:
+    logging.basicConfig(level=logging.WARNING)
+    return asyncio.get_event_loop().run_until_complete(run_scenario(name, args))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--scenario', '-s', action='append', choices=sorted(SCENARIOS),
+        help='Scenario to run, may be passed multiple times (def: all)')
+    parser.add_argument(
+        '--output', '-o', default=None, type=str,
+        help='Write results as JSON to this file instead of stdout')
+    parser.add_argument(
+        '--trace-memory', default=False, action='store_true',
+        help='Trace Python allocations to report the peak per scenario ' +
+             '(slows down the scenarios)')
+    parser.add_argument('--bind-users', default=1000, type=int)
+    parser.add_argument('--sync-size', default=10000, type=int)
+    parser.add_argument('--status-guilds', default=1000, type=int)
+    parser.add_argument('--status-ticks', default=20, type=int)
+    parser.add_argument('--prune-size', default=1000, type=int)
+    parser.add_argument('--member-remove-window', default=1.0, type=float)
+    parser.add_argument('--guild-members', default=100000, type=int)
+    parser.add_argument('--guild-messages', default=5000, type=int)
+    parser.add_argument('--rcon-latency', default=0.001, type=float)
+    parser.add_argument('--discord-latency', default=0.0, type=float)
+    parser.add_argument('--cmd-interval', default=0.0, type=float)
+    parser.add_argument('--reload-window', default=0.1, type=float)
+    parser.add_argument('--db-commit-delay', default=0.05, type=float)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    # ru_maxrss is the peak of the whole process, so
+    # every scenario gets a freshly spawned one.
+    ctx = multiprocessing.get_context('spawn')
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        with ProcessPoolExecutor(1, mp_context=ctx) as pool:
+            results.append(pool.submit(run_scenario_process, name, args).result())
+
+    out = json.dumps({'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(out + '\n')
+    else:
+        print(out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import sys
+import time
+import logging
+import argparse
+from database import SQLite, FORMATS, IMPORT_POLICIES, ImportConflictException, \
+    guess_format, read_bindings
+
+
+def parse_args():
+    """
+    Initializes command line arguments of the
+    offline bulk import and export and parses them.
+    """
+    parser = argparse.ArgumentParser(
+        description='Import or export the whitelist bindings of the bot database ' +
+                    'while the bot is stopped. Imported bindings are applied to ' +
+                    'the servers by the sync command.')
+    parser.add_argument(
+        'action', choices=('import', 'export'),
+        help='Whether to import bindings from or export them to FILE')
+    parser.add_argument(
+        'file', type=str,
+        help='The csv, json or jsonl file, - for stdin or stdout')
+    parser.add_argument(
+        '--format', '-f', default=None, choices=FORMATS,
+        help='The file format (def: guessed from the file extension)')
+    parser.add_argument(
+        '--policy', default='skip', choices=IMPORT_POLICIES,
+        help='How to import bindings of minecraft IDs which are bound to ' +
+             'another account (def: skip)')
+    parser.add_argument(
+        '--batch-size', default=10000, type=int,
+        help='The number of bindings imported per transaction (def: 10000)')
+    parser.add_argument(
+        '--db-file', '-db', default='database.db', type=str,
+        help='Set database file location (def: database.db)')
+
+    args = parser.parse_args()
+    if args.format is None:
+        if args.file == '-':
+            parser.error('--format is required when reading stdin or writing stdout')
+        try:
+            args.format = guess_format(args.file)
+        except ValueError as e:
+            parser.error(str(e))
+
+    return args
+
+
+def main():
+    args = parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s | %(levelname)s | %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        stream=sys.stderr)
+
+    # The resident index of the bot is not needed
+    # and would grow with the imported bindings.
+    db = SQLite(args.db_file, index=False)
+    start = time.monotonic()
+
+    try:
+        if args.action == 'export':
+            if args.file == '-':
+                n = db.export_whitelist(sys.stdout, args.format)
+            else:
+                with open(args.file, 'w', encoding='utf-8', newline='') as f:
+                    n = db.export_whitelist(f, args.format)
+            logging.info('Exported {} bindings in {:.1f}s'.format(
+                n, time.monotonic() - start))
+            return
+
+        if args.file == '-':
+            report = db.import_whitelist(
+                read_bindings(sys.stdin, args.format), args.policy, args.batch_size)
+        else:
+            with open(args.file, 'r', encoding='utf-8-sig', newline='') as f:
+                report = db.import_whitelist(
+                    read_bindings(f, args.format), args.policy, args.batch_size)
+        logging.info('Imported {} bindings in {:.1f}s:\n{}'.format(
+            report.imported, time.monotonic() - start, report.summary()))
+    except ImportConflictException as e:
+        logging.error('Import aborted: {}'.format(e))
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
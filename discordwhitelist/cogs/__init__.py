@@ -1,3 +1,4 @@
 # flake8: noqa
 from .whitelistmgmt import *
 from .admin import *
+from .stats import *
@@ -1,36 +1,76 @@
+import io
+import os
 import sys
 import asyncio
-import logging
-from typing import Optional
-from discord import Role, TextChannel, Message
+import tempfile
+from collections import OrderedDict
+from typing import Optional, Callable
+from discord import Role, TextChannel, File, Member
 from discord.ext.commands import command, check, Cog, \
     Context, MissingRequiredArgument, BadArgument, CheckFailure
-from asyncrcon import AsyncRCON
-from database import SQLite
+from database import AsyncSQLite, FORMATS, IMPORT_POLICIES, ImportConflictException, \
+    guess_format, read_bindings
+from mcserver import ServerRegistry, Server, SyncPlan, SyncPipeline, SyncReport, \
+    Reconciler
+from shared import is_dry_run, is_bulk, truncate, ProgressReporter
+
+
+_SYNC_MAX_RETRIES = 3
 
 
 def is_guild_owner() -> bool:
     async def predicate(ctx: Context) -> bool:
-        return ctx.author.id == ctx.guild.owner.id
+        return ctx.author.id == ctx.guild.owner_id
     return check(predicate)
 
 
 class Admin(Cog, name='Admin'):
 
-    _rcon: AsyncRCON
-    _db: SQLite
+    _servers: ServerRegistry
+    _db: AsyncSQLite
     _sudo_enabled: bool
+    _reconciler: Reconciler
+    _reload: Callable
+    _operations: dict
 
-    def __init__(self, bot, rcon: AsyncRCON, db: SQLite, sudo_enabled=False):
+    def __init__(self, bot, servers: ServerRegistry, db: AsyncSQLite, sudo_enabled=False,
+                 reconciler: Reconciler = None, reload: Callable = None):
         self.bot = bot
-        self._rcon = rcon
+        self._servers = servers
         self._db = db
         self._sudo_enabled = sudo_enabled
+        self._reconciler = reconciler
+        self._reload = reload
+        # guild id -> ProgressReporter of the running sync or
+        # purge, None for operations which can not be cancelled
+        self._operations = {}
+
+    async def _begin_operation(self, ctx: Context,
+                               progress: ProgressReporter = None) -> bool:
+        """
+        Registers a long running operation of the guild,
+        which is unregistered by _end_operation, or
+        returns false if another one is running.
+        """
+        if ctx.guild.id in self._operations:
+            await ctx.send(':warning:  Another sync, purge or import is running, ' +
+                           'wait for it or `cancel` it first.')
+            return False
+        self._operations[ctx.guild.id] = progress
+        return True
+
+    def _end_operation(self, ctx: Context):
+        self._operations.pop(ctx.guild.id, None)
 
     async def _check_admin(self, ctx: Context) -> bool:
-        role_id = self._db.get_admin_role(ctx.guild.id)
-        admin = (role_id and role_id in [str(r.id) for r in ctx.author.roles])
-        admin = admin or ctx.author.id == ctx.guild.owner.id
+        role_id = await self._db.get_admin_role(ctx.guild.id)
+        author = ctx.author
+        if role_id and not isinstance(author, Member):
+            # Without member cache the author may only be
+            # known as user.
+            author = await ctx.guild.fetch_member(author.id)
+        admin = (role_id and role_id in [str(r.id) for r in author.roles])
+        admin = admin or ctx.author.id == ctx.guild.owner_id
         if not admin:
             await ctx.send(':warning:  Insufficient permission.')
         return admin
@@ -43,7 +83,7 @@ class Admin(Cog, name='Admin'):
     @is_guild_owner()
     async def adminrole(self, ctx: Context, role: Role):
         async with ctx.typing():
-            self._db.set_admin_role(ctx.guild.id, role.id)
+            await self._db.set_admin_role(ctx.guild.id, role.id)
             await ctx.send(
                 ':white_check_mark:  Role ' +
                 '`{}` is now set as admin role.'.format(role.name))
@@ -61,7 +101,8 @@ class Admin(Cog, name='Admin'):
 
     @command(
         brief='Execute RCON command',
-        description='Execute RCON command directly on server')
+        description='Execute RCON command directly on all servers or, ' +
+                    'if the first argument is @<server>, on the given server.')
     async def sudo(self, ctx: Context, *cmd):
         async with ctx.typing():
             if not await self._check_admin(ctx):
@@ -71,9 +112,23 @@ class Admin(Cog, name='Admin'):
                 await ctx.send(':warning:  Sudo is disbaled by configuration.')
                 return
 
-            res = await self._rcon.command(' '.join(cmd))
-            await ctx.send(
-                'Result:\n```{}```'.format(res or '[empty]'))
+            servers = list(self._servers)
+            if cmd and cmd[0].startswith('@'):
+                servers = [s for s in servers if s.name == cmd[0][1:]]
+                if not servers:
+                    await ctx.send(':warning:  Unknown server `{}`.'.format(cmd[0][1:]))
+                    return
+                cmd = cmd[1:]
+
+            results = await self._servers.broadcast(
+                lambda s: s.scheduler.command(' '.join(cmd)), servers)
+
+            for name, res in results.items():
+                if isinstance(res, Exception):
+                    res = 'error: {}'.format(res)
+                head = 'Result' if len(self._servers) == 1 else 'Result of **{}**'.format(name)
+                await ctx.send(truncate(
+                    '{}:\n```{}```'.format(head, res or '[empty]'), suffix='```'))
 
     # restart
 
@@ -88,6 +143,48 @@ class Admin(Cog, name='Admin'):
         await ctx.bot.close()
         sys.exit(1)
 
+    # reload
+
+    @command(
+        brief='Reload the configuration',
+        description='Re-reads the config files and applies the changed settings ' +
+                    'without restarting the bot. Only servers whose RCON or ' +
+                    'server settings changed are reconnected.')
+    async def reload(self, ctx: Context):
+        if not await self._check_admin(ctx):
+            return
+
+        if self._reload is None:
+            await ctx.send(':warning:  Reloading is not available.')
+            return
+
+        # The reloaded cog replaces this one, which would
+        # lose track of running operations.
+        if self._operations:
+            await ctx.send(':warning:  A sync, purge or import is running, ' +
+                           'wait for it to finish first.')
+            return
+
+        async with ctx.typing():
+            try:
+                changed, restart = await self._reload()
+            except Exception as e:
+                await ctx.send(':warning:  Reload failed, the previous ' +
+                               'configuration stays active: ```{}```'.format(e))
+                return
+
+        if not changed and not restart:
+            await ctx.send(':white_check_mark:  Reloaded, nothing changed.')
+            return
+
+        content = ':white_check_mark:  Reloaded.'
+        if changed:
+            content += '\nApplied: {}'.format(', '.join('`{}`'.format(c) for c in changed))
+        if restart:
+            content += '\n:warning:  Changed options which require a restart: {}'.format(
+                ', '.join('`{}`'.format(o) for o in restart))
+        await ctx.send(truncate(content))
+
     # statuschan
 
     @command(
@@ -100,7 +197,7 @@ class Admin(Cog, name='Admin'):
         if channel is None:
             channel = ctx.message.channel
 
-        self._db.set_status_channel(ctx.guild.id, channel.id)
+        await self._db.set_status_channel(ctx.guild.id, channel.id)
 
         await ctx.send(':white_check_mark:  Set <#{}> as status channel.'.format(channel.id))
 
@@ -113,7 +210,7 @@ class Admin(Cog, name='Admin'):
         if not await self._check_admin(ctx):
             return
 
-        self._db.set_disabled(ctx.guild.id, True)
+        await self._db.set_disabled(ctx.guild.id, True)
 
         await ctx.send(':white_check_mark:  Whitelist binding is now **disabled**.')
 
@@ -126,7 +223,7 @@ class Admin(Cog, name='Admin'):
         if not await self._check_admin(ctx):
             return
 
-        self._db.set_disabled(ctx.guild.id, False)
+        await self._db.set_disabled(ctx.guild.id, False)
 
         await ctx.send(':white_check_mark:  Whitelist binding is now **enabled**.')
 
@@ -134,60 +231,276 @@ class Admin(Cog, name='Admin'):
 
     @command(
         brief='Sync server whitelist',
-        description='Sync the database mapped whitelist to the servers whitelist')
-    async def sync(self, ctx: Context):
+        description='Sync the database mapped whitelist to the whitelist of all servers. ' +
+                    'Only missing entries are added and all entries which are not ' +
+                    'bound are removed, including those added on the server console, ' +
+                    'which the background reconciliation keeps by default. ' +
+                    'Pass --dry-run to only display the changes ' +
+                    'and --bulk to write the servers whitelist.json directly.')
+    async def sync(self, ctx: Context, *argv):
         if not await self._check_admin(ctx):
             return
 
-        whitelist_map = self._db.get_whitelist()
-        synced = 0
-        to_sync = len(whitelist_map)
+        await self._run_sync(ctx, argv, SyncPlan.sync, 'Synced')
+
+    # purge
+
+    @command(
+        brief='Purge server whitelist',
+        description='Remove all database mapped users from the whitelist of all servers. ' +
+                    'Pass --dry-run to only display the changes ' +
+                    'and --bulk to write the servers whitelist.json directly.')
+    async def purge(self, ctx: Context, *argv):
+        if not await self._check_admin(ctx):
+            return
 
-        msg: Message = await ctx.send(':clock1:  Synced {} of {} users...'.format(synced, to_sync))
+        await self._run_sync(ctx, argv, SyncPlan.purge, 'Purged')
 
-        map_tpls = list(whitelist_map.items())
+    # reconcile
 
-        while synced < to_sync:
-            await asyncio.sleep(0.5)
-            try:
-                await self._rcon.command('whitelist add {}'.format(map_tpls[synced][1]))
-                synced += 1
-            except Exception as e:
-                logging.error('Failed syncing: {}'.format(e))
-                continue
-            await msg.edit(content=':clock1:  Synced {} of {} users...'.format(synced, to_sync))
+    @command(
+        brief='Show reconciliation stats',
+        description='Show the stats of the last background reconciliation of the ' +
+                    'server whitelists with the database. Pass --now to start ' +
+                    'a run immediately.')
+    async def reconcile(self, ctx: Context, *argv):
+        if not await self._check_admin(ctx):
+            return
+
+        if self._reconciler is None:
+            await ctx.send(':warning:  Reconciliation is disabled by configuration.')
+            return
 
-        await self._rcon.command('whitelist reload')
+        if '--now' in argv:
+            if self._reconciler.running:
+                await ctx.send(':warning:  A reconciliation is already running.')
+            else:
+                self._reconciler.trigger()
+                await ctx.send(':clock1:  Reconciliation started.')
+            return
 
-        await msg.edit(content=':white_check_mark:  Synced {} of {} users sccessfully.'.format(synced, to_sync))
+        report = self._reconciler.last_report
+        if report is None:
+            await ctx.send(':information_source:  No reconciliation has run yet.')
+            return
 
-    # purge
+        head = 'Reconciliation running' if self._reconciler.running else 'Last reconciliation'
+        await ctx.send(truncate(':information_source:  {}:\n{}'.format(head, report.summary())))
+
+    # cancel
 
     @command(
-        brief='Purge server whitelist',
-        description='Sync the database mapped whitelist to the servers whitelist')
-    async def purge(self, ctx: Context):
+        brief='Cancel sync or purge',
+        description='Cancel the sync or purge running in this guild. Entries ' +
+                    'which were already applied are kept.')
+    async def cancel(self, ctx: Context):
         if not await self._check_admin(ctx):
             return
 
-        whitelist_map = self._db.get_whitelist()
-        synced = 0
-        to_sync = len(whitelist_map)
+        if ctx.guild.id not in self._operations:
+            await ctx.send(':warning:  No sync or purge is running.')
+            return
+
+        progress = self._operations[ctx.guild.id]
+        if progress is None:
+            await ctx.send(':warning:  The running operation can not be cancelled.')
+            return
+
+        progress.cancel()
+        await ctx.send(':stop_sign:  Cancelling after the current entries...')
+
+    # import
+
+    @command(
+        name='import',
+        brief='Import bindings',
+        description='Import the bindings of the attached csv, json or jsonl file. ' +
+                    'Bindings of minecraft IDs which are bound to another account ' +
+                    'are skipped (def), replace the other binding or abort the ' +
+                    'import. The servers are not changed, run sync afterwards.')
+    async def import_(self, ctx: Context, policy: str = 'skip'):
+        if not await self._check_admin(ctx):
+            return
+
+        if policy not in IMPORT_POLICIES:
+            await ctx.send(':warning:  Policy must be one of {}.'.format(
+                ', '.join(IMPORT_POLICIES)))
+            return
+
+        if not ctx.message.attachments:
+            await ctx.send(':warning:  Attach a csv, json or jsonl file to import.')
+            return
+
+        attachment = ctx.message.attachments[0]
+        try:
+            fmt = guess_format(attachment.filename)
+        except ValueError as e:
+            await ctx.send(':warning:  {}.'.format(e))
+            return
+
+        if not await self._begin_operation(ctx):
+            return
+        try:
+            async with ctx.typing():
+                f = io.StringIO((await attachment.read()).decode('utf-8-sig'))
+                report = await self._db.import_whitelist(read_bindings(f, fmt), policy)
+        except ImportConflictException as e:
+            await ctx.send(':warning:  Import aborted: {}.'.format(e))
+            return
+        except ValueError as e:
+            await ctx.send(':warning:  Failed reading `{}`: {}'.format(
+                attachment.filename, e))
+            return
+        finally:
+            self._end_operation(ctx)
+
+        await ctx.send(':white_check_mark:  Imported {} bindings:\n{}\n'.format(
+            report.imported, report.summary()) +
+            'Run `sync` to apply them to the servers.')
 
-        msg: Message = await ctx.send(':clock1:  Purged {} of {} users...'.format(synced, to_sync))
+    # export
 
-        map_tpls = list(whitelist_map.items())
+    @command(
+        brief='Export bindings',
+        description='Export all bindings as csv (def), json or jsonl file.')
+    async def export(self, ctx: Context, fmt: str = 'csv'):
+        if not await self._check_admin(ctx):
+            return
+
+        if fmt not in FORMATS:
+            await ctx.send(':warning:  Format must be one of {}.'.format(', '.join(FORMATS)))
+            return
 
-        while synced < to_sync:
-            await asyncio.sleep(0.5)
+        async with ctx.typing():
+            fd, fileloc = tempfile.mkstemp(suffix='.' + fmt)
             try:
-                await self._rcon.command('whitelist remove {}'.format(map_tpls[synced][1]))
-                synced += 1
-            except Exception as e:
-                logging.error('Failed syncing: {}'.format(e))
-                continue
-            await msg.edit(content=':clock1:  Purged {} of {} users...'.format(synced, to_sync))
+                with open(fd, 'w', encoding='utf-8', newline='') as f:
+                    n = await self._db.export_whitelist(f, fmt)
+                await ctx.send(
+                    ':white_check_mark:  Exported {} bindings.'.format(n),
+                    file=File(fileloc, filename='whitelist.' + fmt))
+            finally:
+                os.remove(fileloc)
+
+    async def _run_sync(self, ctx: Context, argv: list, make_plan, verb: str):
+        bulk = is_bulk(argv)
+        servers = self._servers.with_wl_file if bulk else list(self._servers)
+        if bulk and not servers:
+            await ctx.send(':warning:  Bulk mode requires the server ' +
+                           'directory to be configured.')
+            return
+
+        loop = asyncio.get_event_loop()
+
+        async def fetch_names(server: Server) -> set:
+            if bulk:
+                return await loop.run_in_executor(None, server.wl_file.names)
+            return await server.scheduler.whitelist(fresh=True)
 
-        await self._rcon.command('whitelist reload')
+        async with ctx.typing():
+            db_names = (await self._db.get_whitelist()).values()
+            fetched = await self._servers.broadcast(fetch_names, servers)
+
+        plans = OrderedDict()
+        for server in servers:
+            res = fetched[server.name]
+            plans[server.name] = res if isinstance(res, Exception) \
+                else make_plan(db_names, res)
+
+        if is_dry_run(argv):
+            reports = OrderedDict()
+            for name, plan in plans.items():
+                if isinstance(plan, Exception):
+                    reports[name] = plan
+                    continue
+                reports[name] = SyncReport(dry_run=True)
+                reports[name].added = plan.to_add
+                reports[name].removed = plan.to_remove
+            await ctx.send(truncate(':information_source:  Dry run, no changes ' +
+                                    'were applied:\n{}'.format(self._summaries(reports))))
+            return
+
+        total = sum(len(p) for p in plans.values() if not isinstance(p, Exception))
+
+        if bulk:
+            # Offline mode UUIDs depend on the spelling
+            # of the names, which the plans lower case.
+            cased_names = {n.lower(): n for n in db_names}
+
+            async def apply_file(server: Server) -> SyncReport:
+                plan = plans[server.name]
+                if isinstance(plan, Exception):
+                    raise plan
+                report = await loop.run_in_executor(
+                    None, server.wl_file.apply, plan, cased_names)
+                await server.scheduler.reload()
+                return report
 
-        await msg.edit(content=':white_check_mark:  Purged {} of {} users sccessfully.'.format(synced, to_sync))
+            if not await self._begin_operation(ctx):
+                return
+            try:
+                async with ctx.typing():
+                    reports = await self._servers.broadcast(apply_file, servers)
+            finally:
+                self._end_operation(ctx)
+            failed = any(isinstance(r, Exception) or r.failed for r in reports.values())
+            icon = ':warning:' if failed else ':white_check_mark:'
+            await ctx.send(truncate('{}  {} {} entries via whitelist.json:\n{}'.format(
+                icon, verb, total, self._summaries(reports))))
+            return
+
+        progress = ProgressReporter(ctx, verb, total)
+        if not await self._begin_operation(ctx, progress):
+            return
+        try:
+            async with progress:
+                reports = await self._servers.broadcast(
+                    lambda s: self._apply_rcon(s, plans[s.name], progress), servers)
+
+                applied = sum(len(r.added) + len(r.removed) for r in reports.values()
+                              if not isinstance(r, Exception))
+                failed = any(isinstance(r, Exception) or r.failed for r in reports.values())
+                icon = ':warning:' if failed else ':white_check_mark:'
+                head = '{}  {} {} of {} entries'.format(icon, verb, applied, total)
+                if progress.cancelled:
+                    head = ':stop_sign:  Cancelled, {} {} of {} entries'.format(
+                        verb.lower(), applied, total)
+                await progress.finish(truncate('{}:\n{}'.format(
+                    head, self._summaries(reports))))
+        finally:
+            self._end_operation(ctx)
+
+    async def _apply_rcon(self, server: Server, plan: SyncPlan,
+                          progress: ProgressReporter) -> SyncReport:
+        if isinstance(plan, Exception):
+            raise plan
+
+        async def on_progress(done: int, total: int):
+            progress.update(progress.done + 1)
+
+        pipeline = SyncPipeline(
+            server.scheduler.command, max_retries=_SYNC_MAX_RETRIES)
+        report = await pipeline.run(plan, on_progress, lambda: progress.cancelled)
+
+        if report.added or report.removed:
+            await server.scheduler.reload()
+        return report
+
+    def _summaries(self, reports: OrderedDict) -> str:
+        """
+        Joins the sync reports of the servers, prefixing
+        every summary with the server name if more than
+        one server is managed.
+        """
+        if len(self._servers) == 1 and len(reports) == 1:
+            report = next(iter(reports.values()))
+            if not isinstance(report, Exception):
+                return report.summary()
+
+        parts = []
+        for name, report in reports.items():
+            if isinstance(report, Exception):
+                parts.append('**{}**: failed: `{}`'.format(name, report))
+            else:
+                parts.append('**{}**:\n{}'.format(name, report.summary()))
+        return '\n'.join(parts)
@@ -0,0 +1,92 @@
+import time
+from discord import Embed
+from discord.ext.commands import command, Cog, Context
+from shared import lower, mentioned_id, format_duration, EMBED_COLOR
+from database import AsyncSQLite
+from mcserver import ServerRegistry
+from status import PlayerHistory, day_of
+
+
+_TOP_SIZE = 10
+_MAX_TOP_DAYS = 365
+
+
+class Stats(Cog, name='Stats'):
+
+    _servers: ServerRegistry
+    _db: AsyncSQLite
+    _history: PlayerHistory
+
+    def __init__(self, bot, servers: ServerRegistry, db: AsyncSQLite, history: PlayerHistory):
+        self.bot = bot
+        self._servers = servers
+        self._db = db
+        self._history = history
+
+    # top
+
+    @command(
+        brief='Playtime leaderboard',
+        description='Lists the players with the most playtime in the last ' +
+                    'days (def: 7) on all servers or on the given server.')
+    async def top(self, ctx: Context, days: int = 7, server: str = None):
+        days = max(1, min(days, _MAX_TOP_DAYS))
+
+        server_id = None
+        if server is not None:
+            srv = self._servers.get(server)
+            if srv is None:
+                await ctx.send(':warning:  Unknown server `{}`.'.format(server))
+                return
+            server_id = srv.id
+
+        async with ctx.typing():
+            rows = await self._db.get_top_playtime(
+                day_of(time.time()) - days + 1, _TOP_SIZE, server_id)
+
+            lines = []
+            for i, (mc_id, seconds, sessions) in enumerate(rows):
+                dc_id, _ = await self._db.get_whitelist_by_mc_id(mc_id)
+                lines.append('{}. `{}`{} - {} in {} session{}'.format(
+                    i + 1, mc_id, ' (<@{}>)'.format(dc_id) if dc_id else '',
+                    format_duration(seconds), sessions, '' if sessions == 1 else 's'))
+
+        em = Embed()
+        em.title = 'Playtime of the last {} days{}'.format(
+            days, ' on {}'.format(server) if server else '')
+        em.color = EMBED_COLOR
+        em.description = '\n'.join(lines) or '*No playtime recorded.*'
+        await ctx.send(embed=em)
+
+    # lastseen
+
+    @command(
+        brief='Last seen time of a player',
+        description='Shows when a minecraft ID or the one bound to a ' +
+                    'discord user was last seen on a server.',
+        aliases=('seen',))
+    async def lastseen(self, ctx: Context, query: lower = None):
+        async with ctx.typing():
+            mention = mentioned_id(query)
+            if query is None or mention:
+                dc_id = mention or str(ctx.message.author.id)
+                _, mc_id = await self._db.get_whitelist_by_discord_id(dc_id)
+                if mc_id is None:
+                    await ctx.send(':warning:  <@{}> has no bound minecraft ID.'.format(dc_id))
+                    return
+            else:
+                mc_id = query
+
+            server, since = self._history.online_since(mc_id)
+            if server is not None:
+                await ctx.send(':green_circle:  `{}` is online on **{}** since <t:{}:R>.'.format(
+                    mc_id, server, int(since)))
+                return
+
+            server, seen = await self._db.get_last_seen(mc_id)
+
+        if seen is None:
+            await ctx.send(':information_source:  `{}` was not seen recently.'.format(mc_id))
+            return
+        await ctx.send(':information_source:  `{}` was last seen on **{}** <t:{}:R>.'.format(
+            mc_id, server or 'an unknown server', seen))
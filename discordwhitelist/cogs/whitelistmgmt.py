@@ -1,20 +1,79 @@
 import asyncio
+import logging
 from discord import Embed
 from discord.ext.commands import command, Cog, Context, MissingRequiredArgument
-from shared import verbose_output, lower, EMBED_COLOR
-from asyncrcon import AsyncRCON
-from database import SQLite
+from shared import verbose_output, lower, server_output, truncate, paginate, \
+    mentioned_id, EMBED_COLOR
+from database import AsyncSQLite
+from mcserver import ServerRegistry
+
+
+# Time in seconds after which users are told that
+# their whitelist change is still pending.
+_FOLLOW_UP_TIMEOUT = 30
+
+_PAGE_SIZE = 20
+
+
+class _BindingPages:
+    """
+    Cursor over the pages of bindings, optionally
+    filtered by a mc id prefix, which fetches every
+    page on demand by keyset pagination.
+    """
+
+    def __init__(self, db: AsyncSQLite, mc_prefix: str = None):
+        self._db = db
+        self._mc_prefix = mc_prefix
+        self.rows = []
+        self.page = 0
+        self.has_next = False
+
+    def _key(self, row: tuple):
+        return row[0] if self._mc_prefix is None else row[2]
+
+    async def first(self):
+        rows = await self._db.get_whitelist_page(
+            _PAGE_SIZE + 1, mc_prefix=self._mc_prefix)
+        self.rows, self.has_next = rows[:_PAGE_SIZE], len(rows) > _PAGE_SIZE
+
+    async def next(self) -> bool:
+        if not self.has_next:
+            return False
+        rows = await self._db.get_whitelist_page(
+            _PAGE_SIZE + 1, after=self._key(self.rows[-1]), mc_prefix=self._mc_prefix)
+        if not rows:
+            self.has_next = False
+            return False
+        self.rows, self.has_next = rows[:_PAGE_SIZE], len(rows) > _PAGE_SIZE
+        self.page += 1
+        return True
+
+    async def prev(self) -> bool:
+        if self.page == 0:
+            return False
+        rows = await self._db.get_whitelist_page(
+            _PAGE_SIZE, before=self._key(self.rows[0]), mc_prefix=self._mc_prefix)
+        if not rows:
+            return False
+        self.rows, self.has_next = rows, True
+        self.page -= 1
+        return True
 
 
 class WhitelistMgmt(Cog, name='Whitelist Management'):
 
-    _rcon: AsyncRCON
-    _db: SQLite
+    _servers: ServerRegistry
+    _db: AsyncSQLite
+    _follow_ups: set
 
-    def __init__(self, bot, rcon: AsyncRCON, db: SQLite):
+    def __init__(self, bot, servers: ServerRegistry, db: AsyncSQLite):
         self.bot = bot
-        self._rcon = rcon
+        self._servers = servers
         self._db = db
+        # Running follow up tasks, referenced until done so
+        # they are not garbage collected.
+        self._follow_ups = set()
 
     # bind
 
@@ -25,7 +84,7 @@ class WhitelistMgmt(Cog, name='Whitelist Management'):
         aliases=('add', 'set'))
     async def bind(self, ctx: Context, mc_id: lower, *argv):
         async with ctx.typing():
-            dc_id, curr_mc_id = self._db.get_whitelist_by_mc_id(mc_id)
+            dc_id, curr_mc_id = await self._db.get_whitelist_by_mc_id(mc_id)
 
             if curr_mc_id is not None and mc_id == curr_mc_id:
                 await ctx.send(':warning:  This minecraft ID is already ' +
@@ -37,22 +96,12 @@ class WhitelistMgmt(Cog, name='Whitelist Management'):
                                'registered by another user!')
                 return
 
-            old_mc_id = self._db.set_witelist(str(ctx.message.author.id), mc_id)
-
-            vbop = []
-
-            if old_mc_id is not None:
-                vbop.append(await self._rcon.command(
-                    'whitelist remove {}'.format(old_mc_id)))
-                await asyncio.sleep(0.5)
-
-            wl_disabled = self._db.get_disabled(ctx.guild.id)
+            wl_disabled = await self._db.get_disabled(ctx.guild.id)
 
-            if not wl_disabled:
-                vbop.append(await self._rcon.command('whitelist add {}'.format(mc_id)))
-
-            await asyncio.sleep(0.5)
-            vbop.append(await self._rcon.command('whitelist reload'))
+            _, entries = await self._db.bind_witelist(
+                str(ctx.message.author.id), mc_id, self._servers.ids, not wl_disabled)
+            self._servers.notify_outbox()
+            self._start_follow_up(ctx, argv, entries)
 
             if wl_disabled:
                 await ctx.send(
@@ -68,8 +117,6 @@ class WhitelistMgmt(Cog, name='Whitelist Management'):
                 ':white_check_mark:  You are now bound to the mc ' +
                 'account `{}` and added to the servers whitelist.'.format(mc_id))
 
-            await verbose_output(ctx, argv, vbop)
-
     @bind.error
     async def bind_error(self, ctx: Context, err):
         if isinstance(err, MissingRequiredArgument):
@@ -84,24 +131,47 @@ class WhitelistMgmt(Cog, name='Whitelist Management'):
         aliases=('remove', 'unset'))
     async def unbind(self, ctx: Context, *argv):
         async with ctx.typing():
-            _, mc_id = self._db.get_whitelist_by_discord_id(
+            _, mc_id = await self._db.get_whitelist_by_discord_id(
                 str(ctx.message.author.id))
             if mc_id is None:
                 await ctx.send(':warning:  Your account is not bound to any ' +
                                'minecraft ID.')
                 return
 
-            vbop = []
-            vbop.append(await self._rcon.command('whitelist remove {}'.format(mc_id)))
-            await asyncio.sleep(0.5)
-            vbop.append(await self._rcon.command('whitelist reload'))
-            self._db.rem_witelist(str(ctx.message.author.id))
+            _, entries = await self._db.unbind_witelist(
+                str(ctx.message.author.id), self._servers.ids)
+            self._servers.notify_outbox()
+            self._start_follow_up(ctx, argv, entries)
 
             await ctx.send(
                 ':white_check_mark:  Successfully removed you from ' +
                 'the servers whitelist and account is unbound.'.format(mc_id))
 
-            await verbose_output(ctx, argv, vbop)
+    def _start_follow_up(self, ctx: Context, argv: list, entries: list):
+        task = asyncio.ensure_future(self._follow_up(ctx, argv, entries))
+        self._follow_ups.add(task)
+        task.add_done_callback(self._follow_up_done)
+
+    def _follow_up_done(self, task: asyncio.Task):
+        self._follow_ups.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('Failed following up whitelist change: {}'.format(task.exception()))
+
+    async def _follow_up(self, ctx: Context, argv: list, entries: list):
+        """
+        Waits for the whitelist changes recorded in the
+        outbox to be applied and sends the verbose output
+        or, if they take too long, a notice that they are
+        still pending.
+        """
+        try:
+            results = await asyncio.wait_for(
+                self._servers.wait_applied(entries), _FOLLOW_UP_TIMEOUT)
+        except asyncio.TimeoutError:
+            await ctx.send(':clock1:  The server is currently not reachable. Your ' +
+                           'whitelist change will be applied as soon as it is back.')
+            return
+        await verbose_output(ctx, argv, server_output(results))
 
     # info
 
@@ -111,7 +181,7 @@ class WhitelistMgmt(Cog, name='Whitelist Management'):
         aliases=('bound', 'display'))
     async def info(self, ctx: Context):
         async with ctx.typing():
-            _, mc_id = self._db.get_whitelist_by_discord_id(
+            _, mc_id = await self._db.get_whitelist_by_discord_id(
                 str(ctx.message.author.id))
             if mc_id is None:
                 await ctx.send(':warning:  Ypur account is not bound to any ' +
@@ -126,34 +196,73 @@ class WhitelistMgmt(Cog, name='Whitelist Management'):
 
     @command(
         brief='Displays whitelisted users',
-        description='Displays currently whitelisted and bound users.',
+        description='Displays currently whitelisted and bound users page by page. ' +
+                    'Pass the beginning of a minecraft ID or mention a user to search ' +
+                    'and react with the arrows to browse the pages.',
         name='list',
         aliases=('ls', 'all'))
-    async def list_bindings(self, ctx: Context):
-        MAX_LEN = 40
-
+    async def list_bindings(self, ctx: Context, query: str = None):
         async with ctx.typing():
-            wl = self._db.get_whitelist()
-            em = Embed()
-            em.title = 'Whitelist'
-            em.color = EMBED_COLOR
-            em.description = ''
-            for dc_id, mc_id in list(wl.items())[:MAX_LEN]:
-                em.description += '<@{}> - `{}`\n'.format(dc_id, mc_id)
+            mention = mentioned_id(query)
+            if mention:
+                dc_id, mc_id = await self._db.get_whitelist_by_discord_id(mention)
+                rows = [(None, dc_id, mc_id)] if dc_id is not None else []
+                await ctx.send(embed=self._list_embed(rows, 'No binding found.'))
+                return
+
+            pages = _BindingPages(self._db, query.lower() if query else None)
+            await pages.first()
+            total = await self._db.get_whitelist_count() if query is None else None
+
+            def render() -> Embed:
+                em = self._list_embed(pages.rows, 'No bindings found.')
+                footer = 'Page {}'.format(pages.page + 1)
+                if total is not None:
+                    footer += ' · {} bindings'.format(total)
+                em.set_footer(text=footer)
+                return em
+
+            msg = await ctx.send(embed=render())
+
+        if pages.has_next:
+            async def prev_page():
+                return render() if await pages.prev() else None
+
+            async def next_page():
+                return render() if await pages.next() else None
 
-            if len(wl) > MAX_LEN:
-                em.description += '*and {} more...*'.format(len(wl) - MAX_LEN)
+            await paginate(ctx, msg, prev_page, next_page)
 
-            await ctx.send(embed=em)
+    def _list_embed(self, rows: list, empty: str) -> Embed:
+        em = Embed()
+        em.title = 'Whitelist'
+        em.color = EMBED_COLOR
+        em.description = '\n'.join(
+            '<@{}> - `{}`'.format(dc_id, mc_id) for _, dc_id, mc_id in rows) or \
+            '*{}*'.format(empty)
+        return em
 
     # serverwl
 
     @command(
         brief='Displays server whitelist',
         description='Displays the raw output of the ' +
-                    '\'whitelist list\' command.',
+                    '\'whitelist list\' command of all or the given server.',
         aliases=('showwl', 'listserver'))
-    async def serverwl(self, ctx: Context):
+    async def serverwl(self, ctx: Context, server: str = None):
         async with ctx.typing():
-            res = await self._rcon.command('whitelist list')
-            await ctx.send('```{}```'.format(res))
+            servers = list(self._servers)
+            if server is not None:
+                servers = [s for s in servers if s.name == server]
+                if not servers:
+                    await ctx.send(':warning:  Unknown server `{}`.'.format(server))
+                    return
+
+            results = await self._servers.broadcast(
+                lambda s: s.scheduler.command('whitelist list'), servers)
+
+            for name, res in results.items():
+                if isinstance(res, Exception):
+                    res = 'error: {}'.format(res)
+                head = '**{}**\n'.format(name) if len(self._servers) > 1 else ''
+                await ctx.send(truncate('{}```{}```'.format(head, res), suffix='```'))
@@ -1,2 +1,5 @@
 # flake8: noqa
+from .models import *
+from .bulk import *
 from .sqlite import *
+from .asyncdb import *
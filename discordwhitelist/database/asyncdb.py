@@ -0,0 +1,304 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+import metrics
+from typing import Callable, Iterable, TextIO
+from .sqlite import SQLite
+from .models import GuildConfig
+from .bulk import ImportReport
+
+
+_DB_LATENCY = metrics.histogram(
+    'db_query_duration_seconds',
+    'Duration of database calls including queueing by method', ('method',))
+_DB_ERRORS = metrics.counter(
+    'db_query_errors',
+    'Failed database calls by method', ('method',))
+_DB_QUEUE = metrics.gauge(
+    'db_queue_depth',
+    'Number of database calls waiting for the worker thread')
+
+
+class _Job:
+
+    __slots__ = ('fn', 'args', 'write', 'loop', 'future')
+
+    def __init__(self, fn: Callable, args: tuple, write: bool,
+                 loop: asyncio.AbstractEventLoop, future: asyncio.Future):
+        self.fn = fn
+        self.args = args
+        self.write = write
+        self.loop = loop
+        self.future = future
+
+
+def _resolve(future: asyncio.Future, res, err: Exception):
+    if future.cancelled():
+        return
+    if err is not None:
+        future.set_exception(err)
+    else:
+        future.set_result(res)
+
+
+class AsyncSQLite:
+    """
+    Awaitable front of SQLite which executes all
+    queries on a dedicated worker thread owning its
+    own connection, so the event loop never blocks
+    on disk I/O.
+
+    Writes arriving within commit_delay seconds of
+    each other are group-committed in one transaction.
+    The futures of those writes resolve after the
+    commit has succeeded.
+
+    Lookups which are served by the resident whitelist
+    index or the guild config cache are answered
+    directly without a thread hop, under the lock
+    SQLite holds while the worker updates them.
+    """
+
+    _db: SQLite
+    _jobs: queue.Queue
+    _thread: threading.Thread
+    _commit_delay: float
+    _max_batch: int
+
+    def __init__(self, fileloc: str, commit_delay: float = 0.05,
+                 max_batch: int = 256):
+        self._commit_delay = commit_delay
+        self._max_batch = max_batch
+        self._jobs = queue.Queue()
+        _DB_QUEUE.set_function(self._jobs.qsize)
+
+        ready = threading.Event()
+        init_err = []
+        self._thread = threading.Thread(
+            target=self._worker, args=(fileloc, ready, init_err),
+            name='database', daemon=True)
+        self._thread.start()
+        ready.wait()
+        if init_err:
+            raise init_err[0]
+
+    def close(self):
+        self._jobs.put(None)
+        self._thread.join()
+
+    def _submit(self, fn: Callable, args: tuple, write: bool) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._jobs.put(_Job(fn, args, write, loop, future))
+        return future
+
+    async def _call(self, fn: Callable, args: tuple, write: bool):
+        try:
+            with _DB_LATENCY.time(fn.__name__):
+                return await self._submit(fn, args, write)
+        except Exception:
+            _DB_ERRORS.inc(fn.__name__)
+            raise
+
+    async def _read(self, fn: Callable, *args):
+        return await self._call(fn, args, False)
+
+    async def _write(self, fn: Callable, *args):
+        return await self._call(fn, args, True)
+
+    #################
+    # WORKER THREAD #
+    #################
+
+    def _worker(self, fileloc: str, ready: threading.Event, init_err: list):
+        try:
+            self._db = SQLite(fileloc, autocommit=False)
+        except Exception as e:
+            init_err.append(e)
+            return
+        finally:
+            ready.set()
+
+        closing = False
+        while not closing:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            batch = [job]
+            if job.write:
+                closing = self._collect_writes(batch)
+
+            self._run_batch(batch)
+
+        self._db.close()
+
+    def _collect_writes(self, batch: list) -> bool:
+        deadline = time.monotonic() + self._commit_delay
+        while len(batch) < self._max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self._jobs.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job is None:
+                return True
+            batch.append(job)
+        return False
+
+    def _run_batch(self, batch: list):
+        results = []
+        for job in batch:
+            try:
+                results.append((job.fn(*job.args), None))
+            except Exception as e:
+                results.append((None, e))
+
+        if any(job.write for job in batch):
+            try:
+                self._db.commit()
+            except Exception as e:
+                logging.error('Failed committing database transaction: {}'.format(e))
+                self._db.rollback()
+                results = [(None, e) if job.write else res
+                           for job, res in zip(batch, results)]
+
+        for job, (res, err) in zip(batch, results):
+            job.loop.call_soon_threadsafe(_resolve, job.future, res, err)
+
+    #############
+    # WHITELIST #
+    #############
+
+    async def get_whitelist(self) -> dict:
+        return self._db.get_whitelist()
+
+    async def get_whitelist_count(self) -> int:
+        return self._db.get_whitelist_count()
+
+    async def get_whitelist_page(self, limit: int, after=None, before=None,
+                                 mc_prefix: str = None) -> list:
+        return await self._read(self._db.get_whitelist_page, limit, after, before, mc_prefix)
+
+    async def export_whitelist(self, f: TextIO, fmt: str) -> int:
+        """
+        Streams all bindings into f on the worker thread,
+        delaying other database calls until finished.
+        """
+        return await self._read(self._db.export_whitelist, f, fmt)
+
+    async def import_whitelist(self, bindings: Iterable, policy: str = 'skip',
+                               batch_size: int = 10000) -> ImportReport:
+        """
+        Imports the bindings on the worker thread, which
+        consumes the iterable, delaying other database
+        calls until finished.
+        """
+        return await self._write(self._db.import_whitelist, bindings, policy, batch_size)
+
+    async def get_whitelist_by_mc_id(self, mc_id: str) -> (str, str):
+        return self._db.get_whitelist_by_mc_id(mc_id)
+
+    async def get_whitelist_by_discord_id(self, discord_id: str) -> (str, str):
+        return self._db.get_whitelist_by_discord_id(discord_id)
+
+    async def set_witelist(self, discord_id: str, mc_id: str) -> str:
+        return await self._write(self._db.set_witelist, discord_id, mc_id)
+
+    async def rem_witelist(self, ident: str):
+        return await self._write(self._db.rem_witelist, ident)
+
+    async def bind_witelist(self, discord_id: str, mc_id: str, server_ids: list,
+                            add: bool = True) -> (str, list):
+        return await self._write(self._db.bind_witelist, discord_id, mc_id, server_ids, add)
+
+    async def unbind_witelist(self, discord_id: str, server_ids: list) -> (str, list):
+        return await self._write(self._db.unbind_witelist, discord_id, server_ids)
+
+    async def unbind_witelist_many(self, discord_ids: list, server_ids: list) -> (list, list):
+        return await self._write(self._db.unbind_witelist_many, discord_ids, server_ids)
+
+    ##########
+    # GUILDS #
+    ##########
+
+    async def warm_guild_configs(self, guild_ids: list = None):
+        return await self._read(self._db.warm_guild_configs, guild_ids)
+
+    async def get_guild_config(self, guild_id: str) -> GuildConfig:
+        cfg = self._db.cached_guild_config(guild_id)
+        if cfg is None:
+            cfg = await self._read(self._db.get_guild_config, guild_id)
+        return cfg
+
+    async def get_admin_role(self, guild_id: str) -> str:
+        return (await self.get_guild_config(guild_id)).admin_role_id
+
+    async def set_admin_role(self, guild_id: str, role_id: str):
+        return await self._write(self._db.set_admin_role, guild_id, role_id)
+
+    async def get_status_channel(self, guild_id: str) -> str:
+        return (await self.get_guild_config(guild_id)).status_channel_id
+
+    async def set_status_channel(self, guild_id: str, channel_id: str):
+        return await self._write(self._db.set_status_channel, guild_id, channel_id)
+
+    async def get_status_message(self, guild_id: str) -> str:
+        return (await self.get_guild_config(guild_id)).status_message_id
+
+    async def set_status_message(self, guild_id: str, message_id: str):
+        return await self._write(self._db.set_status_message, guild_id, message_id)
+
+    async def get_disabled(self, guild_id: str) -> bool:
+        return (await self.get_guild_config(guild_id)).disabled
+
+    async def set_disabled(self, guild_id: str, disabled: bool):
+        return await self._write(self._db.set_disabled, guild_id, disabled)
+
+    ###########
+    # SERVERS #
+    ###########
+
+    async def get_servers(self) -> list:
+        return await self._read(self._db.get_servers)
+
+    async def set_server(self, name: str, address: str, server_dir: str,
+                         server_log: str) -> int:
+        return await self._write(self._db.set_server, name, address, server_dir, server_log)
+
+    ##########
+    # OUTBOX #
+    ##########
+
+    async def get_outbox(self, server_id: int, limit: int = 256) -> list:
+        return await self._read(self._db.get_outbox, server_id, limit)
+
+    async def get_pending_outbox(self, ids: list) -> set:
+        return await self._read(self._db.get_pending_outbox, ids)
+
+    async def ack_outbox(self, ids: list):
+        return await self._write(self._db.ack_outbox, ids)
+
+    async def fail_outbox(self, ids: list, error: str):
+        return await self._write(self._db.fail_outbox, ids, error)
+
+    ###########
+    # HISTORY #
+    ###########
+
+    async def add_player_history(self, sessions: list, playtime: list, last_seen: list):
+        return await self._write(self._db.add_player_history, sessions, playtime, last_seen)
+
+    async def get_top_playtime(self, since_day: int, limit: int,
+                               server_id: int = None) -> list:
+        return await self._read(self._db.get_top_playtime, since_day, limit, server_id)
+
+    async def get_last_seen(self, mc_id: str) -> (str, int):
+        return await self._read(self._db.get_last_seen, mc_id)
+
+    async def prune_player_history(self, before: int, limit: int = 10000) -> int:
+        return await self._write(self._db.prune_player_history, before, limit)
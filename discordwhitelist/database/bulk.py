@@ -0,0 +1,173 @@
+import re
+import csv
+import json
+from typing import Iterable, Iterator, TextIO
+
+
+FORMATS = ('csv', 'json', 'jsonl')
+
+# How imports handle bindings whose mc id is already
+# bound to another discord account.
+IMPORT_POLICIES = ('skip', 'replace', 'abort')
+
+_DISCORD_ID_RE = re.compile(r'^\d{1,22}$')
+_MC_ID_RE = re.compile(r'^\w{1,32}$')
+
+_JSON_CHUNK_SIZE = 64 * 1024
+
+
+class ImportReport:
+    """
+    Counts of an import of bindings.
+    """
+
+    __slots__ = ('inserted', 'updated', 'skipped', 'replaced', 'invalid')
+
+    def __init__(self):
+        self.inserted = 0
+        self.updated = 0
+        self.skipped = 0
+        self.replaced = 0
+        self.invalid = 0
+
+    @property
+    def imported(self) -> int:
+        return self.inserted + self.updated
+
+    def summary(self) -> str:
+        return ('{} inserted\n{} updated\n{} skipped (mc id bound to another account)\n' +
+                '{} replaced (other binding of the mc id removed)\n{} invalid').format(
+                    self.inserted, self.updated, self.skipped, self.replaced, self.invalid)
+
+
+class ImportConflictException(Exception):
+    """
+    Thrown by imports with the 'abort' policy when an
+    mc id is already bound to another discord account.
+    """
+
+    def __init__(self, mc_id: str, imported: int):
+        super(ImportConflictException, self).__init__(
+            'mc id {} is already bound to another account, '.format(mc_id) +
+            'aborted after {} imported bindings'.format(imported))
+        self.mc_id = mc_id
+        self.imported = imported
+
+
+def guess_format(fileloc: str) -> str:
+    ext = fileloc.rsplit('.', 1)[-1].lower()
+    if ext not in FORMATS:
+        raise ValueError('unknown format of {}, expected one of {}'.format(
+            fileloc, ', '.join(FORMATS)))
+    return ext
+
+
+def valid_binding(discord_id: str, mc_id: str) -> bool:
+    return bool(discord_id and mc_id and _DISCORD_ID_RE.match(discord_id) and
+                _MC_ID_RE.match(mc_id))
+
+
+def read_bindings(f: TextIO, fmt: str) -> Iterator[tuple]:
+    """
+    Yields the (discordId, mcId) bindings read from f
+    one by one without loading the whole file. CSV
+    files need a 'discordId,mcId' header, JSON files
+    hold an array of {"discordId": ..., "mcId": ...}
+    objects and JSONL files one such object per line.
+    """
+    if fmt == 'csv':
+        reader = csv.reader(f)
+        header = next(reader, [])
+        if 'discordId' not in header or 'mcId' not in header:
+            raise ValueError('expected a discordId,mcId header')
+        dc_col, mc_col = header.index('discordId'), header.index('mcId')
+        for row in reader:
+            if len(row) > max(dc_col, mc_col):
+                yield row[dc_col].strip(), row[mc_col].strip().lower()
+            elif row:
+                yield None, None
+    elif fmt == 'jsonl':
+        for line in f:
+            if line.strip():
+                yield _binding(json.loads(line))
+    elif fmt == 'json':
+        for obj in _iter_json_array(f):
+            yield _binding(obj)
+    else:
+        raise ValueError('unknown format {}'.format(fmt))
+
+
+def write_bindings(rows: Iterable, f: TextIO, fmt: str) -> int:
+    """
+    Writes the (discordId, mcId) bindings of rows to f
+    as they are consumed and returns their number.
+    """
+    n = 0
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        writer.writerow(('discordId', 'mcId'))
+        for dc_id, mc_id in rows:
+            writer.writerow((dc_id, mc_id))
+            n += 1
+    elif fmt == 'jsonl':
+        for dc_id, mc_id in rows:
+            f.write(json.dumps({'discordId': dc_id, 'mcId': mc_id}) + '\n')
+            n += 1
+    elif fmt == 'json':
+        f.write('[')
+        for dc_id, mc_id in rows:
+            f.write((',\n' if n else '\n') +
+                    json.dumps({'discordId': dc_id, 'mcId': mc_id}))
+            n += 1
+        f.write('\n]\n')
+    else:
+        raise ValueError('unknown format {}'.format(fmt))
+    return n
+
+
+def _binding(obj: dict) -> tuple:
+    dc_id = obj.get('discordId')
+    mc_id = obj.get('mcId')
+    return (str(dc_id).strip() if dc_id is not None else None,
+            str(mc_id).strip().lower() if mc_id is not None else None)
+
+
+def _iter_json_array(f: TextIO) -> Iterator[dict]:
+    """
+    Decodes the elements of a top level JSON array one
+    by one while reading f in chunks.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos = '', 0
+    started = eof = False
+
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (started and buf[pos] == ',')):
+            pos += 1
+
+        if pos < len(buf):
+            if not started:
+                if buf[pos] != '[':
+                    raise ValueError('expected a JSON array')
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                obj, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # The element is continued in the next chunk.
+                if eof:
+                    raise
+            else:
+                pos = end
+                yield obj
+                continue
+
+        if eof:
+            raise ValueError('unterminated JSON array')
+
+        chunk = f.read(_JSON_CHUNK_SIZE)
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
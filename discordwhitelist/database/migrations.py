@@ -0,0 +1,129 @@
+import logging
+from sqlite3 import Connection
+
+
+# Every migration is a list of statements which is
+# executed in one transaction. The index of the
+# migration in MIGRATIONS + 1 is its schema version,
+# which is stored in the 'user_version' pragma of
+# the database file. Append new migrations to the
+# end and never change already released ones.
+
+MIGRATIONS = [
+    # 1: initial schema
+    [
+        'CREATE TABLE IF NOT EXISTS `whitelist` (' +
+        '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
+        '  `discordId` VARCHAR(22),' +
+        '  `mcId` VARCHAR(32)' +
+        ');',
+        'CREATE TABLE IF NOT EXISTS `guilds` (' +
+        '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
+        '  `guildId` VARCHAR(22),' +
+        '  `adminRoleId` VARCHAR(32),' +
+        '  `statusChannelId` VARCHAR(32),' +
+        '  `statusMessageId` VARCHAR(32),' +
+        '  `disabled` BOOLEAN' +
+        ');',
+    ],
+    # 2: dedupe rows and add unique lookup indexes
+    [
+        'DELETE FROM `whitelist` WHERE ' +
+        '`discordId` IS NULL OR `mcId` IS NULL;',
+        'DELETE FROM `whitelist` WHERE `id` NOT IN (' +
+        '  SELECT MAX(`id`) FROM `whitelist` GROUP BY `discordId`);',
+        'DELETE FROM `whitelist` WHERE `id` NOT IN (' +
+        '  SELECT MAX(`id`) FROM `whitelist` GROUP BY `mcId` COLLATE NOCASE);',
+        'DELETE FROM `guilds` WHERE `id` NOT IN (' +
+        '  SELECT MAX(`id`) FROM `guilds` GROUP BY `guildId`);',
+        'CREATE UNIQUE INDEX IF NOT EXISTS `idx_whitelist_discordId` ' +
+        'ON `whitelist` (`discordId`);',
+        'CREATE UNIQUE INDEX IF NOT EXISTS `idx_whitelist_mcId` ' +
+        'ON `whitelist` (`mcId` COLLATE NOCASE);',
+        'CREATE UNIQUE INDEX IF NOT EXISTS `idx_guilds_guildId` ' +
+        'ON `guilds` (`guildId`);',
+    ],
+    # 3: registry of managed minecraft servers
+    [
+        'CREATE TABLE IF NOT EXISTS `servers` (' +
+        '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
+        '  `name` VARCHAR(32) NOT NULL UNIQUE,' +
+        '  `address` VARCHAR(255),' +
+        '  `serverDir` TEXT,' +
+        '  `serverLog` TEXT' +
+        ');',
+    ],
+    # 4: outbox of whitelist mutations pending per server
+    [
+        'CREATE TABLE IF NOT EXISTS `outbox` (' +
+        '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
+        '  `serverId` INTEGER NOT NULL,' +
+        '  `action` VARCHAR(8) NOT NULL,' +
+        '  `mcId` VARCHAR(32) NOT NULL,' +
+        '  `created` INTEGER NOT NULL,' +
+        '  `attempts` INTEGER NOT NULL DEFAULT 0,' +
+        '  `lastError` TEXT' +
+        ');',
+        'CREATE INDEX IF NOT EXISTS `idx_outbox_serverId` ' +
+        'ON `outbox` (`serverId`, `id`);',
+    ],
+    # 5: player sessions with daily playtime rollups
+    [
+        'CREATE TABLE IF NOT EXISTS `sessions` (' +
+        '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
+        '  `serverId` INTEGER NOT NULL,' +
+        '  `mcId` VARCHAR(32) NOT NULL COLLATE NOCASE,' +
+        '  `joined` INTEGER NOT NULL,' +
+        '  `left` INTEGER NOT NULL' +
+        ');',
+        'CREATE INDEX IF NOT EXISTS `idx_sessions_left` ' +
+        'ON `sessions` (`left`);',
+        'CREATE TABLE IF NOT EXISTS `playtime` (' +
+        '  `day` INTEGER NOT NULL,' +
+        '  `serverId` INTEGER NOT NULL,' +
+        '  `mcId` VARCHAR(32) NOT NULL COLLATE NOCASE,' +
+        '  `seconds` INTEGER NOT NULL DEFAULT 0,' +
+        '  `sessions` INTEGER NOT NULL DEFAULT 0,' +
+        '  PRIMARY KEY (`day`, `serverId`, `mcId`)' +
+        ');',
+        'CREATE TABLE IF NOT EXISTS `lastSeen` (' +
+        '  `mcId` VARCHAR(32) NOT NULL PRIMARY KEY COLLATE NOCASE,' +
+        '  `serverId` INTEGER NOT NULL,' +
+        '  `seen` INTEGER NOT NULL' +
+        ');',
+        'CREATE INDEX IF NOT EXISTS `idx_lastSeen_seen` ' +
+        'ON `lastSeen` (`seen`);',
+    ],
+]
+
+
+def schema_version(conn: Connection) -> int:
+    return conn.execute('PRAGMA user_version;').fetchone()[0]
+
+
+def migrate(conn: Connection) -> int:
+    """
+    Applies all pending migrations to the database
+    in order, each in its own transaction, and
+    returns the resulting schema version.
+    """
+    version = schema_version(conn)
+
+    if version > len(MIGRATIONS):
+        raise Exception(
+            'database schema version {} is newer than the '.format(version) +
+            'latest known version {}'.format(len(MIGRATIONS)))
+
+    for to_version in range(version + 1, len(MIGRATIONS) + 1):
+        logging.info('Migrating database to schema version {}...'.format(to_version))
+        conn.execute('BEGIN;')
+        try:
+            for stmt in MIGRATIONS[to_version - 1]:
+                conn.execute(stmt)
+            conn.execute('PRAGMA user_version = {};'.format(to_version))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return len(MIGRATIONS)
@@ -0,0 +1,31 @@
+class GuildConfig:
+    """
+    Settings of a single guild as stored in one
+    row of the 'guilds' table.
+    """
+
+    __slots__ = (
+        'guild_id', 'admin_role_id', 'status_channel_id',
+        'status_message_id', 'disabled')
+
+    guild_id: str
+    admin_role_id: str
+    status_channel_id: str
+    status_message_id: str
+    disabled: bool
+
+    def __init__(self, guild_id: str, admin_role_id: str = None,
+                 status_channel_id: str = None, status_message_id: str = None,
+                 disabled: bool = False):
+        self.guild_id = guild_id
+        self.admin_role_id = admin_role_id
+        self.status_channel_id = status_channel_id
+        self.status_message_id = status_message_id
+        self.disabled = bool(disabled)
+
+    def __repr__(self) -> str:
+        return ('<GuildConfig {{ guild_id: {}, admin_role_id: {}, ' +
+                'status_channel_id: {}, status_message_id: {}, ' +
+                'disabled: {} }}>').format(
+            self.guild_id, self.admin_role_id, self.status_channel_id,
+            self.status_message_id, self.disabled)
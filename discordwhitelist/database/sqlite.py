@@ -1,176 +1,632 @@
+import time
 import sqlite3
+import threading
 from sqlite3 import Connection
+from typing import Iterable, Iterator, TextIO
+from .models import GuildConfig
+from .migrations import migrate
+from .bulk import ImportReport, ImportConflictException, valid_binding, write_bindings
+
+
+# SQLite limits the number of bound parameters
+# per statement to 999 in older versions.
+_MAX_QUERY_PARAMS = 500
+
+# Sorts after every character of a minecraft ID, so
+# prefix + _MAX_CHAR is the upper bound of a prefix.
+_MAX_CHAR = '\U0010ffff'
+
+_GUILD_FIELDS = {
+    'adminRoleId': 'admin_role_id',
+    'statusChannelId': 'status_channel_id',
+    'statusMessageId': 'status_message_id',
+    'disabled': 'disabled',
+}
 
 
 class SQLite:
 
     _conn: Connection
+    _autocommit: bool
+    _by_discord_id: dict
+    _by_mc_id: dict
+    _guilds: dict
+    _lock: threading.Lock
+    _indexed: bool
 
-    def __init__(self, fileloc: str):
+    def __init__(self, fileloc: str, autocommit: bool = True, index: bool = True):
         self._conn = sqlite3.connect(fileloc)
+        self._autocommit = autocommit
+        self._guilds = {}
+        self._lock = threading.Lock()
+        self._indexed = index
+        self._by_discord_id, self._by_mc_id = {}, {}
         self._ensure_created()
+        self._load_index()
 
     def close(self):
         self._conn.close()
 
-    def _ensure_created(self):
-        self._conn.execute(
-            'CREATE TABLE IF NOT EXISTS `whitelist` (' +
-            '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
-            '  `discordId` VARCHAR(22),' +
-            '  `mcId` VARCHAR(32)' +
-            ');')
-        self._conn.execute(
-            'CREATE TABLE IF NOT EXISTS `guilds` (' +
-            '  `id` INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,' +
-            '  `guildId` VARCHAR(22),' +
-            '  `adminRoleId` VARCHAR(32),' +
-            '  `statusChannelId` VARCHAR(32),' +
-            '  `statusMessageId` VARCHAR(32),' +
-            '  `disabled` BOOLEAN' +
-            ');')
+    def commit(self):
         self._conn.commit()
 
-    def get_whitelist(self) -> dict:
+    def rollback(self):
+        self._conn.rollback()
+        with self._lock:
+            self._guilds = {}
+        self._load_index()
+
+    def _commit(self):
+        if self._autocommit:
+            self._conn.commit()
+
+    def _ensure_created(self):
+        migrate(self._conn)
+
+    # The whitelist bindings are kept resident in
+    # memory in both directions, so lookups never hit
+    # the database. All writes go through to SQLite
+    # and update the index afterwards. AsyncSQLite
+    # reads the index and the guild configs from the
+    # event loop while its worker thread writes, so
+    # they are only accessed while holding _lock.
+    # Offline bulk tools open the database without
+    # the index, so their memory does not grow with
+    # the table; only the methods which query SQLite
+    # directly (pages, iteration, import and export)
+    # may be used then.
+
+    def _load_index(self):
+        if not self._indexed:
+            return
+        by_discord_id, by_mc_id = {}, {}
         res = self._conn.execute(
             'SELECT `discordId`, `mcId` FROM `whitelist`;')
-        res_map = {}
-        for e in res.fetchall():
-            res_map[e[0]] = e[1]
-        return res_map
+        for dc_id, mc_id in res.fetchall():
+            by_discord_id[dc_id] = mc_id
+            by_mc_id[mc_id.lower()] = dc_id
+        with self._lock:
+            self._by_discord_id, self._by_mc_id = by_discord_id, by_mc_id
 
-    def get_whitelist_by_mc_id(self, mc_id: str) -> (str, str):
+    def _index_set(self, discord_id: str, mc_id: str):
+        if not self._indexed:
+            return
+        with self._lock:
+            old_mc_id = self._by_discord_id.get(discord_id)
+            if old_mc_id is not None:
+                self._by_mc_id.pop(old_mc_id.lower(), None)
+            self._by_discord_id[discord_id] = mc_id
+            self._by_mc_id[mc_id.lower()] = discord_id
+
+    def _index_rem(self, ident: str):
+        if not self._indexed:
+            return
+        with self._lock:
+            mc_id = self._by_discord_id.pop(ident, None)
+            if mc_id is not None:
+                self._by_mc_id.pop(mc_id.lower(), None)
+            dc_id = self._by_mc_id.pop(ident.lower(), None)
+            if dc_id is not None:
+                self._by_discord_id.pop(dc_id, None)
+
+    def get_whitelist(self) -> dict:
+        with self._lock:
+            return dict(self._by_discord_id)
+
+    def get_whitelist_count(self) -> int:
+        with self._lock:
+            return len(self._by_discord_id)
+
+    def get_whitelist_page(self, limit: int, after=None, before=None,
+                           mc_prefix: str = None) -> list:
+        """
+        Returns up to limit bindings as (id, discordId,
+        mcId) following the cursor after or preceding the
+        cursor before. Bindings are ordered and paged by
+        id or, if filtered by a mc id prefix, by mc id,
+        so every page is a range scan over at most limit
+        rows of the primary key or the mc id index.
+        """
+        conds, args = [], []
+        key = '`id`'
+        if mc_prefix is not None:
+            key = '`mcId` COLLATE NOCASE'
+            conds += ['`mcId` >= ? COLLATE NOCASE', '`mcId` < ? COLLATE NOCASE']
+            args += [mc_prefix, mc_prefix + _MAX_CHAR]
+        if after is not None:
+            conds.append('{} > ?'.format(key))
+            args.append(after)
+        if before is not None:
+            conds.append('{} < ?'.format(key))
+            args.append(before)
+
+        backwards = before is not None and after is None
         res = self._conn.execute(
-            'SELECT `discordId`, `mcId` FROM `whitelist` WHERE ' +
-            '`mcId` = ?;', (mc_id,))
-        row = res.fetchone()
-        if row is None:
+            'SELECT `id`, `discordId`, `mcId` FROM `whitelist` ' +
+            ('WHERE {} '.format(' AND '.join(conds)) if conds else '') +
+            'ORDER BY {} {} LIMIT ?;'.format(key, 'DESC' if backwards else 'ASC'),
+            args + [limit])
+        rows = res.fetchall()
+        return rows[::-1] if backwards else rows
+
+    def iter_whitelist(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """
+        Yields all bindings as (discordId, mcId) ordered
+        by id, reading batch_size rows at a time.
+        """
+        after = 0
+        while True:
+            rows = self.get_whitelist_page(batch_size, after=after)
+            for _, dc_id, mc_id in rows:
+                yield dc_id, mc_id
+            if len(rows) < batch_size:
+                return
+            after = rows[-1][0]
+
+    def export_whitelist(self, f: TextIO, fmt: str) -> int:
+        return write_bindings(self.iter_whitelist(), f, fmt)
+
+    def import_whitelist(self, bindings: Iterable, policy: str = 'skip',
+                         batch_size: int = 10000) -> ImportReport:
+        """
+        Imports the (discordId, mcId) bindings, which are
+        consumed batch_size at a time, each batch in its
+        own transaction. Existing bindings of a discord
+        id are updated. Mc ids bound to another discord
+        id are skipped, replace the other binding or, with
+        the 'abort' policy, abort the import after the
+        previous batches, depending on policy.
+        """
+        report = ImportReport()
+        # Writes pending on this connection must not be rolled
+        # back together with a failing batch.
+        self._conn.commit()
+        self._conn.execute(
+            'CREATE TEMP TABLE IF NOT EXISTS `import_stage` (' +
+            '  `discordId` VARCHAR(22) PRIMARY KEY,' +
+            '  `mcId` VARCHAR(32) UNIQUE COLLATE NOCASE' +
+            ');')
+
+        batch = []
+        for dc_id, mc_id in bindings:
+            if not valid_binding(dc_id, mc_id):
+                report.invalid += 1
+                continue
+            batch.append((dc_id, mc_id))
+            if len(batch) >= batch_size:
+                self._import_batch(batch, policy, report)
+                batch = []
+        if batch:
+            self._import_batch(batch, policy, report)
+
+        return report
+
+    def _import_batch(self, batch: list, policy: str, report: ImportReport):
+        try:
+            self._conn.execute('DELETE FROM `import_stage`;')
+            # Later rows of the batch win over earlier ones
+            # for the same discord id or mc id.
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO `import_stage` (`discordId`, `mcId`) ' +
+                'VALUES (?, ?);', batch)
+
+            conflicts = self._conn.execute(
+                'SELECT `w`.`discordId`, `w`.`mcId` FROM `import_stage` `s` ' +
+                'JOIN `whitelist` `w` ON `w`.`mcId` = `s`.`mcId` COLLATE NOCASE ' +
+                'WHERE `w`.`discordId` != `s`.`discordId`;').fetchall()
+            if conflicts and policy == 'abort':
+                raise ImportConflictException(conflicts[0][1], report.imported)
+            if conflicts and policy == 'skip':
+                self._conn.executemany(
+                    'DELETE FROM `import_stage` WHERE `mcId` = ? COLLATE NOCASE;',
+                    [(mc_id,) for _, mc_id in conflicts])
+                report.skipped += len(conflicts)
+            elif conflicts:
+                self._conn.executemany(
+                    'DELETE FROM `whitelist` WHERE `discordId` = ?;',
+                    [(dc_id,) for dc_id, _ in conflicts])
+                report.replaced += len(conflicts)
+
+            updated = self._conn.execute(
+                'SELECT COUNT(*) FROM `import_stage` `s` JOIN `whitelist` `w` ' +
+                'ON `w`.`discordId` = `s`.`discordId`;').fetchone()[0]
+            staged = self._conn.execute(
+                'SELECT `discordId`, `mcId` FROM `import_stage`;').fetchall()
+            self._conn.execute(
+                'INSERT INTO `whitelist` (`discordId`, `mcId`) ' +
+                'SELECT `discordId`, `mcId` FROM `import_stage` WHERE true ' +
+                'ON CONFLICT (`discordId`) DO UPDATE SET `mcId` = excluded.`mcId`;')
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+        if policy == 'replace':
+            for dc_id, _ in conflicts:
+                self._index_rem(dc_id)
+        for dc_id, mc_id in staged:
+            self._index_set(dc_id, mc_id)
+        report.updated += updated
+        report.inserted += len(staged) - updated
+
+    def get_whitelist_by_mc_id(self, mc_id: str) -> (str, str):
+        with self._lock:
+            dc_id = self._by_mc_id.get(mc_id.lower())
+            bound_mc_id = self._by_discord_id.get(dc_id) if dc_id is not None else None
+        if bound_mc_id is None:
             return (None, None)
-        print(row)
-        return row
+        return (dc_id, bound_mc_id)
 
     def get_whitelist_by_discord_id(self, discord_id: str) -> (str, str):
-        res = self._conn.execute(
-            'SELECT `discordId`, `mcId` FROM `whitelist` WHERE ' +
-            '`discordId` = ?;', (discord_id,))
-        row = res.fetchone()
-        if row is None:
+        with self._lock:
+            mc_id = self._by_discord_id.get(discord_id)
+        if mc_id is None:
             return (None, None)
-        return row
+        return (discord_id, mc_id)
 
     def set_witelist(self, discord_id: str, mc_id: str) -> str:
-        dc_id, old_mc_id = self.get_whitelist_by_discord_id(discord_id)
+        with self._lock:
+            old_mc_id = self._by_discord_id.get(discord_id)
 
-        if dc_id is None:
-            self._conn.execute(
-                'INSERT INTO `whitelist` (`discordId`, `mcId`) VALUES ' +
-                '(?, ?);', (discord_id, mc_id))
-        else:
-            self._conn.execute(
-                'UPDATE `whitelist` SET `mcId` = ? WHERE ' +
-                '`discordId` = ?;', (mc_id, discord_id))
-
-        self._conn.commit()
+        self._conn.execute(
+            'INSERT INTO `whitelist` (`discordId`, `mcId`) VALUES (?, ?) ' +
+            'ON CONFLICT (`discordId`) DO UPDATE SET ' +
+            '`mcId` = excluded.`mcId`;', (discord_id, mc_id))
+        self._commit()
+        self._index_set(discord_id, mc_id)
         return old_mc_id
 
     def rem_witelist(self, ident: str):
         self._conn.execute(
             'DELETE FROM `whitelist` WHERE ' +
-            '`discordId` = ? OR `mcId` = ?;', (ident, ident))
-        self._conn.commit()
-
-    def get_admin_role(self, guild_id: str) -> str:
-        res = self._conn.execute(
-            'SELECT `adminRoleId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        role = res.fetchone()
-        return role[0] if role else None
+            '`discordId` = ? OR `mcId` = ? COLLATE NOCASE;', (ident, ident))
+        self._commit()
+        self._index_rem(ident)
 
-    def set_admin_role(self, guild_id: str, role_id: str):
-        res = self._conn.execute(
-            'SELECT `guildId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        res_guild_id = res.fetchone()
+    def bind_witelist(self, discord_id: str, mc_id: str, server_ids: list,
+                      add: bool = True) -> (str, list):
+        """
+        Binds mc_id to discord_id and records the removal
+        of the previously bound mc id and, if add is true,
+        the addition of mc_id in the outbox of every
+        server in one transaction. Returns the old mc id
+        and the created outbox entries as (id, server id).
+        """
+        with self._lock:
+            old_mc_id = self._by_discord_id.get(discord_id)
 
-        if res_guild_id is None:
+        with _savepoint(self._conn):
             self._conn.execute(
-                'INSERT INTO `guilds` (`guildId`, `adminRoleId`) VALUES ' +
-                '(?, ?);', (guild_id, role_id))
-        else:
+                'INSERT INTO `whitelist` (`discordId`, `mcId`) VALUES (?, ?) ' +
+                'ON CONFLICT (`discordId`) DO UPDATE SET ' +
+                '`mcId` = excluded.`mcId`;', (discord_id, mc_id))
+            entries = []
+            if old_mc_id is not None:
+                entries += self._add_outbox(server_ids, 'remove', old_mc_id)
+            if add:
+                entries += self._add_outbox(server_ids, 'add', mc_id)
+
+        self._commit()
+        self._index_set(discord_id, mc_id)
+        return old_mc_id, entries
+
+    def unbind_witelist(self, discord_id: str, server_ids: list) -> (str, list):
+        """
+        Removes the binding of discord_id and records the
+        removal of the bound mc id in the outbox of every
+        server in one transaction. Returns the unbound mc
+        id and the created outbox entries.
+        """
+        with self._lock:
+            mc_id = self._by_discord_id.get(discord_id)
+        if mc_id is None:
+            return None, []
+
+        with _savepoint(self._conn):
             self._conn.execute(
-                'UPDATE `guilds` SET `adminRoleId` = ? WHERE ' +
-                '`guildId` = ?;', (role_id, guild_id))
+                'DELETE FROM `whitelist` WHERE `discordId` = ?;', (discord_id,))
+            entries = self._add_outbox(server_ids, 'remove', mc_id)
 
-        self._conn.commit()
+        self._commit()
+        self._index_rem(discord_id)
+        return mc_id, entries
+
+    def unbind_witelist_many(self, discord_ids: list, server_ids: list) -> (list, list):
+        """
+        Removes the bindings of all discord_ids and
+        records the removals of the bound mc ids in the
+        outbox of every server in one transaction.
+        Returns the unbound mc ids and the created outbox
+        entries.
+        """
+        with self._lock:
+            bound = [(dc_id, self._by_discord_id[dc_id]) for dc_id in set(discord_ids)
+                     if dc_id in self._by_discord_id]
+        if not bound:
+            return [], []
+
+        entries = []
+        with _savepoint(self._conn):
+            for i in range(0, len(bound), _MAX_QUERY_PARAMS):
+                chunk = [dc_id for dc_id, _ in bound[i:i + _MAX_QUERY_PARAMS]]
+                self._conn.execute(
+                    'DELETE FROM `whitelist` WHERE `discordId` IN ({});'.format(
+                        ', '.join('?' * len(chunk))), chunk)
+            for _, mc_id in bound:
+                entries += self._add_outbox(server_ids, 'remove', mc_id)
+
+        self._commit()
+        for dc_id, _ in bound:
+            self._index_rem(dc_id)
+        return [mc_id for _, mc_id in bound], entries
+
+    # Guild settings are stored in one row per guild
+    # which is created by the first setter called.
+    # Rows are loaded as a whole into GuildConfig
+    # records which are cached per guild and updated
+    # by the setters after writing through.
+
+    def _load_guild_configs(self, guild_ids: list):
+        for i in range(0, len(guild_ids), _MAX_QUERY_PARAMS):
+            chunk = guild_ids[i:i + _MAX_QUERY_PARAMS]
+            res = self._conn.execute(
+                'SELECT `guildId`, `adminRoleId`, `statusChannelId`, ' +
+                '`statusMessageId`, `disabled` FROM `guilds` WHERE ' +
+                '`guildId` IN ({});'.format(', '.join('?' * len(chunk))),
+                chunk)
+            loaded = {row[0]: GuildConfig(*row) for row in res.fetchall()}
+            with self._lock:
+                for guild_id in chunk:
+                    self._guilds[guild_id] = loaded.get(guild_id) or GuildConfig(guild_id)
+
+    def warm_guild_configs(self, guild_ids: list = None):
+        """
+        Loads the configs of the given guilds which are
+        not cached yet or, if no guild ids are passed,
+        of all guilds stored in the database.
+        """
+        if guild_ids is None:
+            res = self._conn.execute(
+                'SELECT `guildId`, `adminRoleId`, `statusChannelId`, ' +
+                '`statusMessageId`, `disabled` FROM `guilds`;')
+            rows = res.fetchall()
+            with self._lock:
+                for row in rows:
+                    self._guilds.setdefault(row[0], GuildConfig(*row))
+            return
+
+        with self._lock:
+            missing = [str(g) for g in guild_ids if str(g) not in self._guilds]
+        self._load_guild_configs(missing)
+
+    def cached_guild_config(self, guild_id: str) -> GuildConfig:
+        with self._lock:
+            return self._guilds.get(str(guild_id))
+
+    def get_guild_config(self, guild_id: str) -> GuildConfig:
+        guild_id = str(guild_id)
+        cfg = self.cached_guild_config(guild_id)
+        if cfg is None:
+            self._load_guild_configs([guild_id])
+            cfg = self.cached_guild_config(guild_id)
+        return cfg
+
+    def _set_guild_field(self, guild_id: str, field: str, value):
+        guild_id = str(guild_id)
+        self._conn.execute(
+            'INSERT INTO `guilds` (`guildId`, `{0}`) VALUES (?, ?) '.format(field) +
+            'ON CONFLICT (`guildId`) DO UPDATE SET ' +
+            '`{0}` = excluded.`{0}`;'.format(field), (guild_id, value))
+        self._commit()
+        with self._lock:
+            cfg = self._guilds.get(guild_id)
+            if cfg is not None:
+                setattr(cfg, _GUILD_FIELDS[field], value)
+
+    def get_admin_role(self, guild_id: str) -> str:
+        return self.get_guild_config(guild_id).admin_role_id
+
+    def set_admin_role(self, guild_id: str, role_id: str):
+        self._set_guild_field(guild_id, 'adminRoleId', str(role_id))
 
     def get_status_channel(self, guild_id: str) -> str:
-        res = self._conn.execute(
-            'SELECT `statusChannelId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        chan = res.fetchone()
-        return chan[0] if chan else None
+        return self.get_guild_config(guild_id).status_channel_id
 
     def set_status_channel(self, guild_id: str, channel_id: str):
-        res = self._conn.execute(
-            'SELECT `guildId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        res_guild_id = res.fetchone()
+        self._set_guild_field(guild_id, 'statusChannelId', str(channel_id))
 
-        if res_guild_id is None:
-            self._conn.execute(
-                'INSERT INTO `guilds` (`guildId`, `statusChannelId`) VALUES ' +
-                '(?, ?);', (guild_id, channel_id))
-        else:
-            self._conn.execute(
-                'UPDATE `guilds` SET `statusChannelId` = ? WHERE ' +
-                '`guildId` = ?;', (channel_id, guild_id))
+    def get_status_message(self, guild_id: str) -> str:
+        return self.get_guild_config(guild_id).status_message_id
 
-        self._conn.commit()
+    def set_status_message(self, guild_id: str, message_id: str):
+        self._set_guild_field(guild_id, 'statusMessageId', str(message_id))
 
-    def get_status_message(self, guild_id: str) -> str:
+    def get_disabled(self, guild_id: str) -> bool:
+        return self.get_guild_config(guild_id).disabled
+
+    def set_disabled(self, guild_id: str, disabled: bool):
+        self._set_guild_field(guild_id, 'disabled', bool(disabled))
+
+    # Managed minecraft servers are registered by name
+    # so other tables can reference them by a stable id.
+    # Their RCON credentials only live in the config.
+
+    def get_servers(self) -> list:
         res = self._conn.execute(
-            'SELECT `statusMessageId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        msg = res.fetchone()
-        return msg[0] if msg else None
+            'SELECT `id`, `name`, `address`, `serverDir`, `serverLog` ' +
+            'FROM `servers` ORDER BY `id`;')
+        return res.fetchall()
 
-    def set_status_message(self, guild_id: str, message_id: str):
+    def set_server(self, name: str, address: str, server_dir: str,
+                   server_log: str) -> int:
+        self._conn.execute(
+            'INSERT INTO `servers` (`name`, `address`, `serverDir`, `serverLog`) ' +
+            'VALUES (?, ?, ?, ?) ON CONFLICT (`name`) DO UPDATE SET ' +
+            '`address` = excluded.`address`, `serverDir` = excluded.`serverDir`, ' +
+            '`serverLog` = excluded.`serverLog`;',
+            (name, address, server_dir, server_log))
+        self._commit()
         res = self._conn.execute(
-            'SELECT `guildId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        res_guild_id = res.fetchone()
+            'SELECT `id` FROM `servers` WHERE `name` = ?;', (name,))
+        return res.fetchone()[0]
+
+    # Whitelist mutations are recorded per server in
+    # the outbox together with the binding change and
+    # deleted once they were applied to the server, so
+    # no mutation is lost while a server is unreachable
+    # or the bot restarts.
 
-        if res_guild_id is None:
+    def _add_outbox(self, server_ids: list, action: str, mc_id: str) -> list:
+        now = int(time.time())
+        entries = []
+        for server_id in server_ids:
+            cur = self._conn.execute(
+                'INSERT INTO `outbox` (`serverId`, `action`, `mcId`, `created`) ' +
+                'VALUES (?, ?, ?, ?);', (server_id, action, mc_id, now))
+            entries.append((cur.lastrowid, server_id))
+        return entries
+
+    def get_outbox(self, server_id: int, limit: int = 256) -> list:
+        res = self._conn.execute(
+            'SELECT `id`, `action`, `mcId`, `attempts` FROM `outbox` ' +
+            'WHERE `serverId` = ? ORDER BY `id` LIMIT ?;', (server_id, limit))
+        return res.fetchall()
+
+    def get_pending_outbox(self, ids: list) -> set:
+        """
+        Returns those of the given outbox entry ids which
+        are not applied yet.
+        """
+        pending = set()
+        for i in range(0, len(ids), _MAX_QUERY_PARAMS):
+            chunk = ids[i:i + _MAX_QUERY_PARAMS]
+            res = self._conn.execute(
+                'SELECT `id` FROM `outbox` WHERE `id` IN ({});'.format(
+                    ', '.join('?' * len(chunk))), chunk)
+            pending.update(row[0] for row in res.fetchall())
+        return pending
+
+    def ack_outbox(self, ids: list):
+        for i in range(0, len(ids), _MAX_QUERY_PARAMS):
+            chunk = ids[i:i + _MAX_QUERY_PARAMS]
             self._conn.execute(
-                'INSERT INTO `guilds` (`guildId`, `statusMessageId`) VALUES ' +
-                '(?, ?);', (guild_id, message_id))
-        else:
+                'DELETE FROM `outbox` WHERE `id` IN ({});'.format(
+                    ', '.join('?' * len(chunk))), chunk)
+        self._commit()
+
+    def fail_outbox(self, ids: list, error: str):
+        for i in range(0, len(ids), _MAX_QUERY_PARAMS):
+            chunk = ids[i:i + _MAX_QUERY_PARAMS]
             self._conn.execute(
-                'UPDATE `guilds` SET `statusMessageId` = ? WHERE ' +
-                '`guildId` = ?;', (message_id, guild_id))
+                'UPDATE `outbox` SET `attempts` = `attempts` + 1, `lastError` = ? ' +
+                'WHERE `id` IN ({});'.format(', '.join('?' * len(chunk))),
+                [error] + chunk)
+        self._commit()
 
-        self._conn.commit()
+    # Play sessions are derived from the online players
+    # and written in batches. Playtime is rolled up per
+    # day, server and player on write, so leaderboards
+    # only read the rollups of the requested days.
 
-    def get_disabled(self, guild_id: str) -> bool:
+    def add_player_history(self, sessions: list, playtime: list, last_seen: list):
+        """
+        Records the closed sessions as (server id, mc id,
+        joined, left), adds the playtime as (day, server
+        id, mc id, seconds, sessions) to the rollups and
+        updates the last seen times given as (mc id,
+        server id, seen) in one transaction.
+        """
+        with _savepoint(self._conn):
+            self._conn.executemany(
+                'INSERT INTO `sessions` (`serverId`, `mcId`, `joined`, `left`) ' +
+                'VALUES (?, ?, ?, ?);', sessions)
+            self._conn.executemany(
+                'INSERT INTO `playtime` (`day`, `serverId`, `mcId`, `seconds`, `sessions`) ' +
+                'VALUES (?, ?, ?, ?, ?) ON CONFLICT (`day`, `serverId`, `mcId`) DO UPDATE SET ' +
+                '`seconds` = `seconds` + excluded.`seconds`, ' +
+                '`sessions` = `sessions` + excluded.`sessions`;', playtime)
+            self._conn.executemany(
+                'INSERT INTO `lastSeen` (`mcId`, `serverId`, `seen`) VALUES (?, ?, ?) ' +
+                'ON CONFLICT (`mcId`) DO UPDATE SET `serverId` = excluded.`serverId`, ' +
+                '`seen` = excluded.`seen` WHERE excluded.`seen` >= `seen`;', last_seen)
+        self._commit()
+
+    def get_top_playtime(self, since_day: int, limit: int, server_id: int = None) -> list:
+        """
+        Returns the (mc id, seconds, sessions) of the
+        players with the most playtime since since_day,
+        on all servers or the given server.
+        """
+        where = '`day` >= ?'
+        args = [since_day]
+        if server_id is not None:
+            where += ' AND `serverId` = ?'
+            args.append(server_id)
         res = self._conn.execute(
-            'SELECT `disabled` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        state = res.fetchone()
-        return state[0] if state else False
+            'SELECT `mcId`, SUM(`seconds`) AS `total`, SUM(`sessions`) FROM `playtime` ' +
+            'WHERE {} GROUP BY `mcId` ORDER BY `total` DESC LIMIT ?;'.format(where),
+            args + [limit])
+        return res.fetchall()
 
-    def set_disabled(self, guild_id: str, disabled: bool):
+    def get_last_seen(self, mc_id: str) -> (str, int):
+        """
+        Returns the name of the server the player was
+        last seen on and the time or (None, None).
+        """
         res = self._conn.execute(
-            'SELECT `guildId` from `guilds` WHERE ' +
-            '`guildId` = ?;', (guild_id,))
-        res_guild_id = res.fetchone()
+            'SELECT `s`.`name`, `l`.`seen` FROM `lastSeen` `l` ' +
+            'LEFT JOIN `servers` `s` ON `s`.`id` = `l`.`serverId` ' +
+            'WHERE `l`.`mcId` = ?;', (mc_id,)).fetchone()
+        return res if res is not None else (None, None)
 
-        if res_guild_id is None:
-            self._conn.execute(
-                'INSERT INTO `guilds` (`guildId`, `disabled`) VALUES ' +
-                '(?, ?);', (guild_id, disabled))
-        else:
-            self._conn.execute(
-                'UPDATE `guilds` SET `disabled` = ? WHERE ' +
-                '`guildId` = ?;', (disabled, guild_id))
+    def prune_player_history(self, before: int, limit: int = 10000) -> int:
+        """
+        Deletes up to limit sessions, rollups and last
+        seen times each which are older than the unix
+        time before and returns the number of deleted rows.
+        """
+        deleted = 0
+        for stmt, arg in (
+                ('DELETE FROM `sessions` WHERE `id` IN (SELECT `id` FROM `sessions` ' +
+                 'WHERE `left` < ? LIMIT ?);', before),
+                ('DELETE FROM `playtime` WHERE `rowid` IN (SELECT `rowid` FROM `playtime` ' +
+                 'WHERE `day` < ? LIMIT ?);', before // 86400),
+                ('DELETE FROM `lastSeen` WHERE `rowid` IN (SELECT `rowid` FROM `lastSeen` ' +
+                 'WHERE `seen` < ? LIMIT ?);', before)):
+            deleted += self._conn.execute(stmt, (arg, limit)).rowcount
+        self._commit()
+        return deleted
 
-        self._conn.commit()
+
+class _savepoint:
+    """
+    Runs the statements of the block in a savepoint,
+    which is rolled back if the block raises, so
+    multi-statement writes are atomic even when group
+    committed with other writes. Outside of a
+    transaction, releasing the savepoint would commit
+    it, so a transaction is begun first and left to
+    the caller to commit.
+    """
+
+    _conn: Connection
+    _began: bool
+
+    def __init__(self, conn: Connection):
+        self._conn = conn
+        self._began = False
+
+    def __enter__(self):
+        self._began = not self._conn.in_transaction
+        if self._began:
+            self._conn.execute('BEGIN;')
+        self._conn.execute('SAVEPOINT `block`;')
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None and self._began:
+            self._conn.rollback()
+            return False
+        if exc_type is not None:
+            self._conn.execute('ROLLBACK TO `block`;')
+        self._conn.execute('RELEASE `block`;')
+        return False
@@ -1,49 +1,219 @@
-import re
+import json
+import time
 import logging
 import asyncio
 import argparse
 import discord
 import asyncrcon
-from asyncrcon import AsyncRCON
-from database import SQLite
+import metrics
+from database import AsyncSQLite
+from mcserver import Server, ServerConfig, ServerRegistry, Reconciler, load_servers_config
 from discord import Member, Embed, Message
 from discord.ext import commands
-from shared import EMBED_COLOR
-from cogs import WhitelistMgmt, Admin
+from shared import StartupTimer, Batcher, EMBED_COLOR
+from status import StatusUpdater, AdaptiveInterval, PlayerHistory
+from cogs import WhitelistMgmt, Admin, Stats
+
+
+_TICK_DURATION = metrics.gauge(
+    'status_tick_duration_seconds',
+    'Duration of the last status update tick')
+_POLL_INTERVAL = metrics.gauge(
+    'status_poll_interval_seconds',
+    'Currently chosen interval of the status poll loop')
+_COMMAND_LATENCY = metrics.histogram(
+    'command_duration_seconds',
+    'Duration of bot commands by command', ('command',))
+_COMMAND_ERRORS = metrics.counter(
+    'command_errors',
+    'Bot commands which raised an exception by command', ('command',))
+
+# Options which are applied by the reload command,
+# changes of all others require a restart.
+_SERVER_OPTIONS = {
+    'rcon_address', 'rcon_password', 'rcon_encoding', 'rcon_cmd_interval',
+    'rcon_reload_window', 'rcon_pool_size', 'rcon_timeout', 'rcon_queue_timeout',
+    'rcon_health_interval', 'rcon_list_ttl', 'rcon_whitelist_ttl',
+    'server_dir', 'server_log', 'uuid_cache', 'servers_config',
+}
+_STATUS_OPTIONS = {
+    'rcon_fetch_freq', 'rcon_fetch_max', 'server_log_reconcile_freq',
+}
+_RELOADABLE = _SERVER_OPTIONS | _STATUS_OPTIONS | {
+    'prefix', 'allow_sudo', 'log_level',
+}
+
+
+class _ReloadArgumentParser(argparse.ArgumentParser):
+    # Invalid options on reload must not exit the
+    # running bot.
+    def error(self, message):
+        raise Exception(message)
+
+
+def load_config(fileloc: str) -> dict:
+    """
+    Loads option values from a JSON file in the format
+
+        {"prefix": "!", "rcon-password": "...", "allow-sudo": true}
+
+    keyed by the long option names.
+    """
+    with open(fileloc, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError('the config file must contain a JSON object')
+    return {k.lstrip('-').replace('-', '_'): v for k, v in data.items()}
 
 
-def parse_args():
+def parse_args(reloading: bool = False):
     """
     Initializes command line arguments and
     parses them on startup returning the parsed
-    args namespace.
+    args namespace. Options from the config file
+    are used unless they are passed on the command
+    line. When reloading, invalid options raise
+    instead of exiting.
     """
-    parser = argparse.ArgumentParser()
+    parser = (_ReloadArgumentParser if reloading else argparse.ArgumentParser)()
+
+    parser.add_argument(
+        '--config', '-c', default=None, type=str,
+        help='A JSON file of option values by their long name, which is ' +
+             're-read by the reload command')
 
     bot = parser.add_argument_group('Discord Bot')
     bot.add_argument(
-        '--token', '-t', required=True, type=str,
-        help='The discord bot token')
+        '--token', '-t', default=None, type=str,
+        help='The discord bot token, required')
     bot.add_argument(
         '--prefix', '-p', default='>', type=str,
         help='The command prefix of the bot (def: \'>\')')
     bot.add_argument(
         '--allow-sudo', default=False, action='store_true',
         help='Whether or not sudo command should be enabled')
+    bot.add_argument(
+        '--status-concurrency', default=20, type=int,
+        help='The maximum number of guild status messages updated ' +
+             'concurrently (def: 20)')
+    bot.add_argument(
+        '--member-remove-window', default=1.0, type=float,
+        help='The time window in seconds in which departing members are ' +
+             'collected and unbound together (def: 1.0)')
+    bot.add_argument(
+        '--low-memory', default=False, action='store_true',
+        help='Run without member and message caches and with minimal ' +
+             'gateway intents for very large guilds')
 
     rcon = parser.add_argument_group('RCON Connection')
     rcon.add_argument(
         '--rcon-address', '-raddr', default='localhost:25575', type=str,
         help='The address of the RCON server (def: \'localhost:25575\')')
     rcon.add_argument(
-        '--rcon-password', '-rpw', required=True, type=str,
-        help='The password of the RCON server')
+        '--rcon-password', '-rpw', default=None, type=str,
+        help='The password of the RCON server, required unless ' +
+             '--servers-config is passed')
     rcon.add_argument(
         '--rcon-encoding', default='utf-8', type=str,
         help='The encoding to be used for RCON payloads')
     rcon.add_argument(
-        '--rcon-fetch-freq', default=30, type=int,
-        help='The interval in seconds in which the server stats will be polled')
+        '--rcon-fetch-freq', '--rcon-fetch-min', default=30, type=float,
+        help='The minimum interval in seconds in which the server stats will be ' +
+             'polled while they are changing (def: 30)')
+    rcon.add_argument(
+        '--rcon-fetch-max', default=300, type=float,
+        help='The maximum interval in seconds the poll interval backs off to ' +
+             'while the server stats are unchanged or RCON is failing (def: 300)')
+    rcon.add_argument(
+        '--rcon-cmd-interval', default=0.05, type=float,
+        help='The minimum time in seconds between two whitelist commands (def: 0.05)')
+    rcon.add_argument(
+        '--rcon-reload-window', default=0.1, type=float,
+        help='The time window in seconds in which whitelist mutations are ' +
+             'collected before a single reload is issued (def: 0.1)')
+    rcon.add_argument(
+        '--rcon-pool-size', default=2, type=int,
+        help='The number of RCON connections opened per server (def: 2)')
+    rcon.add_argument(
+        '--rcon-timeout', default=10, type=float,
+        help='The time in seconds after which an unanswered RCON command ' +
+             'fails and its connection is reopened (def: 10)')
+    rcon.add_argument(
+        '--rcon-queue-timeout', default=30, type=float,
+        help='The time in seconds commands are queued while the RCON ' +
+             'server is unavailable (def: 30)')
+    rcon.add_argument(
+        '--rcon-health-interval', default=30, type=float,
+        help='The interval in seconds in which idle RCON connections ' +
+             'are probed (def: 30)')
+    rcon.add_argument(
+        '--rcon-list-ttl', default=5, type=float,
+        help='The time in seconds the response of \'list\' is cached, ' +
+             '0 to only merge concurrent requests (def: 5)')
+    rcon.add_argument(
+        '--rcon-whitelist-ttl', default=30, type=float,
+        help='The time in seconds the response of \'whitelist list\' is cached ' +
+             'until the whitelist is changed, 0 to only merge concurrent ' +
+             'requests (def: 30)')
+
+    server = parser.add_argument_group('Minecraft Server')
+    server.add_argument(
+        '--server-dir', default=None, type=str,
+        help='The directory of the Minecraft server, enables the --bulk ' +
+             'mode of sync and purge which writes whitelist.json directly')
+    server.add_argument(
+        '--server-log', default=None, type=str,
+        help='The servers logs/latest.log file. When set, online players are ' +
+             'tracked by tailing the log instead of polling via RCON')
+    server.add_argument(
+        '--server-log-reconcile-freq', default=300, type=int,
+        help='The interval in seconds in which the players tracked from the ' +
+             'server log are reconciled via RCON, 0 to disable (def: 300)')
+    server.add_argument(
+        '--uuid-cache', default=None, type=str,
+        help='An additional username to UUID cache file in the format of ' +
+             'the servers usercache.json used by the --bulk mode')
+
+    server.add_argument(
+        '--servers-config', default=None, type=str,
+        help='A JSON file configuring multiple servers managed by this ' +
+             'bot instance, replacing the RCON and server arguments above')
+
+    hst = parser.add_argument_group('Player History')
+    hst.add_argument(
+        '--history-flush-interval', default=60, type=float,
+        help='The interval in seconds in which player sessions and playtime ' +
+             'are written to the database (def: 60)')
+    hst.add_argument(
+        '--history-retention-days', default=90, type=int,
+        help='The number of days player sessions and playtime are kept, ' +
+             '0 to keep them forever (def: 90)')
+
+    rec = parser.add_argument_group('Reconciliation')
+    rec.add_argument(
+        '--reconcile-interval', default=3600, type=float,
+        help='The interval in seconds in which the server whitelists are ' +
+             'reconciled with the database in the background, 0 to disable (def: 3600)')
+    rec.add_argument(
+        '--reconcile-cmd-interval', default=1.0, type=float,
+        help='The minimum time in seconds between two whitelist commands ' +
+             'sent by the reconciler (def: 1.0)')
+    rec.add_argument(
+        '--reconcile-max-fixes', default=500, type=int,
+        help='The maximum number of entries fixed per server and of ' +
+             'departed members unbound per reconciliation run (def: 500)')
+    rec.add_argument(
+        '--reconcile-remove-unbound', default=False, action='store_true',
+        help='Also remove whitelist entries which are not bound to any ' +
+             'account, e.g. added on the server console')
+
+    mtr = parser.add_argument_group('Metrics')
+    mtr.add_argument(
+        '--metrics-port', default=None, type=int,
+        help='Serve Prometheus metrics on this port under /metrics (def: disabled)')
+    mtr.add_argument(
+        '--metrics-address', default='127.0.0.1', type=str,
+        help='The address the metrics endpoint binds to (def: \'127.0.0.1\')')
 
     parser.add_argument(
         '--log-level', '-l', default=20, type=int,
@@ -51,94 +221,201 @@ def parse_args():
     parser.add_argument(
         '--db-file', '-db', default='database.db', type=str,
         help='Set database file location (def: database.db)')
+    parser.add_argument(
+        '--db-commit-delay', default=0.05, type=float,
+        help='The time window in seconds in which database writes ' +
+             'are grouped into one transaction (def: 0.05)')
 
-    return parser.parse_args()
-
-
-def get_status_message(matches: list, db: SQLite) -> discord.Embed:
-    em = discord.Embed()
-    em.color = EMBED_COLOR
-    em.title = 'Server Status'
-    em.description = '**{}** / **{}** players are online.'.format(
-        matches[0], matches[1])
+    args = parser.parse_args()
+    if args.config:
+        try:
+            config = load_config(args.config)
+        except (OSError, ValueError) as e:
+            parser.error('failed loading {}: {}'.format(args.config, e))
+        unknown = [k for k in config if k == 'config' or k not in vars(args)]
+        if unknown:
+            parser.error('unknown options in {}: {}'.format(args.config, ', '.join(unknown)))
+        parser.set_defaults(**config)
+        args = parser.parse_args()
 
-    player_list = []
-    name_map = dict((v, k) for k, v in db.get_whitelist().items())
+    if not args.token:
+        parser.error('--token is required')
+    if not args.servers_config and not args.rcon_password:
+        parser.error('either --rcon-password or --servers-config is required')
 
-    if len(matches) >= 3 and matches[2]:
-        player_names = matches[2].split(',')
-        for name in player_names:
-            name = name.strip().lower()
-            dc_id = name_map.get(name)
-            d_name = '`{}`'.format(name)
-            if dc_id:
-                d_name += ' (<@{}>)'.format(dc_id)
-            player_list.append(d_name)
-    else:
-        player_list = ['*no players online*']
+    return args
 
-    em.add_field(name='Online Players', value='\n'.join(player_list), inline=False)
 
-    return em
+async def connect_servers(servers: ServerRegistry, timer: StartupTimer):
+    with timer.phase('rcon'):
+        await servers.connect_all()
 
 
-async def fetch_server_info(bot: commands.Bot, rcon: AsyncRCON, db: SQLite, freq: int):
+async def update_server_status(bot: commands.Bot, db: AsyncSQLite, servers: ServerRegistry,
+                               updater: StatusUpdater, history: PlayerHistory,
+                               interval: AdaptiveInterval, reconcile_freq: int,
+                               timer: StartupTimer):
+    """
+    Fetches the online players of all servers, records
+    their sessions and updates the status messages in
+    the chosen interval
+    or, for servers whose log is tailed, as soon as
+    their online players change. Servers whose fetch
+    failed are displayed as offline and polled with
+    backoff while their RCON pool reconnects.
+    """
     await bot.wait_until_ready()
 
-    is_first = True
-    status_messages = {}
-
-    while not bot.is_closed():
-        if not is_first:
-            await asyncio.sleep(freq)
-        else:
-            is_first = False
+    with timer.phase('cache'):
+        await db.warm_guild_configs([g.id for g in bot.guilds])
 
-        try:
-            res = await rcon.command('list')
+    last_players = None
 
-            match = re.match(r'^There are (\d+)\/(\d+) players online:\s?(.*)', res, re.MULTILINE | re.S)
+    while not bot.is_closed():
+        started = time.perf_counter()
+        players = await servers.broadcast(lambda s: s.players(reconcile_freq))
+        history.observe(players)
 
-            match_groups = match.groups()
+        failed = [(name, res) for name, res in players.items()
+                  if isinstance(res, Exception)]
 
-            if len(match_groups) < 2:
-                continue
+        try:
+            await updater.update(players)
+            _TICK_DURATION.set(time.perf_counter() - started)
+        except Exception as e:
+            logging.error('Failed updating server status: {}'.format(e))
+
+        if not timer.finished:
+            timer.stop('first_status')
+            timer.finish()
+
+        if failed:
+            delay = interval.failed()
+            for name, err in failed:
+                logging.error('Failed fetching server info of {} (retrying in {:.1f}s): {}'.format(
+                    name, delay, err))
+        elif players == last_players:
+            interval.stable()
+        else:
+            interval.changed()
+        last_players = players
 
-            online = match_groups[0]
-            slots = match_groups[1]
-            activity = discord.Game('{}/{} online'.format(online, slots))
-            await bot.change_presence(activity=activity, status=discord.Status.online)
+        logging.debug('Next status poll in {:.1f}s'.format(interval.current))
+        waiters = [asyncio.ensure_future(w) for w in servers.wait_changed()]
+        _, pending = await asyncio.wait(
+            [asyncio.ensure_future(asyncio.sleep(interval.current))] + waiters,
+            return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        servers.clear_changed()
 
-            for guild in bot.guilds:
-                chan_id = db.get_status_channel(guild.id)
-                if not chan_id:
-                    continue
 
-                chan: discord.TextChannel = guild.get_channel(int(chan_id))
-                if not chan:
-                    db.set_status_channel(guild.id, '')
-                    continue
+def guild_members(bot: commands.Bot) -> dict:
+    """
+    Returns the ids of the members by guild id, None
+    for guilds whose member list is incomplete.
+    """
+    return {str(g.id): set(str(m.id) for m in g.members)
+            if bot.intents.members and g.chunked else None
+            for g in bot.guilds}
 
-                status_msg = status_messages.get(guild.id)
-                if not status_msg:
-                    msg_id = db.get_status_message(guild.id)
-                    if msg_id:
-                        status_msg = await chan.fetch_message(msg_id)
 
-                if not status_msg:
-                    status_msg = await chan.send(embed=get_status_message(match_groups, db))
-                    db.set_status_message(guild.id, status_msg.id)
-                else:
-                    await status_msg.edit(embed=get_status_message(match_groups, db))
+def bot_options(low_memory: bool) -> dict:
+    """
+    Returns the gateway and cache options of the bot.
+    Departing members are only received with the
+    members intent, with which discord.py caches all
+    members of the guilds and the last messages by
+    default. The bot only reads message authors, which
+    come with the messages, and the ids of departing
+    members, so in low memory mode only the events the
+    cogs handle are received and nothing but the
+    guilds and channels is cached.
+    """
+    if not low_memory:
+        intents = discord.Intents.default()
+        intents.members = True
+        return dict(intents=intents)
+
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.guild_reactions = True
+    intents.members = True
+    return dict(
+        intents=intents,
+        member_cache_flags=discord.MemberCacheFlags.none(),
+        chunk_guilds_at_startup=False,
+        max_messages=None)
+
+
+async def reconcile_servers(bot: commands.Bot, reconciler: Reconciler):
+    await bot.wait_until_ready()
+    await reconciler.run()
 
-                status_messages[guild.id] = status_msg
 
-        except Exception as e:
-            logging.error(e)
-            continue
+def server_configs(args) -> list:
+    """
+    Returns the configs of the managed servers, either
+    loaded from the servers config file or built from
+    the RCON and server command line arguments.
+    """
+    if args.servers_config:
+        return load_servers_config(args.servers_config)
+    return [ServerConfig(
+        'default', args.rcon_address, args.rcon_password,
+        args.rcon_encoding, args.server_dir, args.server_log, args.uuid_cache)]
+
+
+def server_options(args) -> dict:
+    return dict(
+        cmd_interval=args.rcon_cmd_interval,
+        reload_window=args.rcon_reload_window,
+        cache_ttls={'list': args.rcon_list_ttl,
+                    'whitelist list': args.rcon_whitelist_ttl},
+        size=args.rcon_pool_size, timeout=args.rcon_timeout,
+        queue_timeout=args.rcon_queue_timeout,
+        health_interval=args.rcon_health_interval)
+
+
+async def reload_servers(servers: ServerRegistry, db: AsyncSQLite, configs: list,
+                         options: dict, loop: asyncio.AbstractEventLoop) -> (list, list):
+    """
+    Replaces the managed servers by the given configs.
+    Servers whose config and options are unchanged keep
+    running with their RCON connections, changed and
+    new ones are started and connected, the replaced
+    and removed ones stopped. Returns the started and
+    the stopped servers.
+    """
+    managed, started = [], []
+    for cfg in configs:
+        server = servers.get(cfg.name)
+        if server is None or server.config != cfg or server.options != options:
+            server = Server(cfg, **options)
+            started.append(server)
+        managed.append(server)
+
+    await servers.register(db, started)
+    stopped = servers.replace(managed)
+    for server in stopped:
+        server.stop()
+    for server in started:
+        server.start(loop)
+    await servers.connect_all(started)
+    return started, stopped
 
 
 def main():
+    """
+    Starts the bot. Connecting to the RCON servers,
+    loading the cached database state and logging in
+    to Discord run concurrently, so neither waits for
+    the other and an unreachable server does not keep
+    the bot from starting.
+    """
+    timer = StartupTimer()
+
     args = parse_args()
 
     logging.basicConfig(
@@ -146,19 +423,96 @@ def main():
         format='%(asctime)s | %(levelname)s | %(message)s',
         datefmt='%Y-%m-%d %H:%M:%S')
 
-    rcon = AsyncRCON(args.rcon_address, args.rcon_password,
-                     encoding=args.rcon_encoding)
-
-    db = SQLite(args.db_file)
-
-    bot = commands.Bot(command_prefix=args.prefix)
-
-    bot.loop.run_until_complete(rcon.open_connection())
-    bot.loop.create_task(fetch_server_info(bot, rcon, db, args.rcon_fetch_freq))
-
-    if args.allow_sudo:
-        logging.warning('allow sudo is enabled! This gives acces to the ' +
-                        'RCON console directly out of the discord chat!')
+    servers = ServerRegistry([
+        Server(cfg, **server_options(args)) for cfg in server_configs(args)])
+
+    bot = commands.Bot(command_prefix=args.prefix, **bot_options(args.low_memory))
+
+    with timer.phase('database'):
+        db = AsyncSQLite(args.db_file, commit_delay=args.db_commit_delay)
+        bot.loop.run_until_complete(servers.register(db))
+
+    bot.loop.create_task(connect_servers(servers, timer))
+    bot.loop.create_task(db.warm_guild_configs())
+    servers.start(bot.loop)
+    updater = StatusUpdater(bot, db, concurrency=args.status_concurrency)
+
+    if args.metrics_port:
+        from metrics.server import MetricsServer
+        metrics_server = MetricsServer(args.metrics_address, args.metrics_port)
+        bot.loop.run_until_complete(metrics_server.start())
+
+    history = PlayerHistory(
+        servers, db, flush_interval=args.history_flush_interval,
+        retention_days=args.history_retention_days)
+    bot.loop.create_task(history.run())
+
+    def start_status(args) -> asyncio.Task:
+        interval = AdaptiveInterval(args.rcon_fetch_freq, args.rcon_fetch_max)
+        _POLL_INTERVAL.set_function(lambda: interval.current)
+        return bot.loop.create_task(update_server_status(
+            bot, db, servers, updater, history, interval,
+            args.server_log_reconcile_freq, timer))
+
+    status_task = start_status(args)
+
+    reconciler = None
+    if args.reconcile_interval > 0:
+        reconciler = Reconciler(
+            servers, db, interval=args.reconcile_interval,
+            cmd_interval=args.reconcile_cmd_interval,
+            max_fixes=args.reconcile_max_fixes,
+            remove_unbound=args.reconcile_remove_unbound,
+            guild_members=lambda: guild_members(bot))
+        bot.loop.create_task(reconcile_servers(bot, reconciler))
+
+    def add_cogs(args):
+        if args.allow_sudo:
+            logging.warning('allow sudo is enabled! This gives acces to the ' +
+                            'RCON console directly out of the discord chat!')
+        for cog in (WhitelistMgmt(bot, servers, db),
+                    Admin(bot, servers, db, args.allow_sudo, reconciler, reload_config),
+                    Stats(bot, servers, db, history)):
+            bot.remove_cog(cog.qualified_name)
+            bot.add_cog(cog)
+
+    async def reload_config() -> (list, list):
+        """
+        Re-reads the config files and applies the changed
+        options while the Discord connection and the
+        database stay open. Returns the applied changes
+        and the changed options which require a restart.
+        """
+        nonlocal args, status_task
+        new = parse_args(reloading=True)
+        changed = [k for k, v in vars(new).items() if v != getattr(args, k)]
+        restart = [k for k in changed if k not in _RELOADABLE]
+        # Pending changes are reported again on the next
+        # reload until the bot is restarted.
+        for k in restart:
+            setattr(new, k, getattr(args, k))
+
+        started, stopped = await reload_servers(
+            servers, db, server_configs(new), server_options(new), bot.loop)
+        names = set(servers.names)
+        for server in stopped:
+            if server.name not in names:
+                history.close(server.id)
+
+        bot.command_prefix = new.prefix
+        logging.getLogger().setLevel(new.log_level)
+        if started or stopped or any(k in _STATUS_OPTIONS for k in changed):
+            status_task.cancel()
+            status_task = start_status(new)
+        add_cogs(new)
+        args = new
+
+        applied = [k for k in changed if k in _RELOADABLE and k not in _SERVER_OPTIONS]
+        applied += ['server {}'.format(s.name) for s in started]
+        applied += ['removed server {}'.format(s.name) for s in stopped if s.name not in names]
+        logging.info('Reloaded configuration (applied: {}, requires restart: {})'.format(
+            ', '.join(applied) or '-', ', '.join(restart) or '-'))
+        return applied, restart
 
     ##########
     # EVENTS #
@@ -166,6 +520,8 @@ def main():
 
     @bot.event
     async def on_ready():
+        timer.stop('discord')
+        timer.start('first_status')
         logging.info(
             'Ready (logged in as {}#{} [{}])'.format(
                 bot.user.name, bot.user.discriminator, bot.user.id))
@@ -202,31 +558,59 @@ def main():
             await msg.channel.send(embed=em)
         await bot.process_commands(msg)
 
-    @bot.event
-    async def on_member_remove(member: Member):
-        _, mc_id = db.get_whitelist_by_discord_id(str(member.id))
-        if mc_id is not None:
-            await rcon.command('whitelist remove {}'.format(mc_id))
-            await asyncio.sleep(0.5)
-            await rcon.command('whitelist reload')
-            db.rem_witelist(str(member.id))
+    async def unbind_departed(discord_ids: list):
+        mc_ids, entries = await db.unbind_witelist_many(discord_ids, servers.ids)
+        if entries:
+            logging.info('Unbound {} of {} departed members'.format(
+                len(mc_ids), len(discord_ids)))
+            servers.notify_outbox()
+
+    # Prunes, raids and bans remove many members at once,
+    # which are unbound in one transaction instead.
+    departures = Batcher(unbind_departed, args.member_remove_window)
+
+    if args.low_memory:
+        # member_remove is only raised for cached members,
+        # so departures are taken from the gateway event.
+        @bot.event
+        async def on_socket_response(msg: dict):
+            if msg.get('t') == 'GUILD_MEMBER_REMOVE':
+                departures.add(msg['d']['user']['id'])
+    else:
+        @bot.event
+        async def on_member_remove(member: Member):
+            departures.add(str(member.id))
+
+    @bot.before_invoke
+    async def before_invoke(ctx: commands.Context):
+        ctx.invoke_started = time.perf_counter()
+
+    @bot.after_invoke
+    async def after_invoke(ctx: commands.Context):
+        started = getattr(ctx, 'invoke_started', None)
+        if started is not None:
+            _COMMAND_LATENCY.observe(
+                time.perf_counter() - started, ctx.command.qualified_name)
 
     @bot.event
     async def on_command_error(ctx: commands.Context, err):
+        _COMMAND_ERRORS.inc(ctx.command.qualified_name if ctx.command else '')
         await ctx.send(':warning:  Command raised an exception: ```{}```'.format(err))
 
     ################
     # REGISTRATION #
     ################
 
-    bot.add_cog(WhitelistMgmt(bot, rcon, db))
-    bot.add_cog(Admin(bot, rcon, db, args.allow_sudo))
+    add_cogs(args)
 
     ###########
     # RUN BOT #
     ###########
 
+    timer.start('discord')
     bot.run(args.token)
+    servers.stop()
+    db.close()
 
 
 if __name__ == '__main__':
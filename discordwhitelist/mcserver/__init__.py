@@ -0,0 +1,10 @@
+# flake8: noqa
+from .players import *
+from .rcon import *
+from .pool import *
+from .scheduler import *
+from .outbox import *
+from .sync import *
+from .cache import *
+from .registry import *
+from .reconciler import *
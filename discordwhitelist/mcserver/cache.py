@@ -0,0 +1,116 @@
+import time
+import asyncio
+import metrics
+from typing import Callable
+from .rcon import command_verb
+
+
+_CACHE_HITS = metrics.counter(
+    'rcon_cache_hits',
+    'RCON reads answered from the cache or by a concurrent identical read ' +
+    'by server and command verb', ('server', 'verb'))
+_CACHE_MISSES = metrics.counter(
+    'rcon_cache_misses',
+    'RCON reads sent to the server by server and command verb', ('server', 'verb'))
+
+
+# Seconds the responses of read commands are cached
+# by command verb. Verbs without TTL are only
+# single-flighted.
+DEFAULT_CACHE_TTLS = {
+    'list': 5.0,
+    'whitelist list': 30.0,
+}
+
+
+class _Entry:
+
+    __slots__ = ('raw', 'expires', 'parsed')
+
+    def __init__(self, raw: str, expires: float):
+        self.raw = raw
+        self.expires = expires
+        self.parsed = {}
+
+    def value(self, parse: Callable):
+        if parse is None:
+            return self.raw
+        if parse not in self.parsed:
+            self.parsed[parse] = parse(self.raw)
+        return self.parsed[parse]
+
+
+class ReadCache:
+    """
+    Caches the responses of read commands for the TTL
+    of their verb and single-flights concurrent
+    identical reads into one round trip. Responses
+    are parsed at most once per cached entry, so
+    parsed results are shared between callers and
+    must not be modified.
+
+    invalidate drops all entries and lets reads in
+    flight finish without caching their response.
+    """
+
+    _name: str
+    _ttls: dict
+    _entries: dict
+    _flights: dict
+    _generation: int
+
+    def __init__(self, ttls: dict = None, name: str = 'default'):
+        self._name = name
+        self._ttls = DEFAULT_CACHE_TTLS if ttls is None else ttls
+        self._entries = {}
+        self._flights = {}
+        self._generation = 0
+
+    def invalidate(self):
+        self._generation += 1
+        self._entries.clear()
+        self._flights.clear()
+
+    async def get(self, cmd: str, fetch: Callable, parse: Callable = None,
+                  fresh: bool = False):
+        """
+        Returns the cached response of cmd, parsed by
+        parse if given, or fetches it by calling the
+        coroutine function fetch. With fresh, cached
+        responses are ignored but a read already in
+        flight is joined.
+        """
+        key = ' '.join(cmd.lower().split())
+        verb = command_verb(cmd)
+
+        entry = self._entries.get(key)
+        if entry is not None and not fresh and entry.expires > time.monotonic():
+            _CACHE_HITS.inc(self._name, verb)
+            return entry.value(parse)
+
+        flight = self._flights.get(key)
+        if flight is None:
+            _CACHE_MISSES.inc(self._name, verb)
+            flight = asyncio.ensure_future(
+                self._fetch(key, fetch, self._ttls.get(verb, 0)))
+            self._flights[key] = flight
+        else:
+            _CACHE_HITS.inc(self._name, verb)
+
+        # Callers which are cancelled must not cancel the
+        # read for the others waiting on it.
+        entry = await asyncio.shield(flight)
+        return entry.value(parse)
+
+    async def _fetch(self, key: str, fetch: Callable, ttl: float) -> _Entry:
+        generation = self._generation
+        try:
+            raw = await fetch()
+        finally:
+            if generation == self._generation:
+                self._flights.pop(key, None)
+
+        entry = _Entry(raw, time.monotonic() + ttl)
+        if ttl > 0 and generation == self._generation:
+            self._entries[key] = entry
+        return entry
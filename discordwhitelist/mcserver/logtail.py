@@ -0,0 +1,121 @@
+import os
+import re
+import asyncio
+import logging
+
+
+# Only lines logged by the server itself are matched,
+# so chat messages can not spoof joins. Both the
+# vanilla ('[12:00:00] [Server thread/INFO]: ') and
+# the Spigot/Paper ('[12:00:00 INFO]: ') formats
+# are supported.
+_LINE_PREFIX = r'^\[[^\]]*(?:\] \[Server thread/| )INFO\]: '
+_JOIN_RX = re.compile(_LINE_PREFIX + r'(\w{1,16}) joined the game\s*$')
+_LEFT_RX = re.compile(_LINE_PREFIX + r'(\w{1,16}) left the game\s*$')
+_STOP_RX = re.compile(_LINE_PREFIX + r'Stopping server\s*$')
+
+_MAX_READ = 1 << 20
+
+
+class LogTail:
+    """
+    Incrementally tails the servers 'logs/latest.log'
+    and keeps track of the set of online players by
+    parsing join and leave lines.
+
+    The read offset is remembered between polls, so
+    only new bytes are read. When the file is rotated
+    (its inode changed or it got shorter), it is read
+    again from the start and the online set is reset.
+
+    The changed event is set whenever the online set
+    has changed.
+    """
+
+    _path: str
+    _poll_interval: float
+    _inode: int
+    _offset: int
+    _partial: bytes
+
+    online: set
+    changed: asyncio.Event
+
+    def __init__(self, path: str, poll_interval: float = 0.5):
+        self._path = path
+        self._poll_interval = poll_interval
+        self._inode = None
+        self._offset = 0
+        self._partial = b''
+        self.online = set()
+        self.changed = asyncio.Event()
+
+    def reconcile(self, names: list):
+        names = set(n.lower() for n in names)
+        if names != self.online:
+            logging.debug('reconciled online players from log: {} -> {}'.format(
+                self.online, names))
+            self.online = names
+            self.changed.set()
+
+    def _read_lines(self) -> list:
+        try:
+            st = os.stat(self._path)
+        except FileNotFoundError:
+            return []
+
+        rotated = self._inode is not None and (
+            st.st_ino != self._inode or st.st_size < self._offset)
+        if rotated:
+            self._offset = 0
+            self._partial = b''
+        self._inode = st.st_ino
+
+        if st.st_size == self._offset:
+            return [] if not rotated else [None]
+
+        with open(self._path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read(_MAX_READ)
+        self._offset += len(data)
+
+        data = self._partial + data
+        lines = data.split(b'\n')
+        self._partial = lines.pop()
+
+        res = [None] if rotated else []
+        res.extend(line.decode('utf-8', 'replace') for line in lines)
+        return res
+
+    def _apply(self, lines: list) -> bool:
+        online = set(self.online)
+        for line in lines:
+            if line is None:
+                online.clear()
+                continue
+            match = _JOIN_RX.match(line)
+            if match:
+                online.add(match.group(1).lower())
+                continue
+            match = _LEFT_RX.match(line)
+            if match:
+                online.discard(match.group(1).lower())
+                continue
+            if _STOP_RX.match(line):
+                online.clear()
+
+        if online == self.online:
+            return False
+        self.online = online
+        return True
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                lines = await loop.run_in_executor(None, self._read_lines)
+                if lines and self._apply(lines):
+                    self.changed.set()
+            except Exception as e:
+                logging.error('Failed reading server log: {}'.format(e))
+            await asyncio.sleep(self._poll_interval)
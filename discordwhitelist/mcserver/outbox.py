@@ -0,0 +1,163 @@
+import random
+import asyncio
+import logging
+import metrics
+from collections import OrderedDict
+
+
+_OUTBOX_APPLIED = metrics.counter(
+    'outbox_applied',
+    'Outbox entries applied to the server by server', ('server',))
+_OUTBOX_FAILED = metrics.counter(
+    'outbox_failed_attempts',
+    'Failed attempts to apply outbox entries by server', ('server',))
+
+
+class Outbox:
+    """
+    Applies the whitelist mutations recorded in the
+    database outbox of a server in order through its
+    command scheduler.
+
+    Entries are fetched in batches of batch_size and
+    all entries for the same name are collapsed into
+    the latest one, which is idempotent to apply
+    again. Applied entries are deleted, failed ones
+    are kept and retried with exponential backoff of
+    up to max_retry_delay seconds. Later entries for
+    a name are never applied before earlier ones.
+    """
+
+    _batch_size: int
+    _max_retry_delay: float
+    _wakeup: asyncio.Event
+    _waiters: dict
+    _retry_delay: float
+
+    def __init__(self, server, db, batch_size: int = 256,
+                 max_retry_delay: float = 60.0):
+        self._server = server
+        self._db = db
+        self._batch_size = batch_size
+        self._max_retry_delay = max_retry_delay
+        self._wakeup = asyncio.Event()
+        self._waiters = {}
+        self._retry_delay = 0.0
+
+    def notify(self):
+        """
+        Wakes up the worker after new entries were
+        recorded for the server.
+        """
+        self._wakeup.set()
+
+    async def wait(self, ids: list) -> list:
+        """
+        Waits until the entries with the given ids are
+        applied and returns the RCON responses. Entries
+        which were applied before have no responses.
+        """
+        loop = asyncio.get_event_loop()
+        futures = []
+        for ident in ids:
+            future = loop.create_future()
+            self._waiters.setdefault(ident, []).append(future)
+            futures.append(future)
+
+        try:
+            # Entries are deleted once applied, so those
+            # acked before the waiters were registered are
+            # no longer in the outbox.
+            pending = await self._db.get_pending_outbox(ids)
+            for ident, future in zip(ids, futures):
+                if ident not in pending and not future.done():
+                    future.set_result([])
+
+            op = []
+            for res in await asyncio.gather(*futures):
+                op.extend(res)
+            return op
+        finally:
+            for ident, future in zip(ids, futures):
+                waiters = self._waiters.get(ident)
+                if waiters is not None and future in waiters:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[ident]
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                entries = await self._db.get_outbox(self._server.id, self._batch_size)
+            except Exception as e:
+                logging.error('Failed reading outbox of server {}: {}'.format(
+                    self._server.name, e))
+                entries = None
+
+            if not entries:
+                if entries is not None:
+                    await self._wakeup.wait()
+                else:
+                    await asyncio.sleep(self._next_retry_delay())
+                continue
+
+            if await self._apply(entries):
+                self._retry_delay = 0.0
+            else:
+                await asyncio.sleep(self._next_retry_delay())
+
+    async def _apply(self, entries: list) -> bool:
+        mutations = OrderedDict()
+        for ident, action, mc_id, _ in entries:
+            prev = mutations.pop(mc_id.lower(), None)
+            ids = prev[2] if prev is not None else []
+            ids.append(ident)
+            mutations[mc_id.lower()] = (action, mc_id, ids)
+
+        scheduler = self._server.scheduler
+        results = await asyncio.gather(
+            *[scheduler.add(mc_id) if action == 'add' else scheduler.remove(mc_id)
+              for action, mc_id, _ in mutations.values()],
+            return_exceptions=True)
+
+        applied, failed = [], []
+        for (_, _, ids), res in zip(mutations.values(), results):
+            (failed if isinstance(res, Exception) else applied).append((ids, res))
+
+        if applied:
+            ack_ids = [i for ids, _ in applied for i in ids]
+            await self._db.ack_outbox(ack_ids)
+            _OUTBOX_APPLIED.inc(self._server.name, amount=len(ack_ids))
+            for ids, res in applied:
+                self._resolve(ids, res)
+
+        if failed:
+            err = failed[0][1]
+            logging.warning('Failed applying {} outbox entries to server {}: {}'.format(
+                len(failed), self._server.name, err))
+            _OUTBOX_FAILED.inc(self._server.name, amount=len(failed))
+            await self._db.fail_outbox([i for ids, _ in failed for i in ids], str(err))
+
+        return not failed
+
+    def close(self, err: Exception):
+        """
+        Fails all waiters with err after the run task
+        was cancelled.
+        """
+        waiters, self._waiters = self._waiters, {}
+        for futures in waiters.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(err)
+
+    def _resolve(self, ids: list, res: list):
+        for ident in ids:
+            for future in self._waiters.pop(ident, []):
+                if not future.done():
+                    future.set_result(res)
+
+    def _next_retry_delay(self) -> float:
+        self._retry_delay = min(self._max_retry_delay, self._retry_delay * 2 or 1.0)
+        return self._retry_delay * random.uniform(0.8, 1.2)
@@ -0,0 +1,41 @@
+import re
+
+
+_LIST_RX = re.compile(r'^There are (\d+)\/(\d+) players online:\s?(.*)', re.MULTILINE | re.S)
+
+
+class PlayerList:
+    """
+    Snapshot of the players online on a server.
+    """
+
+    __slots__ = ('online', 'slots', 'names')
+
+    online: int
+    slots: int
+    names: list
+
+    def __init__(self, online: int, slots: int, names: list):
+        self.online = online
+        self.slots = slots
+        self.names = names
+
+    def __eq__(self, other) -> bool:
+        return (isinstance(other, PlayerList) and
+                (self.online, self.slots, self.names) ==
+                (other.online, other.slots, other.names))
+
+    def __repr__(self) -> str:
+        return '<PlayerList {{ online: {}, slots: {}, names: {} }}>'.format(
+            self.online, self.slots, self.names)
+
+
+def parse_player_list(res: str) -> PlayerList:
+    """
+    Parses the output of the 'list' command.
+    """
+    match = _LIST_RX.match(res)
+    if not match:
+        raise Exception('unexpected list response: {}'.format(res))
+    names = [n.strip().lower() for n in match.group(3).split(',') if n.strip()]
+    return PlayerList(int(match.group(1)), int(match.group(2)), names)
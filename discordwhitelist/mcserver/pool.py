@@ -0,0 +1,257 @@
+import time
+import random
+import asyncio
+import logging
+import metrics
+from asyncrcon import MaxRetriesExceedException, NulLResponseException
+from .rcon import InstrumentedRCON
+
+
+_POOL_CONNECTIONS = metrics.gauge(
+    'rcon_pool_connections',
+    'Open RCON connections in the pool by server', ('server',))
+_POOL_DROPPED = metrics.counter(
+    'rcon_pool_dropped_connections',
+    'RCON connections dropped after failed commands or health probes by server',
+    ('server',))
+
+
+# Cheap command used to probe idle connections.
+_PROBE_COMMAND = 'list'
+
+# Errors of a connection which was closed by the
+# server. Commands failing with these are retried on
+# another connection.
+_CONNECTION_ERRORS = (
+    OSError, asyncio.IncompleteReadError,
+    MaxRetriesExceedException, NulLResponseException)
+
+
+class RCONUnavailableException(Exception):
+    """
+    Thrown when no RCON connection to the server
+    became available within the queue timeout.
+    """
+
+    def __init__(self, name: str):
+        super(RCONUnavailableException, self).__init__(
+            'RCON of server {} is unavailable'.format(name))
+
+
+class RCONPool:
+    """
+    Pool of up to size authenticated RCON connections
+    to one server.
+
+    Every command runs exclusively on one connection
+    with a timeout, so independent commands run
+    concurrently instead of interleaving on a single
+    socket. Connections which fail a command or a
+    periodic health probe are dropped and reopened in
+    the background with exponential backoff. Only
+    connections idle for health_interval seconds are
+    probed, one at a time and, if the pool has more
+    than one, never the last idle one. While no
+    connection is available, commands are queued in
+    order for up to queue_timeout seconds. Commands
+    whose connection was closed by the server are
+    retried on another connection within that time,
+    so they should be idempotent, which all whitelist
+    commands are.
+    """
+
+    name: str
+
+    _addr: str
+    _passwd: str
+    _encoding: str
+    _size: int
+    _timeout: float
+    _queue_timeout: float
+    _health_interval: float
+    _max_backoff: float
+    _idle: asyncio.Queue
+    _idle_since: dict
+    _open: int
+    _dropped: asyncio.Event
+    _fill_lock: asyncio.Lock
+    _backoff: float
+    _closed: bool
+
+    def __init__(self, addr: str, passwd: str, name: str = 'default', size: int = 2,
+                 encoding: str = 'utf-8', timeout: float = 10.0,
+                 queue_timeout: float = 30.0, health_interval: float = 30.0,
+                 max_backoff: float = 60.0):
+        self.name = name
+        self._addr = addr
+        self._passwd = passwd
+        self._encoding = encoding
+        self._size = max(1, size)
+        self._timeout = timeout
+        self._queue_timeout = queue_timeout
+        self._health_interval = health_interval
+        self._max_backoff = max_backoff
+        self._idle = asyncio.Queue()
+        self._idle_since = {}
+        self._open = 0
+        self._dropped = asyncio.Event()
+        self._fill_lock = asyncio.Lock()
+        self._backoff = 0.0
+        self._closed = False
+        _POOL_CONNECTIONS.set_function(lambda: self._open, name)
+
+    @property
+    def connected(self) -> bool:
+        return self._open > 0
+
+    async def connect(self):
+        """
+        Opens the missing connections concurrently and
+        raises if none could be opened.
+        """
+        await self._fill()
+        if not self.connected:
+            raise RCONUnavailableException(self.name)
+
+    async def command(self, cmd: str, timeout: float = None) -> str:
+        """
+        Executes cmd on the next available connection
+        and returns the response. Raises
+        RCONUnavailableException if no connection became
+        available in time and asyncio.TimeoutError if the
+        server did not respond within timeout (def: the
+        timeout of the pool) seconds.
+        """
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self._queue_timeout
+
+        while True:
+            conn = await self._acquire(deadline - loop.time())
+            try:
+                res = await asyncio.wait_for(conn.command(cmd), timeout or self._timeout)
+            except asyncio.TimeoutError:
+                self._drop(conn)
+                raise
+            except _CONNECTION_ERRORS as e:
+                self._drop(conn)
+                logging.debug('RCON connection to server {} lost, retrying: {}'.format(
+                    self.name, e))
+                continue
+            except (Exception, asyncio.CancelledError):
+                # The state of the connection is unknown after a
+                # failed or interrupted command, so it is not reused.
+                self._drop(conn)
+                raise
+            self._release(conn)
+            return res
+
+    async def run(self):
+        """
+        Keeps the pool filled and probes idle connections
+        every health_interval seconds.
+        """
+        while not self._closed:
+            await self._fill()
+
+            if self._open < self._size:
+                delay = self._next_backoff()
+                logging.warning(
+                    ('RCON pool of server {} has {}/{} connections, ' +
+                     'retrying in {:.1f}s').format(self.name, self._open, self._size, delay))
+                await asyncio.sleep(delay)
+                continue
+
+            self._backoff = 0.0
+            try:
+                await asyncio.wait_for(self._dropped.wait(), self._health_interval)
+            except asyncio.TimeoutError:
+                await self._probe()
+            self._dropped.clear()
+
+    def close(self):
+        self._closed = True
+        while not self._idle.empty():
+            _close_quietly(self._idle.get_nowait())
+            self._open -= 1
+        self._idle_since.clear()
+
+    async def _fill(self):
+        async with self._fill_lock:
+            missing = self._size - self._open
+            if missing <= 0 or self._closed:
+                return
+            results = await asyncio.gather(
+                *[self._open_one() for _ in range(missing)], return_exceptions=True)
+            errors = [res for res in results if isinstance(res, Exception)]
+            if errors:
+                logging.error('Failed opening {} RCON connections to server {}: {}'.format(
+                    len(errors), self.name, errors[0]))
+
+    async def _open_one(self):
+        conn = InstrumentedRCON(
+            self._addr, self._passwd, name=self.name,
+            auto_reconnect=False, encoding=self._encoding)
+        try:
+            await asyncio.wait_for(conn.open_connection(), self._timeout)
+        except (Exception, asyncio.CancelledError):
+            _close_quietly(conn)
+            raise
+        self._open += 1
+        self._idle_since[conn] = time.monotonic()
+        self._idle.put_nowait(conn)
+
+    async def _acquire(self, timeout: float) -> InstrumentedRCON:
+        if self._closed or timeout <= 0:
+            raise RCONUnavailableException(self.name)
+        try:
+            return await asyncio.wait_for(self._idle.get(), timeout)
+        except asyncio.TimeoutError:
+            raise RCONUnavailableException(self.name)
+
+    def _release(self, conn: InstrumentedRCON):
+        if self._closed:
+            _close_quietly(conn)
+            self._open -= 1
+            return
+        self._idle_since[conn] = time.monotonic()
+        self._idle.put_nowait(conn)
+
+    def _drop(self, conn: InstrumentedRCON):
+        self._idle_since.pop(conn, None)
+        _close_quietly(conn)
+        self._open -= 1
+        _POOL_DROPPED.inc(self.name)
+        self._dropped.set()
+
+    async def _probe(self):
+        # Cycles once through the idle connections, taking
+        # out at most one at a time for its probe.
+        for _ in range(self._idle.qsize()):
+            if self._closed or self._idle.empty() or self._idle.qsize() <= 1 < self._size:
+                return
+            conn = self._idle.get_nowait()
+            if time.monotonic() - self._idle_since.get(conn, 0.0) < self._health_interval:
+                self._idle.put_nowait(conn)
+                continue
+            await self._probe_one(conn)
+
+    async def _probe_one(self, conn: InstrumentedRCON):
+        try:
+            await asyncio.wait_for(conn.command(_PROBE_COMMAND), self._timeout)
+        except Exception as e:
+            logging.warning('RCON health probe of server {} failed: {}'.format(
+                self.name, e or type(e).__name__))
+            self._drop(conn)
+            return
+        self._release(conn)
+
+    def _next_backoff(self) -> float:
+        self._backoff = min(self._max_backoff, self._backoff * 2 or 1.0)
+        return self._backoff * random.uniform(0.8, 1.2)
+
+
+def _close_quietly(conn: InstrumentedRCON):
+    try:
+        conn.close()
+    except Exception:
+        pass
@@ -0,0 +1,67 @@
+import metrics
+from asyncrcon import AsyncRCON
+
+
+_RCON_LATENCY = metrics.histogram(
+    'rcon_command_duration_seconds',
+    'Duration of RCON commands by server and command verb', ('server', 'verb'))
+_RCON_ERRORS = metrics.counter(
+    'rcon_command_errors',
+    'Failed RCON commands by server and command verb', ('server', 'verb'))
+_RCON_CONNECTS = metrics.counter(
+    'rcon_connects',
+    'Opened RCON connections by server', ('server',))
+
+
+# Sub commands which are part of the verb label,
+# all other arguments are dropped to keep the
+# label cardinality low.
+_SUB_COMMANDS = {
+    'whitelist': ('add', 'remove', 'list', 'reload', 'on', 'off'),
+}
+
+
+def command_verb(cmd: str) -> str:
+    parts = cmd.strip().lower().split()
+    if not parts:
+        return ''
+    verb = parts[0].lstrip('/')
+    if len(parts) > 1 and parts[1] in _SUB_COMMANDS.get(verb, ()):
+        verb += ' ' + parts[1]
+    return verb[:32]
+
+
+# Commands which do not change the server state and
+# may run concurrently with and unthrottled by writes.
+_READ_VERBS = ('list', 'whitelist list')
+
+
+def is_read_command(cmd: str) -> bool:
+    return command_verb(cmd) in _READ_VERBS
+
+
+class InstrumentedRCON(AsyncRCON):
+    """
+    AsyncRCON recording command latencies, command
+    errors and connects as metrics labeled with the
+    name of the server.
+    """
+
+    name: str
+
+    def __init__(self, addr: str, passwd: str, name: str = 'default', **kwargs):
+        super(InstrumentedRCON, self).__init__(addr, passwd, **kwargs)
+        self.name = name
+
+    async def open_connection(self):
+        await super(InstrumentedRCON, self).open_connection()
+        _RCON_CONNECTS.inc(self.name)
+
+    async def command(self, cmd: str) -> str:
+        verb = command_verb(cmd)
+        try:
+            with _RCON_LATENCY.time(self.name, verb):
+                return await super(InstrumentedRCON, self).command(cmd)
+        except Exception:
+            _RCON_ERRORS.inc(self.name, verb)
+            raise
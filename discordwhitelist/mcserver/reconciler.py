@@ -0,0 +1,222 @@
+import time
+import asyncio
+import logging
+import metrics
+from typing import Callable
+from collections import OrderedDict
+from .pool import RCONUnavailableException
+from .sync import SyncPlan, SyncReport
+from .registry import ServerRegistry, Server
+
+
+_RECONCILE_LAST_RUN = metrics.gauge(
+    'reconcile_last_run_timestamp_seconds',
+    'Unix time of the last finished reconciliation run')
+_RECONCILE_DRIFT = metrics.gauge(
+    'reconcile_drift',
+    'Whitelist entries differing from the database in the last reconciliation ' +
+    'run by server', ('server',))
+_RECONCILE_FIXES = metrics.counter(
+    'reconcile_fixes',
+    'Whitelist entries fixed by the reconciler by server and action',
+    ('server', 'action'))
+_RECONCILE_DEPARTED = metrics.counter(
+    'reconcile_departed_unbinds',
+    'Bindings of accounts which left all guilds removed by the reconciler')
+
+
+class ReconcileReport:
+    """
+    Statistics of a reconciliation run.
+    """
+
+    __slots__ = ('started', 'finished', 'departed', 'drift', 'servers')
+
+    started: float
+    finished: float
+    departed: int
+    drift: dict
+    servers: OrderedDict
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.departed = 0
+        self.drift = {}
+        self.servers = OrderedDict()
+
+    def summary(self) -> str:
+        lines = ['Started <t:{}:R>, took {:.1f}s'.format(
+            int(self.started), (self.finished or time.time()) - self.started)]
+        lines.append('{} bindings of members who left unbound'.format(self.departed))
+        for name, report in self.servers.items():
+            if isinstance(report, Exception):
+                lines.append('**{}**: failed: `{}`'.format(name, report))
+                continue
+            lines.append('**{}**: {} entries drifted'.format(name, self.drift.get(name, 0)))
+            lines.append(report.summary(max_names=10))
+        return '\n'.join(lines)
+
+
+class Reconciler:
+    """
+    Fixes drift between the database and the server
+    whitelists in the background every interval
+    seconds.
+
+    Bindings of accounts which are no longer member
+    of any guild, as returned by guild_members, are
+    unbound. The whitelist of every server is then
+    diffed against the database and up to max_fixes
+    entries per server are fixed. Bound names are
+    added unless all guilds of their account have
+    whitelist binding disabled, so disable is not
+    undone. Entries without binding, e.g. added on
+    the console, are only removed with remove_unbound.
+    Fixes are sent one command every
+    cmd_interval seconds and only while the command
+    scheduler of the server is idle, so interactive
+    mutations are never queued behind the reconciler.
+    Entries whose binding changed since the diff are
+    left to the outbox.
+    """
+
+    last_report: ReconcileReport
+
+    _servers: ServerRegistry
+    _interval: float
+    _cmd_interval: float
+    _max_fixes: int
+    _remove_unbound: bool
+    _guild_members: Callable
+    _wakeup: asyncio.Event
+
+    def __init__(self, servers: ServerRegistry, db, interval: float = 3600.0,
+                 cmd_interval: float = 1.0, max_fixes: int = 500,
+                 remove_unbound: bool = False, guild_members: Callable = None):
+        """
+        guild_members returns the ids of the members by
+        guild id, with None for guilds whose member list
+        is incomplete.
+        """
+        self.last_report = None
+        self._servers = servers
+        self._db = db
+        self._interval = interval
+        self._cmd_interval = cmd_interval
+        self._max_fixes = max_fixes
+        self._remove_unbound = remove_unbound
+        self._guild_members = guild_members
+        self._wakeup = asyncio.Event()
+
+    @property
+    def running(self) -> bool:
+        return self.last_report is not None and self.last_report.finished is None
+
+    def trigger(self):
+        """
+        Starts the next run immediately.
+        """
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logging.error('Failed reconciling server whitelists: {}'.format(e))
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def reconcile(self) -> ReconcileReport:
+        report = ReconcileReport()
+        self.last_report = report
+
+        guilds = self._guild_members() if self._guild_members is not None else {}
+        report.departed = await self._unbind_departed(guilds)
+
+        bindings = await self._db.get_whitelist()
+        allowed = await self._allowed_ids(guilds)
+        db_names = set(n.lower() for n in bindings.values())
+        add_names = set(mc_id.lower() for dc_id, mc_id in bindings.items()
+                        if allowed is None or dc_id in allowed)
+        report.servers = await self._servers.broadcast(
+            lambda s: self._reconcile_server(s, db_names, add_names, report))
+
+        report.finished = time.time()
+        _RECONCILE_LAST_RUN.set(report.finished)
+        logging.info('Reconciled server whitelists in {:.1f}s: {}'.format(
+            report.finished - report.started,
+            ', '.join('{} {} drifted'.format(name, n) for name, n in report.drift.items())))
+        return report
+
+    async def _allowed_ids(self, guilds: dict) -> set:
+        """
+        Returns the ids of the members of the guilds with
+        whitelist binding enabled, None if binding is
+        enabled in all guilds.
+        """
+        disabled = [g for g in guilds if await self._db.get_disabled(g)]
+        if not disabled:
+            return None
+        # Without the member lists it is unknown whose
+        # binding belongs to a disabled guild.
+        if any(members is None for members in guilds.values()):
+            return set()
+        return set().union(*[m for g, m in guilds.items() if g not in disabled])
+
+    async def _unbind_departed(self, guilds: dict) -> int:
+        if not guilds or any(members is None for members in guilds.values()):
+            return 0
+        members = set().union(*guilds.values())
+
+        bindings = await self._db.get_whitelist()
+        departed = [dc_id for dc_id in bindings if dc_id not in members]
+        if not departed:
+            return 0
+
+        mc_ids, _ = await self._db.unbind_witelist_many(
+            departed[:self._max_fixes], self._servers.ids)
+        self._servers.notify_outbox()
+        _RECONCILE_DEPARTED.inc(amount=len(mc_ids))
+        return len(mc_ids)
+
+    async def _reconcile_server(self, server: Server, db_names: set, add_names: set,
+                                report: ReconcileReport) -> SyncReport:
+        scheduler = server.scheduler
+        await scheduler.wait_idle()
+        server_names = await scheduler.whitelist(fresh=True)
+        plan = SyncPlan(
+            add_names - server_names,
+            server_names - db_names if self._remove_unbound else ())
+        report.drift[server.name] = len(plan)
+        _RECONCILE_DRIFT.set(len(plan), server.name)
+
+        res = SyncReport()
+        for action, name in plan.commands()[:self._max_fixes]:
+            await asyncio.sleep(self._cmd_interval)
+
+            dc_id, _ = await self._db.get_whitelist_by_mc_id(name)
+            if (dc_id is not None) != (action == 'add'):
+                continue
+
+            await scheduler.wait_idle()
+            try:
+                await scheduler.command('whitelist {} {}'.format(action, name))
+            except Exception as e:
+                res.failed.append((name, e))
+                if isinstance(e, RCONUnavailableException):
+                    break
+                continue
+
+            (res.added if action == 'add' else res.removed).append(name)
+            _RECONCILE_FIXES.inc(server.name, action)
+
+        if res.added or res.removed:
+            await scheduler.reload()
+        res.finished = time.monotonic()
+        return res
@@ -0,0 +1,272 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Callable
+from collections import OrderedDict
+from .pool import RCONPool, RCONUnavailableException
+from .players import PlayerList
+from .scheduler import CommandScheduler
+from .outbox import Outbox
+
+
+class ServerConfig:
+    """
+    Connection and file settings of a managed server.
+    """
+
+    __slots__ = ('name', 'address', 'password', 'encoding',
+                 'server_dir', 'server_log', 'uuid_cache')
+
+    def __init__(self, name: str, address: str, password: str,
+                 encoding: str = 'utf-8', server_dir: str = None,
+                 server_log: str = None, uuid_cache: str = None):
+        self.name = name
+        self.address = address
+        self.password = password
+        self.encoding = encoding
+        self.server_dir = server_dir
+        self.server_log = server_log
+        self.uuid_cache = uuid_cache
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ServerConfig) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+
+def load_servers_config(fileloc: str) -> list:
+    """
+    Loads server configs from a JSON file in the format
+
+        {"servers": [{"name": "lobby", "address": "localhost:25575",
+                      "password": "...", "server_dir": "...",
+                      "server_log": "...", "uuid_cache": "..."}]}
+    """
+    with open(fileloc, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    configs = []
+    for entry in data.get('servers', []):
+        if not entry.get('name') or not entry.get('password'):
+            raise Exception('every server requires a name and a password')
+        configs.append(ServerConfig(
+            entry['name'], entry.get('address', 'localhost:25575'),
+            entry['password'], entry.get('encoding', 'utf-8'),
+            entry.get('server_dir'), entry.get('server_log'),
+            entry.get('uuid_cache')))
+
+    if len(set(c.name for c in configs)) != len(configs):
+        raise Exception('server names must be unique')
+
+    return configs
+
+
+class Server:
+    """
+    A managed minecraft server with its own RCON
+    connection pool, command scheduler and, if
+    configured, whitelist file access and server log
+    tail, whose modules are only imported when used.
+    pool_options are passed to the RCONPool and
+    cache_ttls to the CommandScheduler. options holds
+    all of them to detect changes on reload.
+    """
+
+    config: ServerConfig
+    options: dict
+    rcon: RCONPool
+    scheduler: CommandScheduler
+    outbox: Outbox
+    id: int
+
+    _slots: int
+    _reconciled: float
+    _tasks: list
+
+    def __init__(self, config: ServerConfig, cmd_interval: float, reload_window: float,
+                 cache_ttls: dict = None, **pool_options):
+        self.config = config
+        self.options = dict(
+            pool_options, cmd_interval=cmd_interval,
+            reload_window=reload_window, cache_ttls=cache_ttls)
+        self.rcon = RCONPool(
+            config.address, config.password, name=config.name,
+            encoding=config.encoding, **pool_options)
+        self.scheduler = CommandScheduler(
+            self.rcon, cmd_interval=cmd_interval,
+            reload_window=reload_window, name=config.name, cache_ttls=cache_ttls)
+        self.wl_file = None
+        if config.server_dir:
+            from .whitelistfile import WhitelistFile
+            self.wl_file = WhitelistFile(config.server_dir, config.uuid_cache)
+        self.tail = None
+        if config.server_log:
+            from .logtail import LogTail
+            self.tail = LogTail(config.server_log)
+        self.outbox = None
+        self.id = None
+        self._slots = None
+        self._reconciled = 0.0
+        self._tasks = []
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._tasks.append(loop.create_task(self.rcon.run()))
+        self._tasks.append(loop.create_task(self.scheduler.run()))
+        if self.tail is not None:
+            self._tasks.append(loop.create_task(self.tail.run()))
+        if self.outbox is not None:
+            self._tasks.append(loop.create_task(self.outbox.run()))
+
+    def stop(self):
+        """
+        Stops the tasks of the server and fails all
+        mutations, reloads and outbox waits pending on it.
+        """
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        self.rcon.close()
+        err = RCONUnavailableException(self.name)
+        self.scheduler.close(err)
+        if self.outbox is not None:
+            self.outbox.close(err)
+
+    async def connect(self):
+        await self.rcon.connect()
+
+    async def players(self, reconcile_freq: float = 0) -> PlayerList:
+        """
+        Returns the players online on the server. When
+        the server log is tailed, the player list is
+        only fetched via RCON to reconcile the tracked
+        players every reconcile_freq seconds (never, if
+        0) after the first fetch.
+        """
+        if self.tail is not None and self._slots is not None:
+            due = reconcile_freq > 0 and \
+                time.monotonic() - self._reconciled >= reconcile_freq
+            if not due:
+                names = sorted(self.tail.online)
+                return PlayerList(len(names), self._slots, names)
+
+        players = await self.scheduler.players()
+        self._slots = players.slots
+        self._reconciled = time.monotonic()
+        if self.tail is not None:
+            self.tail.reconcile(players.names)
+        return players
+
+
+class ServerRegistry:
+    """
+    The managed servers by name. Operations on all
+    servers are fanned out concurrently and report a
+    result or exception per server.
+    """
+
+    _servers: OrderedDict
+
+    def __init__(self, servers: list = ()):
+        self._servers = OrderedDict((s.name, s) for s in servers)
+
+    def __iter__(self):
+        return iter(list(self._servers.values()))
+
+    def __len__(self) -> int:
+        return len(self._servers)
+
+    def get(self, name: str) -> Server:
+        return self._servers.get(name)
+
+    @property
+    def names(self) -> list:
+        return list(self._servers.keys())
+
+    @property
+    def ids(self) -> list:
+        return [s.id for s in self]
+
+    @property
+    def with_wl_file(self) -> list:
+        return [s for s in self if s.wl_file is not None]
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        for server in self:
+            server.start(loop)
+
+    def stop(self):
+        for server in self:
+            server.stop()
+
+    def replace(self, servers: list) -> list:
+        """
+        Replaces the managed servers and returns the
+        previous ones which are no longer managed.
+        """
+        previous = list(self)
+        self._servers = OrderedDict((s.name, s) for s in servers)
+        return [s for s in previous if self._servers.get(s.name) is not s]
+
+    async def register(self, db, servers: list = None):
+        """
+        Registers the servers (or the given servers) in
+        the database and sets up their outbox workers,
+        which are started with the servers.
+        """
+        for server in (self if servers is None else servers):
+            server.id = await db.set_server(
+                server.name, server.config.address,
+                server.config.server_dir, server.config.server_log)
+            server.outbox = Outbox(server, db)
+
+    def notify_outbox(self):
+        for server in self:
+            if server.outbox is not None:
+                server.outbox.notify()
+
+    async def wait_applied(self, entries: list) -> OrderedDict:
+        """
+        Waits until the outbox entries, given as (id,
+        server id), are applied and returns the RCON
+        responses or the raised exception by server name.
+        """
+        ids = {}
+        for ident, server_id in entries:
+            ids.setdefault(server_id, []).append(ident)
+        servers = [s for s in self if s.id in ids]
+        return await self.broadcast(lambda s: s.outbox.wait(ids[s.id]), servers)
+
+    async def broadcast(self, fn: Callable, servers: list = None) -> OrderedDict:
+        """
+        Calls the coroutine function fn with every server
+        (or the given servers) concurrently and returns
+        the results or raised exceptions by server name.
+        """
+        servers = list(self) if servers is None else servers
+        results = await asyncio.gather(
+            *[fn(server) for server in servers], return_exceptions=True)
+        return OrderedDict((s.name, r) for s, r in zip(servers, results))
+
+    async def connect_all(self, servers: list = None) -> OrderedDict:
+        results = await self.broadcast(lambda s: s.connect(), servers)
+        for name, res in results.items():
+            if isinstance(res, Exception):
+                logging.error('Failed connecting to RCON of server {}: {}'.format(name, res))
+        return results
+
+    def wait_changed(self) -> list:
+        """
+        Returns awaitables which complete as soon as the
+        tracked online players of any tailed server log
+        have changed.
+        """
+        return [s.tail.changed.wait() for s in self if s.tail is not None]
+
+    def clear_changed(self):
+        for server in self:
+            if server.tail is not None:
+                server.tail.changed.clear()
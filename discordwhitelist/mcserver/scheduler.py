@@ -0,0 +1,241 @@
+import time
+import asyncio
+import logging
+import metrics
+from collections import OrderedDict
+from .rcon import is_read_command
+from .pool import RCONPool
+from .cache import ReadCache
+from .players import PlayerList, parse_player_list
+from .sync import parse_whitelist
+
+
+_QUEUE_DEPTH = metrics.gauge(
+    'rcon_scheduler_queue_depth',
+    'Number of whitelist mutations waiting to be sent by server', ('server',))
+_COALESCED = metrics.counter(
+    'rcon_scheduler_coalesced',
+    'Whitelist mutations superseded by a later one for the same name by server',
+    ('server',))
+
+
+class _Mutation:
+
+    __slots__ = ('action', 'futures')
+
+    def __init__(self, action: str):
+        self.action = action
+        self.futures = []
+
+
+class CommandScheduler:
+    """
+    Queues whitelist mutations in front of the RCON
+    connection and applies them in batches.
+
+    Commands are sent at most once every cmd_interval
+    seconds. Mutations queued for the same name before
+    being sent are collapsed into the latest one, so an
+    add followed by a remove cancel each other out. All
+    mutations arriving within reload_window seconds are
+    followed by a single 'whitelist reload'.
+
+    The futures returned by add and remove resolve with
+    the list of RCON responses once the mutation and
+    the following reload have been applied. Background
+    work waits for wait_idle, so it never delays
+    queued mutations by more than a single command.
+
+    Read commands are answered from a ReadCache with
+    the given cache_ttls by command verb, which every
+    other command invalidates.
+    """
+
+    _name: str
+    _rcon: RCONPool
+    _cmd_interval: float
+    _reload_window: float
+    _pending: OrderedDict
+    _reload_futures: list
+    _applying: tuple
+    _wakeup: asyncio.Event
+    _idle: asyncio.Event
+    _last_sent: float
+    _cache: ReadCache
+
+    def __init__(self, rcon: RCONPool, cmd_interval: float = 0.05,
+                 reload_window: float = 0.1, name: str = 'default',
+                 cache_ttls: dict = None):
+        self._name = name
+        self._rcon = rcon
+        self._cmd_interval = cmd_interval
+        self._reload_window = reload_window
+        self._pending = OrderedDict()
+        self._reload_futures = []
+        self._applying = None
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._last_sent = 0.0
+        self._cache = ReadCache(cache_ttls, name)
+        _QUEUE_DEPTH.set_function(lambda: self.queue_size, name)
+
+    @property
+    def queue_size(self) -> int:
+        return len(self._pending)
+
+    @property
+    def idle(self) -> bool:
+        return self._idle.is_set()
+
+    async def wait_idle(self):
+        """
+        Waits until all queued mutations and reloads
+        have been applied.
+        """
+        await self._idle.wait()
+
+    def add(self, name: str) -> asyncio.Future:
+        return self._enqueue('add', name)
+
+    def remove(self, name: str) -> asyncio.Future:
+        return self._enqueue('remove', name)
+
+    def reload(self) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        self._reload_futures.append(future)
+        self._idle.clear()
+        self._wakeup.set()
+        return future
+
+    async def command(self, cmd: str, fresh: bool = False) -> str:
+        """
+        Sends a single command directly. Commands
+        changing the server state respect the command
+        rate limit, read commands are sent immediately
+        or answered from the cache unless fresh.
+        """
+        if is_read_command(cmd):
+            return await self._cache.get(
+                cmd, lambda: self._rcon.command(cmd), fresh=fresh)
+
+        self._cache.invalidate()
+        await self._throttle()
+        try:
+            return await self._rcon.command(cmd)
+        finally:
+            # Reads sent while the command was running may
+            # have seen the state before it.
+            self._cache.invalidate()
+
+    async def players(self, fresh: bool = False) -> PlayerList:
+        return await self._cache.get(
+            'list', lambda: self._rcon.command('list'), parse_player_list, fresh)
+
+    async def whitelist(self, fresh: bool = False) -> set:
+        """
+        Returns the lower case names on the whitelist,
+        which must not be modified.
+        """
+        return await self._cache.get(
+            'whitelist list', lambda: self._rcon.command('whitelist list'),
+            parse_whitelist, fresh)
+
+    def close(self, err: Exception):
+        """
+        Fails the futures of all queued mutations and
+        reloads and of the batch being applied with err,
+        after the run task was cancelled.
+        """
+        batch, reload_futures = self._applying or (OrderedDict(), [])
+        for mut in list(batch.values()) + list(self._pending.values()):
+            _fail(mut.futures, err)
+        _fail(reload_futures + self._reload_futures, err)
+        self._pending = OrderedDict()
+        self._reload_futures = []
+        self._applying = None
+        self._idle.set()
+
+    def _enqueue(self, action: str, name: str) -> asyncio.Future:
+        future = asyncio.get_event_loop().create_future()
+        key = name.lower()
+
+        mut = self._pending.pop(key, None)
+        if mut is None:
+            mut = _Mutation(action)
+        elif mut.action != action:
+            _COALESCED.inc(self._name)
+            logging.debug('whitelist {} {} supersedes pending {}'.format(
+                action, name, mut.action))
+            mut.action = action
+
+        mut.futures.append(future)
+        self._pending[key] = mut
+        self._idle.clear()
+        self._wakeup.set()
+        return future
+
+    async def _throttle(self):
+        wait = self._last_sent + self._cmd_interval - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_sent = time.monotonic()
+
+    async def run(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self._reload_window)
+            self._wakeup.clear()
+
+            batch = self._pending
+            reload_futures = self._reload_futures
+            self._pending = OrderedDict()
+            self._reload_futures = []
+
+            self._applying = (batch, reload_futures)
+            try:
+                await self._apply(batch, reload_futures)
+            except Exception as e:
+                logging.error('Failed applying whitelist mutations: {}'.format(e))
+            self._applying = None
+
+            if not self._pending and not self._reload_futures:
+                self._idle.set()
+
+    async def _apply(self, batch: OrderedDict, reload_futures: list):
+        applied = []
+
+        for name, mut in batch.items():
+            try:
+                res = await self.command('whitelist {} {}'.format(mut.action, name))
+            except Exception as e:
+                _fail(mut.futures, e)
+                continue
+            applied.append((mut, res))
+
+        if not applied and not reload_futures:
+            return
+
+        try:
+            reload_res = await self.command('whitelist reload')
+        except Exception as e:
+            for mut, _ in applied:
+                _fail(mut.futures, e)
+            _fail(reload_futures, e)
+            return
+
+        for mut, res in applied:
+            _resolve(mut.futures, [res, reload_res])
+        _resolve(reload_futures, [reload_res])
+
+
+def _resolve(futures: list, res):
+    for future in futures:
+        if not future.done():
+            future.set_result(res)
+
+
+def _fail(futures: list, err: Exception):
+    for future in futures:
+        if not future.done():
+            future.set_exception(err)
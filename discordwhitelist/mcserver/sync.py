@@ -0,0 +1,185 @@
+import re
+import time
+import asyncio
+import logging
+from typing import Callable, Iterable
+
+
+_WL_LIST_RX = re.compile(r'^There are (\d+)[^:]*whitelisted players?:\s?(.*)', re.S)
+_NAME_SPLIT_RX = re.compile(r',|\s+and\s+|\s')
+
+
+def parse_whitelist(res: str) -> set:
+    """
+    Parses the output of the 'whitelist list' command
+    into a set of lower case player names.
+    """
+    match = _WL_LIST_RX.match(res.strip())
+    if not match:
+        if 'no whitelisted players' in res:
+            return set()
+        raise Exception('unexpected whitelist list response: {}'.format(res))
+    return set(
+        name.lower() for name in _NAME_SPLIT_RX.split(match.group(2))
+        if name)
+
+
+class SyncPlan:
+    """
+    Names which have to be added to and removed from
+    the servers whitelist to match the database.
+    """
+
+    __slots__ = ('to_add', 'to_remove')
+
+    to_add: list
+    to_remove: list
+
+    def __init__(self, to_add: Iterable = (), to_remove: Iterable = ()):
+        self.to_add = sorted(to_add)
+        self.to_remove = sorted(to_remove)
+
+    @staticmethod
+    def sync(db_names: Iterable, server_names: set) -> 'SyncPlan':
+        db_names = set(n.lower() for n in db_names)
+        return SyncPlan(db_names - server_names, server_names - db_names)
+
+    @staticmethod
+    def purge(db_names: Iterable, server_names: set) -> 'SyncPlan':
+        db_names = set(n.lower() for n in db_names)
+        return SyncPlan((), db_names & server_names)
+
+    def __len__(self) -> int:
+        return len(self.to_add) + len(self.to_remove)
+
+    def commands(self) -> list:
+        return ([('add', n) for n in self.to_add] +
+                [('remove', n) for n in self.to_remove])
+
+
+class SyncReport:
+
+    __slots__ = ('added', 'removed', 'failed', 'dry_run', 'started', 'finished')
+
+    added: list
+    removed: list
+    failed: list
+    dry_run: bool
+    started: float
+    finished: float
+
+    def __init__(self, dry_run: bool = False):
+        self.added = []
+        self.removed = []
+        self.failed = []
+        self.dry_run = dry_run
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def duration(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def summary(self, max_names: int = 20) -> str:
+        lines = []
+        verb = 'to be ' if self.dry_run else ''
+        for title, names in (('added', self.added), ('removed', self.removed)):
+            line = '{} {}{}'.format(len(names), verb, title)
+            if names:
+                line += ': ' + _format_names(names, max_names)
+            lines.append(line)
+        if self.failed:
+            lines.append('{} failed: {}'.format(
+                len(self.failed),
+                _format_names([n for n, _ in self.failed], max_names)))
+        lines.append('took {:.1f}s'.format(self.duration))
+        return '\n'.join(lines)
+
+
+def _format_names(names: list, max_names: int) -> str:
+    res = ', '.join('`{}`'.format(n) for n in names[:max_names])
+    if len(names) > max_names:
+        res += ' and {} more'.format(len(names) - max_names)
+    return res
+
+
+class SyncPipeline:
+    """
+    Applies the commands of a SyncPlan with bounded
+    concurrency and an adaptive delay between commands.
+
+    The delay starts at min_delay, is halved after
+    each success down to min_delay and doubled after
+    each failure up to max_delay. Every entry is tried
+    at most max_retries + 1 times before it is reported
+    as failed.
+    """
+
+    _send: Callable
+    _concurrency: int
+    _min_delay: float
+    _max_delay: float
+    _max_retries: int
+    _delay: float
+
+    def __init__(self, send: Callable, concurrency: int = 1,
+                 min_delay: float = 0.0, max_delay: float = 5.0,
+                 max_retries: int = 3):
+        self._send = send
+        self._concurrency = concurrency
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._max_retries = max_retries
+        self._delay = min_delay
+
+    async def run(self, plan: SyncPlan, on_progress: Callable = None,
+                  cancelled: Callable = None) -> SyncReport:
+        """
+        Applies the plan, calling on_progress with the
+        number of processed and total entries after
+        each entry. Stops taking new entries once
+        cancelled returns true.
+        """
+        report = SyncReport()
+        queue = asyncio.Queue()
+        for cmd in plan.commands():
+            queue.put_nowait(cmd)
+
+        total = len(plan)
+
+        async def worker():
+            while not queue.empty():
+                if cancelled is not None and cancelled():
+                    return
+                action, name = queue.get_nowait()
+                err = await self._apply(action, name)
+                if err is not None:
+                    report.failed.append((name, err))
+                elif action == 'add':
+                    report.added.append(name)
+                else:
+                    report.removed.append(name)
+                if on_progress is not None:
+                    done = len(report.added) + len(report.removed) + len(report.failed)
+                    await on_progress(done, total)
+
+        await asyncio.gather(*[worker() for _ in range(max(1, self._concurrency))])
+
+        report.finished = time.monotonic()
+        return report
+
+    async def _apply(self, action: str, name: str) -> Exception:
+        err = None
+        for _ in range(self._max_retries + 1):
+            if self._delay > 0:
+                await asyncio.sleep(self._delay)
+            try:
+                await self._send('whitelist {} {}'.format(action, name))
+                self._delay = max(self._min_delay, self._delay / 2)
+                return None
+            except Exception as e:
+                err = e
+                self._delay = min(self._max_delay, max(self._delay * 2, 0.1))
+                logging.warning('Failed sending whitelist {} {}: {}'.format(
+                    action, name, e))
+        return err
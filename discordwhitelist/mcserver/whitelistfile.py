@@ -0,0 +1,174 @@
+import os
+import json
+import stat
+import time
+import uuid
+import hashlib
+import logging
+import tempfile
+import threading
+from .sync import SyncPlan, SyncReport
+
+
+def offline_uuid(name: str) -> str:
+    """
+    Derives the UUID the server assigns to a player in
+    offline mode, which is a version 3 UUID of the
+    string 'OfflinePlayer:<name>'. The name is case
+    sensitive, so it must be passed as the player
+    spells it.
+    """
+    digest = bytearray(hashlib.md5(
+        'OfflinePlayer:{}'.format(name).encode('utf-8')).digest())
+    digest[6] = digest[6] & 0x0f | 0x30
+    digest[8] = digest[8] & 0x3f | 0x80
+    return str(uuid.UUID(bytes=bytes(digest)))
+
+
+class UUIDCache:
+    """
+    Case insensitive username to UUID lookup loaded
+    from files in the format of the servers
+    'usercache.json'.
+    """
+
+    _uuids: dict
+
+    def __init__(self, *files: str):
+        self._uuids = {}
+        for fileloc in files:
+            if fileloc and os.path.isfile(fileloc):
+                self._load(fileloc)
+
+    def _load(self, fileloc: str):
+        try:
+            with open(fileloc, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except Exception as e:
+            logging.warning('Failed loading UUID cache {}: {}'.format(fileloc, e))
+            return
+        for entry in entries:
+            name, uid = entry.get('name'), entry.get('uuid')
+            if name and uid:
+                self._uuids[name.lower()] = (name, uid)
+
+    def get(self, name: str) -> (str, str):
+        """
+        Returns the cased name and the UUID of name or
+        (None, None) if it is not cached.
+        """
+        return self._uuids.get(name.lower()) or (None, None)
+
+
+def read_online_mode(server_dir: str) -> bool:
+    """
+    Reads the online-mode setting from the servers
+    'server.properties', which defaults to true.
+    """
+    fileloc = os.path.join(server_dir, 'server.properties')
+    if not os.path.isfile(fileloc):
+        return True
+    with open(fileloc, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, sep, value = line.partition('=')
+            if sep and key.strip() == 'online-mode':
+                return value.strip().lower() != 'false'
+    return True
+
+
+class WhitelistFile:
+    """
+    Direct access to the 'whitelist.json' of a server
+    for bulk operations. The file is always replaced
+    atomically by writing a temporary file next to it
+    and renaming it over the original.
+    """
+
+    _server_dir: str
+    _path: str
+    _uuid_cache_file: str
+    _lock: threading.Lock
+
+    def __init__(self, server_dir: str, uuid_cache_file: str = None):
+        self._server_dir = server_dir
+        self._path = os.path.join(server_dir, 'whitelist.json')
+        self._uuid_cache_file = uuid_cache_file
+        self._lock = threading.Lock()
+
+    def read(self) -> list:
+        if not os.path.isfile(self._path):
+            return []
+        with open(self._path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def names(self) -> set:
+        return set(e['name'].lower() for e in self.read() if e.get('name'))
+
+    def write(self, entries: list):
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.whitelist.', suffix='.json', dir=self._server_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entries, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            # mkstemp creates the file readable by the owner
+            # only, which the server may not run as.
+            try:
+                mode = stat.S_IMODE(os.stat(self._path).st_mode)
+            except FileNotFoundError:
+                mode = 0o644
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, self._path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def apply(self, plan: SyncPlan, cased_names: dict = None) -> SyncReport:
+        """
+        Applies the plan to the whitelist file. Existing
+        entries which are not removed by the plan are
+        kept as they are.
+
+        Added names are looked up in the UUID caches.
+        Names which are not cached get their offline
+        mode UUID, derived from their spelling in
+        cased_names (lower case name -> name), or are
+        skipped and reported as failed if the server
+        runs in online mode.
+        """
+        report = SyncReport()
+        cased_names = cased_names or {}
+
+        with self._lock:
+            cache = UUIDCache(
+                os.path.join(self._server_dir, 'usercache.json'),
+                self._uuid_cache_file)
+            online_mode = read_online_mode(self._server_dir)
+
+            to_remove = set(plan.to_remove)
+            entries = []
+            for entry in self.read():
+                name = (entry.get('name') or '').lower()
+                if name in to_remove:
+                    report.removed.append(name)
+                else:
+                    entries.append(entry)
+
+            for name in plan.to_add:
+                cased_name, uid = cache.get(name)
+                if uid is None and online_mode:
+                    logging.warning('Skipped adding {} to {}: no cached UUID in online mode'.format(
+                        name, self._path))
+                    report.failed.append((name, 'no cached UUID'))
+                    continue
+                if uid is None:
+                    cased_name = cased_names.get(name, name)
+                    uid = offline_uuid(cased_name)
+                entries.append({'uuid': uid, 'name': cased_name})
+                report.added.append(name)
+
+            self.write(entries)
+
+        report.finished = time.monotonic()
+        return report
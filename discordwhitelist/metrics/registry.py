@@ -0,0 +1,224 @@
+import time
+import bisect
+import threading
+from typing import Callable
+
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = None) -> str:
+    pairs = ['{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{{{}}}'.format(','.join(pairs)) if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class _Metric:
+
+    kind = None
+
+    name: str
+    help: str
+    labels: tuple
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, label_values: tuple) -> tuple:
+        if len(label_values) != len(self.labels):
+            raise ValueError('{} expects labels {}'.format(self.name, self.labels))
+        return tuple(str(v) for v in label_values)
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.kind),
+        ]
+        for suffix, label_values, extra, value in self._samples():
+            lines.append('{}{}{} {}'.format(
+                self.name, suffix,
+                _format_labels(self.labels, label_values, extra),
+                _format_value(value)))
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+
+    kind = 'counter'
+
+    def inc(self, *label_values, amount: float = 1):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list:
+        with self._lock:
+            return [('_total', k, None, v) for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+
+    kind = 'gauge'
+
+    _fns: dict
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super(Gauge, self).__init__(name, help, labels)
+        self._fns = {}
+
+    def set(self, value: float, *label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, fn: Callable, *label_values):
+        """
+        Sets a function which is called on exposition
+        and returns the current value of the gauge with
+        the given labels.
+        """
+        key = self._key(label_values)
+        with self._lock:
+            self._fns[key] = fn
+
+    def _samples(self) -> list:
+        with self._lock:
+            samples = [('', k, None, v) for k, v in self._values.items()]
+            fns = list(self._fns.items())
+        samples.extend(('', k, None, fn()) for k, fn in fns)
+        return samples
+
+
+class _Timer:
+
+    __slots__ = ('_hist', '_label_values', '_start')
+
+    def __init__(self, hist: 'Histogram', label_values: tuple):
+        self._hist = hist
+        self._label_values = label_values
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._start, *self._label_values)
+
+
+class Histogram(_Metric):
+
+    kind = 'histogram'
+
+    buckets: tuple
+
+    def __init__(self, name: str, help: str, labels: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values):
+        key = self._key(label_values)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self, *label_values) -> _Timer:
+        return _Timer(self, label_values)
+
+    def _samples(self) -> list:
+        samples = []
+        with self._lock:
+            items = [(k, list(v[0]), v[1], v[2]) for k, v in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float('inf'),), counts):
+                cumulative += c
+                samples.append((
+                    '_bucket', key, 'le="{}"'.format(_format_value(bound)), cumulative))
+            samples.append(('_sum', key, None, total))
+            samples.append(('_count', key, None, count))
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics exposed together. Registering
+    a metric with an already known name returns the
+    existing instance, so modules can be reloaded
+    without losing their metrics.
+    """
+
+    _metrics: dict
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, help: str, labels: tuple, **kwargs) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError('metric {} is already registered as {}'.format(
+                    name, metric.kind))
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(m.expose() for m in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: tuple = ()) -> Counter:
+    return REGISTRY.counter(name, help, labels)
+
+
+def gauge(name: str, help: str, labels: tuple = ()) -> Gauge:
+    return REGISTRY.gauge(name, help, labels)
+
+
+def histogram(name: str, help: str, labels: tuple = (),
+              buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, help, labels, buckets)
@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from .registry import Registry, REGISTRY
+
+
+_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server exposing the metrics of a
+    registry in the Prometheus text format on
+    GET /metrics.
+    """
+
+    _address: str
+    _port: int
+    _registry: Registry
+    _server: asyncio.AbstractServer
+
+    def __init__(self, address: str, port: int, registry: Registry = REGISTRY):
+        self._address = address
+        self._port = port
+        self._registry = registry
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(
+            self._handle, self._address, self._port)
+        logging.info('Serving metrics on http://{}:{}/metrics'.format(
+            self._address, self._port))
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b'\r\n', b'\n', b''):
+                pass
+
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', self._registry.expose()
+            else:
+                status, body = '404 Not Found', 'not found\n'
+
+            data = body.encode('utf-8')
+            writer.write((
+                'HTTP/1.1 {}\r\n'.format(status) +
+                'Content-Type: {}\r\n'.format(_CONTENT_TYPE) +
+                'Content-Length: {}\r\n'.format(len(data)) +
+                'Connection: close\r\n\r\n').encode('latin-1') + data)
+            await writer.drain()
+        except Exception as e:
+            logging.debug('Failed serving metrics request: {}'.format(e))
+        finally:
+            writer.close()
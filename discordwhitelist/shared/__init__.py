@@ -1,2 +1,6 @@
 # flake8: noqa
 from .shared import *
+from .startup import *
+from .pagination import *
+from .batching import *
+from .progress import *
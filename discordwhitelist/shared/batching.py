@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Callable
+
+
+class Batcher:
+    """
+    Collects items added within window seconds after
+    the first one and passes them to the coroutine
+    function flush as one list. Reaching max_size
+    items flushes immediately. Items added while a
+    flush is running go into the next batch.
+    """
+
+    _flush: Callable
+    _window: float
+    _max_size: int
+    _items: list
+    _timer: asyncio.TimerHandle
+    _tasks: set
+
+    def __init__(self, flush: Callable, window: float = 1.0, max_size: int = 1000):
+        self._flush = flush
+        self._window = window
+        self._max_size = max_size
+        self._items = []
+        self._timer = None
+        self._tasks = set()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def add(self, item):
+        self._items.append(item)
+        if len(self._items) >= self._max_size:
+            self._schedule(0)
+        elif self._timer is None:
+            self._schedule(self._window)
+
+    def _schedule(self, delay: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_event_loop().call_later(delay, self._start_run)
+
+    def _start_run(self):
+        task = asyncio.ensure_future(self._run())
+        self._tasks.add(task)
+        task.add_done_callback(self._run_done)
+
+    def _run_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('Failed running batch flush: {}'.format(task.exception()))
+
+    async def _run(self):
+        items = self._items
+        self._items = []
+        self._timer = None
+        if not items:
+            return
+        try:
+            await self._flush(items)
+        except Exception as e:
+            logging.error('Failed flushing batch of {} items: {}'.format(len(items), e))
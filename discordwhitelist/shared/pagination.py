@@ -0,0 +1,55 @@
+import asyncio
+import logging
+from typing import Callable
+from discord import Embed, Message, HTTPException, Object
+from discord.ext.commands import Context
+
+
+PAGE_PREV = '◀'
+PAGE_NEXT = '▶'
+
+
+async def paginate(ctx: Context, msg: Message, prev_page: Callable,
+                   next_page: Callable, timeout: float = 120):
+    """
+    Lets the author of the command browse the pages
+    displayed in msg by reacting with the arrow
+    emojis. prev_page and next_page are coroutine
+    functions returning the embed of the adjacent page
+    or None if there is none. Navigation ends after
+    timeout seconds without a reaction. Reactions are
+    received as raw events, so msg does not need to be
+    in the message cache.
+    """
+    try:
+        await msg.add_reaction(PAGE_PREV)
+        await msg.add_reaction(PAGE_NEXT)
+    except HTTPException as e:
+        logging.debug('Failed adding page reactions: {}'.format(e))
+        return
+
+    def check(payload) -> bool:
+        return payload.message_id == msg.id and payload.user_id == ctx.author.id and \
+            str(payload.emoji) in (PAGE_PREV, PAGE_NEXT)
+
+    while True:
+        try:
+            payload = await ctx.bot.wait_for(
+                'raw_reaction_add', check=check, timeout=timeout)
+        except asyncio.TimeoutError:
+            break
+
+        fn = prev_page if str(payload.emoji) == PAGE_PREV else next_page
+        em: Embed = await fn()
+        if em is not None:
+            await msg.edit(embed=em)
+
+        try:
+            await msg.remove_reaction(payload.emoji, Object(payload.user_id))
+        except HTTPException:
+            pass
+
+    try:
+        await msg.clear_reactions()
+    except HTTPException:
+        pass
@@ -0,0 +1,131 @@
+import time
+import asyncio
+import logging
+from discord import Message
+from discord.ext.commands import Context
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '{}h {:02d}m'.format(seconds // 3600, seconds % 3600 // 60)
+    if seconds >= 60:
+        return '{}m {:02d}s'.format(seconds // 60, seconds % 60)
+    return '{}s'.format(seconds)
+
+
+class ProgressReporter:
+    """
+    Reports the progress of a long running operation
+    in a message which is edited at most once every
+    interval seconds in the background, so updates
+    never wait for Discord. The message shows the rate
+    and the estimated time left.
+
+    Used as async context manager, the message is
+    always finalized, with the error if the operation
+    raised. Operations should check cancelled and
+    stop early once cancel was called.
+    """
+
+    _ctx: Context
+    _verb: str
+    _total: int
+    _unit: str
+    _interval: float
+    _started: float
+    _done: int
+    _cancelled: bool
+    _finished: bool
+    _changed: asyncio.Event
+    _task: asyncio.Task
+
+    msg: Message
+
+    def __init__(self, ctx: Context, verb: str, total: int, unit: str = 'entries',
+                 interval: float = 3.0):
+        self._ctx = ctx
+        self._verb = verb
+        self._total = total
+        self._unit = unit
+        self._interval = interval
+        self._started = time.monotonic()
+        self._done = 0
+        self._cancelled = False
+        self._finished = False
+        self._changed = asyncio.Event()
+        self._task = None
+        self.msg = None
+
+    @property
+    def done(self) -> int:
+        return self._done
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    async def __aenter__(self) -> 'ProgressReporter':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is not None and not self._finished:
+            await self.finish(':warning:  Failed after {} of {} {}: `{}`'.format(
+                self._done, self._total, self._unit, exc or exc_type.__name__))
+        elif not self._finished:
+            # The final message shows neither rate nor
+            # time left.
+            self._finished = True
+            await self.finish(self.render(':white_check_mark:'))
+        return False
+
+    async def start(self):
+        self._started = time.monotonic()
+        self.msg = await self._ctx.send(self.render(':clock1:'))
+        self._task = asyncio.ensure_future(self._run())
+
+    def update(self, done: int):
+        self._done = done
+        self._changed.set()
+
+    def cancel(self):
+        self._cancelled = True
+        self._changed.set()
+
+    async def finish(self, content: str):
+        """
+        Stops the periodic edits and replaces the
+        message with content, sending it as a new
+        message if the edit fails.
+        """
+        self._finished = True
+        if self._task is not None:
+            self._task.cancel()
+        try:
+            await self.msg.edit(content=content)
+        except Exception as e:
+            logging.warning('Failed finalizing progress message: {}'.format(e))
+            await self._ctx.send(content)
+
+    def render(self, icon: str) -> str:
+        content = '{}  {} {} of {} {}'.format(
+            icon, self._verb, self._done, self._total, self._unit)
+        elapsed = time.monotonic() - self._started
+        if self._done and elapsed > 0 and not self._finished:
+            rate = self._done / elapsed
+            content += ' ({:.1f}/s, {} left)'.format(
+                rate, format_duration((self._total - self._done) / rate))
+        if self._cancelled:
+            content += ', cancelled' if self._finished else ', cancelling...'
+        return content
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            try:
+                await self.msg.edit(content=self.render(':clock1:'))
+            except Exception as e:
+                logging.warning('Failed updating progress message: {}'.format(e))
+            await asyncio.sleep(self._interval)
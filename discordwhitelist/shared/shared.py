@@ -1,17 +1,58 @@
+import re
 from discord.ext.commands import Context
 
 
 EMBED_COLOR = 0xf90261
+MAX_MESSAGE_LEN = 2000
+
+_MENTION_RE = re.compile(r'^<@!?(\d+)>$|^(\d{15,22})$')
 
 
 def lower(arg: str) -> str:
     return arg.lower()
 
 
+def mentioned_id(arg: str) -> str:
+    """
+    Returns the discord id of a user mention or a raw
+    user id or None if arg is neither.
+    """
+    match = _MENTION_RE.match(arg) if arg else None
+    return match and (match.group(1) or match.group(2))
+
+
+def truncate(text: str, limit: int = MAX_MESSAGE_LEN, suffix: str = '') -> str:
+    if len(text) <= limit:
+        return text
+    return text[:limit - len(suffix) - 3] + '...' + suffix
+
+
+def server_output(results: dict) -> list:
+    """
+    Flattens the per server results of a fan-out into
+    output lines prefixed with the server name.
+    """
+    op = []
+    for name, res in results.items():
+        if isinstance(res, Exception):
+            op.append('[{}] error: {}'.format(name, res))
+        else:
+            op.extend('[{}] {}'.format(name, r) for r in res)
+    return op
+
+
 def is_verbose(argv: list) -> bool:
     return '-v' in argv or '--verbose' in argv
 
 
+def is_dry_run(argv: list) -> bool:
+    return '--dry-run' in argv
+
+
+def is_bulk(argv: list) -> bool:
+    return '--bulk' in argv
+
+
 async def verbose_output(ctx: Context, argv: list, op: list):
     if is_verbose(argv) and op:
         await ctx.send(
@@ -0,0 +1,60 @@
+import time
+import logging
+import metrics
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+_STARTUP_DURATION = metrics.gauge(
+    'startup_duration_seconds',
+    'Duration of the startup phases and the total time until the ' +
+    'first status update', ('phase',))
+
+
+class StartupTimer:
+    """
+    Records the durations of the startup phases, which
+    may overlap, and reports them together with the
+    total time since started once startup finished.
+    """
+
+    _started: float
+    _running: dict
+    _phases: OrderedDict
+    _finished: bool
+
+    def __init__(self, started: float = None):
+        self._started = started if started is not None else time.perf_counter()
+        self._running = {}
+        self._phases = OrderedDict()
+        self._finished = False
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def start(self, phase: str, at: float = None):
+        self._running[phase] = at if at is not None else time.perf_counter()
+
+    def stop(self, phase: str):
+        started = self._running.pop(phase, None)
+        if started is not None and phase not in self._phases:
+            self._phases[phase] = time.perf_counter() - started
+            _STARTUP_DURATION.set(self._phases[phase], phase)
+
+    @contextmanager
+    def phase(self, phase: str):
+        self.start(phase)
+        try:
+            yield
+        finally:
+            self.stop(phase)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        total = time.perf_counter() - self._started
+        _STARTUP_DURATION.set(total, 'total')
+        logging.info('Startup finished in {:.2f}s ({})'.format(total, ', '.join(
+            '{} {:.2f}s'.format(p, d) for p, d in self._phases.items())))
@@ -0,0 +1,4 @@
+# flake8: noqa
+from .updater import *
+from .interval import *
+from .history import *
@@ -0,0 +1,184 @@
+import time
+import asyncio
+import logging
+import metrics
+from mcserver import ServerRegistry
+
+
+_DAY = 86400
+
+_HISTORY_FLUSHED = metrics.counter(
+    'player_history_flushed_sessions',
+    'Closed player sessions written to the database')
+_HISTORY_OPEN = metrics.gauge(
+    'player_history_open_sessions',
+    'Currently open player sessions on all servers')
+
+
+def day_of(ts: float) -> int:
+    """
+    Returns the UTC day number of the unix time ts,
+    as used by the playtime rollups.
+    """
+    return int(ts // _DAY)
+
+
+class PlayerHistory:
+    """
+    Derives play sessions from consecutive player lists
+    of the servers and writes them to the database in
+    batches every flush_interval seconds.
+
+    Observing a player list only diffs it against the
+    previous one of the server. Playtime is aggregated
+    in memory per day, server and player until the
+    next flush, which also accounts the time of open
+    sessions so far, so at most flush_interval seconds
+    of playtime are lost on a restart. Sessions on a
+    server whose player list could not be fetched end
+    with its last observed list. History older than
+    retention_days is pruned.
+    """
+
+    _servers: ServerRegistry
+    _flush_interval: float
+    _retention: float
+    _online: dict
+    _sessions: list
+    _playtime: dict
+    _seen: dict
+    _observed: dict
+    _pruned: float
+
+    def __init__(self, servers: ServerRegistry, db, flush_interval: float = 60.0,
+                 retention_days: int = 90):
+        self._servers = servers
+        self._db = db
+        self._flush_interval = flush_interval
+        self._retention = retention_days * _DAY
+        # server id -> mc id -> [joined, accounted until]
+        self._online = {}
+        self._sessions = []
+        self._playtime = {}
+        self._seen = {}
+        # server id -> time of the last observed player list
+        self._observed = {}
+        self._pruned = 0.0
+        _HISTORY_OPEN.set_function(lambda: sum(len(o) for o in self._online.values()))
+
+    def online_since(self, mc_id: str) -> (str, float):
+        """
+        Returns the name of the server the player is
+        currently online on and the join time or
+        (None, None).
+        """
+        mc_id = mc_id.lower()
+        for server in self._servers:
+            session = self._online.get(server.id, {}).get(mc_id)
+            if session is not None:
+                return server.name, session[0]
+        return None, None
+
+    def observe(self, players: dict, now: float = None):
+        """
+        Opens and closes the sessions of the players
+        which joined or left since the last observed
+        player lists, given by server name. The sessions
+        on servers whose list could not be fetched are
+        closed, as their players can not be observed.
+        """
+        now = now if now is not None else time.time()
+        for name, res in players.items():
+            server = self._servers.get(name)
+            if server is None or server.id is None:
+                continue
+            if isinstance(res, Exception):
+                self.close(server.id, self._observed.get(server.id, now))
+                continue
+            self._observed[server.id] = now
+
+            online = self._online.setdefault(server.id, {})
+            current = set(res.names)
+            if len(current) == len(online) and current.issuperset(online):
+                continue
+
+            for mc_id in current.difference(online):
+                online[mc_id] = [now, now]
+                self._add_playtime(server.id, mc_id, now, now, sessions=1)
+            for mc_id in set(online).difference(current):
+                joined, accounted = online.pop(mc_id)
+                self._add_playtime(server.id, mc_id, accounted, now)
+                self._sessions.append((server.id, mc_id, int(joined), int(now)))
+                self._seen[mc_id] = (server.id, int(now))
+
+    def close(self, server_id: int, now: float = None):
+        """
+        Closes the open sessions of a server which is
+        unreachable or no longer managed at now, or when
+        they were last accounted if that is later.
+        """
+        now = now if now is not None else time.time()
+        for mc_id, (joined, accounted) in self._online.pop(server_id, {}).items():
+            left = max(now, accounted)
+            self._add_playtime(server_id, mc_id, accounted, left)
+            self._sessions.append((server_id, mc_id, int(joined), int(left)))
+            self._seen[mc_id] = (server_id, int(left))
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            await self.flush()
+
+            if self._retention > 0 and time.time() - self._pruned >= 3600:
+                self._pruned = time.time()
+                try:
+                    await self._db.prune_player_history(int(self._pruned - self._retention))
+                except Exception as e:
+                    logging.error('Failed pruning player history: {}'.format(e))
+
+    async def flush(self, now: float = None):
+        now = now if now is not None else time.time()
+        for server_id, online in self._online.items():
+            for mc_id, session in online.items():
+                self._add_playtime(server_id, mc_id, session[1], now)
+                session[1] = now
+                self._seen[mc_id] = (server_id, int(now))
+
+        sessions, playtime, seen = self._sessions, self._playtime, self._seen
+        if not sessions and not playtime and not seen:
+            return
+        self._sessions, self._playtime, self._seen = [], {}, {}
+
+        try:
+            await self._db.add_player_history(
+                sessions,
+                [k + (int(round(v[0])), v[1]) for k, v in playtime.items()],
+                [(mc_id, server_id, ts) for mc_id, (server_id, ts) in seen.items()])
+        except Exception as e:
+            logging.error('Failed writing player history: {}'.format(e))
+            # Keep the batch for the next flush, merged with
+            # whatever was observed in the meantime.
+            self._sessions = sessions + self._sessions
+            for key, (seconds, n) in playtime.items():
+                entry = self._playtime.setdefault(key, [0.0, 0])
+                entry[0] += seconds
+                entry[1] += n
+            for mc_id, last in seen.items():
+                self._seen.setdefault(mc_id, last)
+            return
+
+        _HISTORY_FLUSHED.inc(amount=len(sessions))
+
+    def _add_playtime(self, server_id: int, mc_id: str, start: float, end: float,
+                      sessions: int = 0):
+        # Sessions across midnight are split between the
+        # rollups of both days.
+        while True:
+            day = day_of(start)
+            stop = min(end, (day + 1) * _DAY)
+            entry = self._playtime.setdefault((day, server_id, mc_id), [0.0, 0])
+            entry[0] += stop - start
+            entry[1] += sessions
+            if stop >= end:
+                return
+            start, sessions = stop, 0
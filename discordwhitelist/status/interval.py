@@ -0,0 +1,44 @@
+import random
+
+
+class AdaptiveInterval:
+    """
+    Chooses the interval of the status poll loop.
+
+    The interval drops to min_interval whenever the
+    polled state has changed and grows by factor after
+    each poll with an unchanged state, up to
+    max_interval. After failed polls, a jittered
+    exponential backoff starting at min_interval and
+    capped at max_interval is used instead.
+    """
+
+    _min: float
+    _max: float
+    _factor: float
+    _errors: int
+
+    current: float
+
+    def __init__(self, min_interval: float, max_interval: float, factor: float = 1.5):
+        self._min = min_interval
+        self._max = max(min_interval, max_interval)
+        self._factor = factor
+        self._errors = 0
+        self.current = min_interval
+
+    def changed(self) -> float:
+        self._errors = 0
+        self.current = self._min
+        return self.current
+
+    def stable(self) -> float:
+        self._errors = 0
+        self.current = min(self._max, self.current * self._factor)
+        return self.current
+
+    def failed(self) -> float:
+        self._errors += 1
+        ceiling = min(self._max, self._min * (2 ** self._errors))
+        self.current = random.uniform(ceiling / 2, ceiling)
+        return self.current
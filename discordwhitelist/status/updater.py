@@ -0,0 +1,188 @@
+import json
+import asyncio
+import hashlib
+import logging
+import discord
+import metrics
+from discord.ext import commands
+from database import AsyncSQLite
+from mcserver import PlayerList
+from shared import truncate, EMBED_COLOR
+
+
+_DISCORD_LATENCY = metrics.histogram(
+    'discord_request_duration_seconds',
+    'Duration of Discord API requests by the status updater', ('method',))
+_SKIPPED = metrics.counter(
+    'status_skipped_updates',
+    'Status message edits and presence changes skipped as unchanged', ('kind',))
+_GUILD_ERRORS = metrics.counter(
+    'status_guild_errors',
+    'Failed status message updates')
+
+
+_MAX_FIELD_LEN = 1024
+
+
+async def _player_lines(players: PlayerList, db: AsyncSQLite) -> str:
+    player_list = []
+
+    if players.names:
+        for name in players.names:
+            dc_id, _ = await db.get_whitelist_by_mc_id(name)
+            d_name = '`{}`'.format(name)
+            if dc_id:
+                d_name += ' (<@{}>)'.format(dc_id)
+            player_list.append(d_name)
+    else:
+        player_list = ['*no players online*']
+
+    return truncate('\n'.join(player_list), _MAX_FIELD_LEN)
+
+
+def total_players(players: dict) -> (int, int):
+    """
+    Returns the sum of online players and slots of all
+    servers which could be queried.
+    """
+    online = [p for p in players.values() if isinstance(p, PlayerList)]
+    return sum(p.online for p in online), sum(p.slots for p in online)
+
+
+async def get_status_message(players: dict, db: AsyncSQLite) -> discord.Embed:
+    """
+    Renders the status embed from the player lists
+    (or the exceptions raised fetching them) by server
+    name. A single server is displayed with one
+    'Online Players' field, multiple servers with one
+    field per server.
+    """
+    em = discord.Embed()
+    em.color = EMBED_COLOR
+    em.title = 'Server Status'
+    online, slots = total_players(players)
+    em.description = '**{}** / **{}** players are online.'.format(online, slots)
+
+    if len(players) == 1:
+        res = next(iter(players.values()))
+        value = await _player_lines(res, db) if isinstance(res, PlayerList) \
+            else '*server is offline*'
+        em.add_field(name='Online Players', value=value, inline=False)
+        return em
+
+    for name, res in players.items():
+        if isinstance(res, PlayerList):
+            em.add_field(
+                name='{} ({}/{})'.format(name, res.online, res.slots),
+                value=await _player_lines(res, db), inline=False)
+        else:
+            em.add_field(name=name, value='*server is offline*', inline=False)
+
+    return em
+
+
+def embed_digest(em: discord.Embed) -> str:
+    return hashlib.sha1(
+        json.dumps(em.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class StatusUpdater:
+    """
+    Keeps the presence of the bot and the status
+    messages of all guilds up to date.
+
+    The status embed is rendered once per update and
+    shared across all guilds, which are updated
+    concurrently with at most concurrency requests in
+    flight. Messages whose last sent embed has the same
+    digest are not edited again and the presence is
+    only changed when the player count has changed.
+    """
+
+    _bot: commands.Bot
+    _db: AsyncSQLite
+    _concurrency: int
+    _messages: dict
+    _digests: dict
+    _presence: tuple
+
+    def __init__(self, bot: commands.Bot, db: AsyncSQLite, concurrency: int = 20):
+        self._bot = bot
+        self._db = db
+        self._concurrency = concurrency
+        self._messages = {}
+        self._digests = {}
+        self._presence = None
+
+    async def update(self, players: dict):
+        """
+        Updates presence and status messages from the
+        player lists (or fetch exceptions) by server name.
+        """
+        await self._update_presence(*total_players(players))
+
+        em = await get_status_message(players, self._db)
+        digest = embed_digest(em)
+        sem = asyncio.Semaphore(self._concurrency)
+
+        guilds = list(self._bot.guilds)
+        results = await asyncio.gather(
+            *[self._update_guild(guild, em, digest, sem) for guild in guilds],
+            return_exceptions=True)
+
+        for guild, res in zip(guilds, results):
+            if isinstance(res, Exception):
+                _GUILD_ERRORS.inc()
+                logging.error('Failed updating status message of guild {}: {}'.format(
+                    guild.id, res))
+
+    async def _update_presence(self, online: int, slots: int):
+        if self._presence == (online, slots):
+            _SKIPPED.inc('presence')
+            return
+        activity = discord.Game('{}/{} online'.format(online, slots))
+        with _DISCORD_LATENCY.time('change_presence'):
+            await self._bot.change_presence(activity=activity, status=discord.Status.online)
+        self._presence = (online, slots)
+
+    async def _update_guild(self, guild: discord.Guild, em: discord.Embed,
+                            digest: str, sem: asyncio.Semaphore):
+        cfg = await self._db.get_guild_config(guild.id)
+        chan_id = cfg.status_channel_id
+        if not chan_id:
+            return
+
+        chan: discord.TextChannel = guild.get_channel(int(chan_id))
+        if not chan:
+            await self._db.set_status_channel(guild.id, '')
+            return
+
+        status_msg = self._messages.get(guild.id)
+        if status_msg is not None and status_msg.channel.id != chan.id:
+            status_msg = None
+
+        if status_msg is not None and self._digests.get(guild.id) == digest:
+            _SKIPPED.inc('edit')
+            return
+
+        if status_msg is None and cfg.status_message_id:
+            # Known status messages are edited through a partial
+            # message handle instead of being fetched first. If the
+            # message was deleted, the edit fails and it is resent.
+            status_msg = chan.get_partial_message(int(cfg.status_message_id))
+
+        async with sem:
+            if status_msg is not None:
+                try:
+                    with _DISCORD_LATENCY.time('edit'):
+                        await status_msg.edit(embed=em)
+                except discord.NotFound:
+                    status_msg = None
+
+            if status_msg is None:
+                with _DISCORD_LATENCY.time('send'):
+                    status_msg = await chan.send(embed=em)
+                await self._db.set_status_message(guild.id, status_msg.id)
+
+        self._messages[guild.id] = status_msg
+        self._digests[guild.id] = digest